@@ -0,0 +1,206 @@
+# adjust_factors.py
+# -*- encoding: UTF-8 -*-
+"""
+Per-stock price adjustment factors for the raw (unadjusted) history store.
+
+The store keeps the bars exactly as traded; qfq/hfq prices are derived at load time
+from Sina's cumulative hfq factor (`ak.stock_zh_a_daily(adjust="hfq-factor")`):
+
+    hfq price = raw price * hfq_factor(as of the bar's date)
+    qfq price = hfq price / latest hfq_factor
+
+Factors only change on ex-rights days, so they are stored once per stock in
+`{cache_dir}/adjust_factors.sqlite` and refetched only for stocks flagged with
+`request_refresh()` (a corporate action was detected) or never fetched yet.
+"""
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+
+import akshare as ak
+import numpy as np
+import pandas as pd
+
+import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+FACTOR_FILE = "adjust_factors.sqlite"
+FACTOR_COLUMN = 'hfq_factor'
+# Adjustment modes; RAW_ADJUST is what the history store holds
+RAW_ADJUST = 'none'
+ADJUST_MODES = (RAW_ADJUST, 'qfq', 'hfq')
+PRICE_COLUMNS = ['开盘', '收盘', '最高', '最低']
+
+_DATE_FORMAT = '%Y-%m-%d'
+
+
+def exchange_symbol(code):
+    """'600000' -> 'sh600000' (Sina symbol)."""
+    code = str(code).zfill(6)
+    if code.startswith(('6', '9')):
+        return f"sh{code}"
+    if code.startswith(('4', '8')):
+        return f"bj{code}"
+    return f"sz{code}"
+
+
+def download_factors(code):
+    """Full hfq factor history of one stock as a DataFrame (日期, hfq_factor), oldest first."""
+    df = rate_limiter.call('factor', ak.stock_zh_a_daily, symbol=exchange_symbol(code), adjust="hfq-factor")
+    if df is None or df.empty:
+        return pd.DataFrame(columns=['日期', FACTOR_COLUMN])
+    factors = pd.DataFrame({'日期': pd.to_datetime(df['date']),
+                            FACTOR_COLUMN: pd.to_numeric(df[FACTOR_COLUMN], errors='coerce')})
+    return factors.dropna().sort_values('日期').reset_index(drop=True)
+
+
+class FactorStore:
+    """SQLite table of hfq factors per stock, plus which stocks need a refetch."""
+
+    def __init__(self, cache_dir="stock_data_cache"):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, FACTOR_FILE)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS factors (
+                    code TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    hfq_factor REAL NOT NULL,
+                    PRIMARY KEY (code, date)
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS factor_status (
+                    code TEXT PRIMARY KEY,
+                    fetched_at TEXT,
+                    needs_refresh INTEGER NOT NULL DEFAULT 0
+                )""")
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def load(self, codes=None):
+        """Factors of `codes` (all if None) as a long DataFrame (股票代码, 日期, hfq_factor)."""
+        query = "SELECT code AS 股票代码, date AS 日期, hfq_factor FROM factors"
+        params = ()
+        if codes is not None:
+            codes = [str(c) for c in codes]
+            query += f" WHERE code IN ({','.join('?' * len(codes))})"
+            params = tuple(codes)
+        with self._lock:
+            df = pd.read_sql_query(query + " ORDER BY code, date", self._connect(), params=params)
+        df['日期'] = pd.to_datetime(df['日期']).astype('datetime64[ns]')
+        return df
+
+    def replace(self, code, factors):
+        """Replaces the factor history of one stock in a single transaction."""
+        rows = [(str(code), pd.Timestamp(d).strftime(_DATE_FORMAT), float(f))
+                for d, f in zip(factors['日期'], factors[FACTOR_COLUMN])]
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM factors WHERE code = ?", (str(code),))
+                conn.executemany("INSERT INTO factors (code, date, hfq_factor) VALUES (?, ?, ?)", rows)
+                conn.execute("INSERT OR REPLACE INTO factor_status (code, fetched_at, needs_refresh) VALUES (?, ?, 0)",
+                             (str(code), now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def request_refresh(self, codes):
+        """Flags stocks whose factors changed (corporate action seen) for a refetch."""
+        codes = [(str(c),) for c in codes]
+        if not codes:
+            return
+        with self._lock:
+            self._connect().executemany(
+                "INSERT INTO factor_status (code, needs_refresh) VALUES (?, 1) "
+                "ON CONFLICT(code) DO UPDATE SET needs_refresh = 1", codes)
+
+    def codes_to_refresh(self, codes):
+        """Subset of `codes` never fetched or flagged by request_refresh()."""
+        codes = [str(c) for c in codes]
+        with self._lock:
+            done = {row[0] for row in self._connect().execute(
+                "SELECT code FROM factor_status WHERE needs_refresh = 0 AND fetched_at IS NOT NULL")}
+        return {code for code in codes if code not in done}
+
+    def refresh(self, codes):
+        """Downloads and stores factors of `codes`; returns the codes that were updated."""
+        updated = set()
+        for code in codes:
+            try:
+                factors = download_factors(code)
+            except Exception as e:
+                logger.warning(f"获取 {code} 复权因子失败: {e}", extra={'stock': code, 'strategy': '复权因子'})
+                continue
+            self.replace(code, factors)
+            updated.add(str(code))
+        if updated:
+            logger.info(f"已更新 {len(updated)} 只股票的复权因子。", extra={'stock': 'NONE', 'strategy': '复权因子'})
+        return updated
+
+
+def factors_for_rows(df, factors, code_column='股票代码', date_column='日期'):
+    """
+    hfq factor in effect on every row of the long bar frame `df` (aligned with its rows).
+    Rows before a stock's first factor take that first factor; stocks without factors get 1.0.
+    """
+    if df.empty:
+        return np.ones(0)
+    codes = df[code_column].astype(str).to_numpy()
+    if factors is None or factors.empty:
+        return np.ones(len(df))
+
+    dates = pd.to_datetime(df[date_column]).astype('datetime64[ns]').to_numpy()
+    order = np.argsort(dates, kind='stable')
+    keys = pd.DataFrame({code_column: codes[order], date_column: dates[order]})
+    right = factors[[code_column, date_column, FACTOR_COLUMN]].sort_values(date_column, kind='stable')
+    matched = pd.merge_asof(keys, right, on=date_column, by=code_column, direction='backward')[FACTOR_COLUMN].to_numpy()
+
+    factor = np.empty(len(df))
+    factor[order] = matched
+    missing = np.isnan(factor)
+    if missing.any():
+        first = right.groupby(code_column)[FACTOR_COLUMN].first()
+        factor[missing] = pd.Series(codes[missing]).map(first).fillna(1.0).to_numpy()
+    return factor
+
+
+def apply_adjustment(df, factors, adjust, inverse=False):
+    """
+    Returns `df` (raw bars, long or single-stock with 股票代码) with prices converted to
+    `adjust` ('qfq'/'hfq'; RAW_ADJUST or None leaves it unchanged). With `inverse=True`
+    adjusted prices are converted back to raw ones. Volume is never adjusted.
+    """
+    if adjust in (None, RAW_ADJUST) or df is None or df.empty:
+        return df
+    if adjust not in ADJUST_MODES:
+        raise ValueError(f"不支持的复权方式: {adjust}")
+    factor = factors_for_rows(df, factors)
+    if adjust == 'qfq' and factors is not None and not factors.empty:
+        latest = factors.sort_values('日期', kind='stable').groupby('股票代码')[FACTOR_COLUMN].last()
+        factor = factor / df['股票代码'].astype(str).map(latest).fillna(1.0).to_numpy()
+    if inverse:
+        factor = 1.0 / factor
+
+    df = df.copy()
+    columns = [c for c in PRICE_COLUMNS if c in df.columns]
+    df[columns] = df[columns].to_numpy(dtype=np.float64) * factor[:, None]
+    return df
@@ -0,0 +1,408 @@
+# benchmark.py
+# -*- encoding: UTF-8 -*-
+"""
+Benchmarks on a deterministic synthetic market, stored as JSON for comparing commits.
+
+    python benchmark.py --stocks 200 --days 500 --output bench.json [--compare previous.json]
+
+synthetic_market() generates raw daily bars in the history store's schema (股票代码 +
+BAR_COLUMNS) with configurable limit-up frequency and suspensions (missing sessions);
+write_cache() puts them into a cache directory together with a trading calendar and
+flat adjustment factors, so data_fetcher_new serves every stock from the cache
+without any network call. The suite times:
+
+    cache_load             data_fetcher_new.run() of all stocks from the cache
+    strategy.<module.func> every per-stock check of the strategy package, each stock once
+    universe.<module.func> the check_universe forms over one MarketPanel
+    backtest.new_limit_up  new_limit_up.backtest over the whole history of each stock
+    process                work_flow_new.process() end to end with the named strategies
+    replay                 with --replay DIR: work_flow_new.prepare() replayed from a run
+                           recorded by replay.py, optionally with --replay-latency per stock
+
+The strategies run with the DEFAULT_STRATEGY_CONFIG of their modules. Per-stock timings
+are reported as total, mean and p95 per stock; a strategy check that raises counts as an
+error of its result, and the run exits with 1 if any benchmark had errors. --compare
+prints the ratio to an earlier result file and exits with 1 if a benchmark got slower
+than --threshold times its previous time.
+"""
+import argparse
+import datetime
+import importlib
+import json
+import logging
+import os
+import pkgutil
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import feature_store
+import settings
+import trading_calendar
+from adjust_factors import FACTOR_COLUMN, RAW_ADJUST, FactorStore
+from history_store import BAR_COLUMNS, CODE_COLUMN, HistoryStore, split_by_stock
+
+logger = logging.getLogger(__name__)
+
+# work_flow_new.process() streams history from data_fetcher_new's default start date on;
+# stocks whose cache starts later are stale and would be downloaded
+PROCESS_HISTORY_START = pd.Timestamp('2025-01-01')
+# Helper modules of the strategy package that hold no strategy
+NON_STRATEGY_MODULES = {'context', 'kernels'}
+DEFAULT_THRESHOLD = 1.2
+
+
+def weekday_sessions():
+    """Mon-Fri sessions through the end of the current year, as the offline trading calendar."""
+    return pd.bdate_range('2000-01-03', datetime.date(datetime.date.today().year, 12, 31))
+
+
+def synthetic_market(n_stocks=200, n_days=500, limit_up_rate=0.02, suspension_rate=0.002, seed=0, end=None):
+    """
+    Raw daily bars of `n_stocks` stocks over the `n_days` sessions ending at `end` (default:
+    the last completed session of a Mon-Fri calendar) as one long frame in the history
+    store's schema. A stock closes limit up (+10%) on a `limit_up_rate` share of days and
+    starts a 1-20 session suspension on a `suspension_rate` share; the last session is
+    never suspended, so every stock is up to date.
+    """
+    rng = np.random.default_rng(seed)
+    sessions = weekday_sessions()
+    if end is None:
+        end = trading_calendar.TradingCalendar(sessions.values).last_completed_session()
+    sessions = sessions[sessions <= pd.Timestamp(end)][-n_days:]
+    frames = []
+    for i in range(n_stocks):
+        code = f"{600000 + i:06d}" if i % 2 == 0 else f"{i:06d}"
+        returns = np.clip(rng.normal(0.0005, 0.02, n_days), -0.095, 0.095)
+        limit_up = rng.random(n_days) < limit_up_rate
+        returns[limit_up] = 0.1
+        close = np.round(rng.uniform(5, 50) * np.cumprod(1 + returns), 2)
+        open_ = np.round(close / (1 + returns) * (1 + rng.normal(0, 0.01, n_days)), 2)
+        high = np.round(np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, n_days))), 2)
+        low = np.round(np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, n_days))), 2)
+        volume = np.round(rng.lognormal(11, 0.5, n_days) * np.where(limit_up, 3, 1))
+        float_shares = rng.uniform(1e6, 2e7)  # in 手
+        traded = np.ones(n_days, dtype=bool)
+        for start in np.flatnonzero(rng.random(n_days - 1) < suspension_rate):
+            traded[start:min(start + int(rng.integers(1, 21)), n_days - 1)] = False
+        frames.append(pd.DataFrame({
+            CODE_COLUMN: code, '日期': sessions[traded], '开盘': open_[traded], '收盘': close[traded],
+            '最高': high[traded], '最低': low[traded], '成交量': volume[traded],
+            '成交额': np.round(close * volume * 100, 2)[traded], '换手率': np.round(volume / float_shares * 100, 2)[traded],
+        }))
+    return pd.concat(frames, ignore_index=True)[[CODE_COLUMN] + BAR_COLUMNS]
+
+
+def stock_names(bars):
+    """[(code, name)] of the stocks in `bars`."""
+    return [(code, f"合成{code}") for code in bars[CODE_COLUMN].unique()]
+
+
+def strategy_frames(bars):
+    """{(code, name): frame} with the derived columns the strategies read (涨跌幅, p_change)."""
+    frames = {}
+    for code, frame in split_by_stock(bars).items():
+        frame = frame.drop(columns=[CODE_COLUMN]).reset_index(drop=True)
+        frame['涨跌幅'] = frame['收盘'].pct_change() * 100
+        frame['p_change'] = frame['涨跌幅']
+        frames[(code, f"合成{code}")] = frame
+    return frames
+
+
+def write_cache(cache_dir, bars):
+    """Writes `bars`, a Mon-Fri trading calendar and flat hfq factors (1.0) into `cache_dir`."""
+    os.makedirs(cache_dir, exist_ok=True)
+    pd.DataFrame({'trade_date': weekday_sessions()}).to_parquet(
+        os.path.join(cache_dir, trading_calendar.CALENDAR_FILE), index=False)
+    HistoryStore(cache_dir).append(bars)
+    factors = FactorStore(cache_dir)
+    for code, first_date in bars.groupby(CODE_COLUMN)['日期'].min().items():
+        factors.replace(code, pd.DataFrame({'日期': [first_date], FACTOR_COLUMN: [1.0]}))
+    factors.close()
+
+
+def strategy_checks():
+    """{'module.function': per-stock check} of every strategy module."""
+    import strategy
+    checks = {}
+    for module_info in pkgutil.iter_modules(strategy.__path__):
+        if module_info.name in NON_STRATEGY_MODULES:
+            continue
+        module = importlib.import_module(f"strategy.{module_info.name}")
+        for name, func in vars(module).items():
+            if (name.startswith('check') and not name.endswith(('_each_day', '_universe')) and callable(func)
+                    and getattr(func, '__module__', None) == module.__name__):
+                checks[f"{module_info.name}.{name}"] = func
+    return dict(sorted(checks.items()))
+
+
+def named_strategies():
+    """{STRATEGY_NAME: check} of the strategy modules work_flow_new can enable (see discover_strategies)."""
+    import strategy
+    strategies = {}
+    for module_info in pkgutil.iter_modules(strategy.__path__):
+        module = importlib.import_module(f"strategy.{module_info.name}")
+        name = getattr(module, 'STRATEGY_NAME', None)
+        check = getattr(module, 'check_enter', None) or getattr(module, 'check', None)
+        if name and callable(check):
+            strategies[name] = check
+    return strategies
+
+
+def strategy_defaults():
+    """{STRATEGY_NAME: DEFAULT_STRATEGY_CONFIG} of the strategy modules, the 'strategies' settings of a benchmark."""
+    import strategy
+    defaults = {}
+    for module_info in pkgutil.iter_modules(strategy.__path__):
+        module = importlib.import_module(f"strategy.{module_info.name}")
+        name = getattr(module, 'STRATEGY_NAME', None)
+        if name and isinstance(getattr(module, 'DEFAULT_STRATEGY_CONFIG', None), dict):
+            defaults[name] = dict(module.DEFAULT_STRATEGY_CONFIG)
+    return defaults
+
+
+@contextmanager
+def overridden_settings(**overrides):
+    """Sets the given settings for the block and restores the previous values afterwards."""
+    config = settings.get_config()
+    saved = {key: config.get(key) for key in overrides}
+    config.update(overrides)
+    try:
+        yield config
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                config.pop(key, None)
+            else:
+                config[key] = value
+
+
+def _summary(seconds, items, **extra):
+    seconds = np.asarray(seconds, dtype=float)
+    return {'seconds': round(float(seconds.sum()), 6), 'items': items,
+            'mean_ms': round(float(seconds.sum()) / max(items, 1) * 1e3, 4),
+            'p95_ms': round(float(np.percentile(seconds, 95)) * 1e3, 4) if seconds.size > 1 else None, **extra}
+
+
+def _best(runs):
+    """The fastest of repeated runs of a benchmark."""
+    return min(runs, key=lambda summary: summary['seconds'])
+
+
+def bench_cache_load(cache_dir, bars, repeat=1):
+    import data_fetcher_new
+    stocks = stock_names(bars)
+    # The latest first bar of any stock, so no stock counts as missing history
+    start_date = bars.groupby(CODE_COLUMN)['日期'].min().max().strftime('%Y%m%d')
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        frames = data_fetcher_new.run(stocks, start_date=start_date, cache_dir=cache_dir, adjust=RAW_ADJUST)
+        runs.append(_summary([time.perf_counter() - started], len(stocks), loaded=len(frames)))
+    return _best(runs)
+
+
+def bench_strategies(frames, checks, repeat=1):
+    results = {}
+    for label, check in checks.items():
+        runs = []
+        for _ in range(repeat):
+            # Each check pays for its own indicators
+            feature_store.reset()
+            seconds, hits, errors = [], 0, 0
+            for code_name, frame in frames.items():
+                data = frame.copy()
+                started = time.perf_counter()
+                try:
+                    hits += bool(check(code_name, data))
+                except Exception as e:
+                    if not errors:
+                        logger.warning(f"{label} 检查 {code_name[0]} 出错: {e!r}", extra={'stock': code_name[0], 'strategy': '基准测试'})
+                    errors += 1
+                seconds.append(time.perf_counter() - started)
+            runs.append(_summary(seconds, len(frames), hits=hits, errors=errors))
+        results[f"strategy.{label}"] = _best(runs)
+    feature_store.reset()
+    return results
+
+
+def bench_universe(frames, checks, repeat=1):
+    import universe
+    from market_panel import MarketPanel
+    panel = MarketPanel.from_frames({code: frame for (code, _), frame in frames.items()})
+    results = {}
+    for label, check in checks.items():
+        universe_func = universe.vectorized_form(check)
+        if universe_func is None:
+            continue
+        runs = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            hits = sum(universe.evaluate({label: universe_func}, panel)[label].values())
+            runs.append(_summary([time.perf_counter() - started], len(panel.codes), hits=hits))
+        results[f"universe.{label}"] = _best(runs)
+    return results
+
+
+def bench_backtest(frames, repeat=1):
+    from strategy import new_limit_up
+    runs = []
+    for _ in range(repeat):
+        seconds, trades = [], 0
+        for (code, name), frame in frames.items():
+            start = frame['日期'].iloc[0].strftime('%Y%m%d')
+            end = frame['日期'].iloc[-1].strftime('%Y%m%d')
+            data = frame.copy()
+            started = time.perf_counter()
+            stats = new_limit_up.backtest(f"{code} {name}", data, start, end)
+            seconds.append(time.perf_counter() - started)
+            trades += stats['总交易次数']
+        runs.append(_summary(seconds, len(frames), trades=trades))
+    return {'backtest.new_limit_up': _best(runs)}
+
+
+def bench_process(cache_dir, stocks, strategies, repeat=1):
+    import work_flow_new
+    runs = []
+    try:
+        with overridden_settings(data_dir=cache_dir, push={'enable': False}, profile={'enabled': False}):
+            for _ in range(repeat):
+                feature_store.reset()
+                started = time.perf_counter()
+                work_flow_new.process(stocks, dict(strategies), "", [])
+                runs.append(_summary([time.perf_counter() - started], len(stocks), strategies=len(strategies)))
+    finally:
+        feature_store.reset()
+    return {'process': _best(runs)}
+
+
+def bench_replay(snapshot_dir, repeat=1, latency=0.0):
+    import replay
+    import work_flow_new
+    runs = []
+    for _ in range(repeat):
+        with replay.playback(snapshot_dir, latency=latency) as replayed:
+            started = time.perf_counter()
+            work_flow_new.prepare()
+            runs.append(_summary([time.perf_counter() - started], len(replayed.meta['stocks']), latency=latency))
+    return {'replay': _best(runs)}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(n_stocks=200, n_days=500, limit_up_rate=0.02, suspension_rate=0.002, seed=0, repeat=1, only=None, cache_dir=None,
+        replay_dir=None, replay_latency=0.0):
+    """Runs the suite (benchmarks whose name starts with one of `only`, all if None); returns the result document."""
+    def wanted(prefix):
+        return only is None or any(prefix.startswith(o) or o.startswith(prefix) for o in only)
+
+    params = {'stocks': n_stocks, 'days': n_days, 'limit_up_rate': limit_up_rate,
+              'suspension_rate': suspension_rate, 'seed': seed, 'repeat': repeat}
+    bars = synthetic_market(n_stocks, n_days, limit_up_rate, suspension_rate, seed)
+    stocks = stock_names(bars)
+    checks = strategy_checks()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="sequoia-bench-") as tmp, overridden_settings(strategies=strategy_defaults()):
+        cache_dir = cache_dir or tmp
+        if wanted('cache_load'):
+            write_cache(os.path.join(cache_dir, 'cache'), bars)
+            results['cache_load'] = bench_cache_load(os.path.join(cache_dir, 'cache'), bars, repeat)
+        if wanted('strategy.') or wanted('universe.') or wanted('backtest.'):
+            frames = strategy_frames(bars)
+            if wanted('strategy.'):
+                results.update(bench_strategies(frames, checks, repeat))
+            if wanted('universe.'):
+                results.update(bench_universe(frames, checks, repeat))
+            if wanted('backtest.'):
+                results.update(bench_backtest(frames, repeat))
+        if wanted('process'):
+            process_bars = bars
+            if bars['日期'].min() > PROCESS_HISTORY_START:
+                # Longer history of the same seed, so nothing is stale for the streamed fetch
+                process_days = int(np.busday_count(PROCESS_HISTORY_START.date(), bars['日期'].max().date())) + 2
+                process_bars = synthetic_market(n_stocks, process_days, limit_up_rate, suspension_rate, seed)
+            process_dir = os.path.join(cache_dir, 'process')
+            write_cache(process_dir, process_bars)
+            results.update(bench_process(process_dir, stock_names(process_bars), named_strategies(), repeat))
+    if replay_dir and wanted('replay'):
+        params.update(replay=replay_dir, replay_latency=replay_latency)
+        results.update(bench_replay(replay_dir, repeat, replay_latency))
+    return {'meta': {'commit': _git_commit(), 'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                     **params},
+            'results': results}
+
+
+def compare(previous, current, threshold=DEFAULT_THRESHOLD):
+    """[(benchmark, previous s, current s, ratio, regressed)] of the benchmarks in both result documents."""
+    rows = []
+    for name, result in current['results'].items():
+        old = previous.get('results', {}).get(name)
+        if not old or not old.get('seconds'):
+            continue
+        ratio = result['seconds'] / old['seconds']
+        rows.append((name, old['seconds'], result['seconds'], ratio, ratio > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sequoia 合成行情基准测试")
+    parser.add_argument('--stocks', type=int, default=200)
+    parser.add_argument('--days', type=int, default=500)
+    parser.add_argument('--limit-up-rate', type=float, default=0.02, help="每只股票每天涨停的概率")
+    parser.add_argument('--suspension-rate', type=float, default=0.002, help="每只股票每天开始停牌的概率 (停牌 1-20 天)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help="每项重复次数，取最快一次")
+    parser.add_argument('--only', nargs='*', help="只运行名称以这些前缀开头的基准，例如 strategy.enter cache_load")
+    parser.add_argument('--replay', metavar='DIR', help="同时计时回放 newmain.py --record 记录的运行")
+    parser.add_argument('--replay-latency', type=float, default=0.0, help="回放时每只股票模拟的上游延迟(秒)")
+    parser.add_argument('--output', default="benchmark.json")
+    parser.add_argument('--compare', help="与之前的结果文件比较")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="耗时超过之前的多少倍算退化")
+    args = parser.parse_args(argv)
+
+    document = run(args.stocks, args.days, args.limit_up_rate, args.suspension_rate, args.seed, args.repeat, args.only,
+                   replay_dir=args.replay, replay_latency=args.replay_latency)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False, indent=1)
+    for name, result in document['results'].items():
+        p95 = f", p95 {result['p95_ms']}ms" if result['p95_ms'] is not None else ""
+        logger.info(f"{name}: {result['seconds']:.3f}s, 每只 {result['mean_ms']}ms{p95}",
+                    extra={'stock': 'NONE', 'strategy': '基准测试'})
+    logger.info(f"基准结果已写入 {args.output}", extra={'stock': 'NONE', 'strategy': '基准测试'})
+    failed = {name: result['errors'] for name, result in document['results'].items() if result.get('errors')}
+    for name, errors in failed.items():
+        logger.error(f"{name}: {errors} 次检查出错，耗时不可比较", extra={'stock': 'NONE', 'strategy': '基准测试'})
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        regressed = False
+        for name, old, new, ratio, slower in compare(previous, document, args.threshold):
+            regressed |= slower
+            log = logger.warning if slower else logger.info
+            log(f"{name}: {old:.3f}s -> {new:.3f}s ({ratio:.2f}x){' 退化' if slower else ''}",
+                extra={'stock': 'NONE', 'strategy': '基准测试'})
+        return 1 if regressed or failed else 0
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                            handlers=[logging.StreamHandler(sys.stdout)])
+    # Per-stock messages of the strategies would dominate the timings
+    logging.getLogger('strategy').setLevel(logging.ERROR)
+    sys.exit(main())
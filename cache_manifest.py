@@ -0,0 +1,199 @@
+# cache_manifest.py
+# -*- encoding: UTF-8 -*-
+"""
+SQLite manifest of the history store: one row per stock with its first/last cached
+date, row count, last close, adjustment mode, schema version and a content checksum.
+
+The manifest is updated in one transaction after every history store write, so a run
+can decide which stocks need fetching with a single indexed query instead of opening
+data files. The checksum is the sum (mod 2**64) of per-row hashes, which lets appends
+update it incrementally and `verify()` recompute it from the data.
+"""
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.sqlite"
+# Bump when the layout or meaning of cached bars changes; stale entries are refetched
+# (2: raw bars + adjustment factors instead of hfq prices)
+SCHEMA_VERSION = 2
+
+_MASK64 = (1 << 64) - 1
+_DATE_FORMAT = '%Y-%m-%d'
+
+
+def rows_checksum(df):
+    """Order-independent checksum of bar rows (without the index)."""
+    if df.empty:
+        return 0
+    hashes = pd.util.hash_pandas_object(df.reset_index(drop=True), index=False)
+    return int(hashes.sum()) & _MASK64
+
+
+def summarize(df, code_column='股票代码', date_column='日期', close_column='收盘'):
+    """Per-stock first/last date, row count, last close and checksum of a long bar frame."""
+    df = df.sort_values([code_column, date_column], kind='stable')
+    summary = []
+    for code, group in df.groupby(code_column, sort=False):
+        summary.append({
+            'code': code,
+            'first_date': group[date_column].iloc[0],
+            'last_date': group[date_column].iloc[-1],
+            'row_count': len(group),
+            'last_close': float(group[close_column].iloc[-1]),
+            'checksum': rows_checksum(group),
+        })
+    return summary
+
+
+class CacheManifest:
+    """Per-stock index of what the history store holds."""
+
+    def __init__(self, cache_dir="stock_data_cache"):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, MANIFEST_FILE)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS stocks (
+                    code TEXT PRIMARY KEY,
+                    first_date TEXT NOT NULL,
+                    last_date TEXT NOT NULL,
+                    row_count INTEGER NOT NULL,
+                    last_close REAL,
+                    adjust TEXT NOT NULL,
+                    schema_version INTEGER NOT NULL,
+                    checksum TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_stocks_last_date ON stocks(last_date)")
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def is_empty(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM stocks").fetchone()[0] == 0
+
+    def record_append(self, df, adjust, load=None):
+        """
+        Merges the summary of freshly appended rows into the manifest in one transaction.
+        Rows dated within a stock's cached range replace bars already counted: its entry
+        is then rebuilt from `load(codes)` (the store's deduplicated bars), or without
+        `load` those rows are left out of the counts.
+        """
+        df = df.drop_duplicates(subset=['股票代码', '日期'], keep='last')
+        entries = self.entries(df['股票代码'].unique())
+        current = entries[(entries['adjust'] == adjust) & (entries['schema_version'] == SCHEMA_VERSION)]
+        first, last = (current[column].reindex(df['股票代码']).to_numpy() for column in ('first_date', 'last_date'))
+        overlaps = (df['日期'] >= first) & (df['日期'] <= last)
+        rebuilt = set()
+        if overlaps.any():
+            if load is not None:
+                rebuilt = set(df.loc[overlaps, '股票代码'])
+                df = pd.concat([df[~df['股票代码'].isin(rebuilt)], load(sorted(rebuilt))], ignore_index=True)
+            else:
+                df = df[~overlaps]
+        summary = summarize(df)
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for item in summary:
+                    row = conn.execute("SELECT first_date, last_date, row_count, last_close, checksum, adjust, schema_version FROM stocks WHERE code = ?",
+                                       (item['code'],)).fetchone()
+                    first_date = item['first_date'].strftime(_DATE_FORMAT)
+                    last_date = item['last_date'].strftime(_DATE_FORMAT)
+                    row_count, last_close, checksum = item['row_count'], item['last_close'], item['checksum']
+                    if row is not None and row[5] == adjust and row[6] == SCHEMA_VERSION and item['code'] not in rebuilt:
+                        first_date = min(first_date, row[0])
+                        if row[1] > last_date:
+                            last_date, last_close = row[1], row[3]
+                        row_count += row[2]
+                        checksum = (checksum + int(row[4])) & _MASK64
+                    conn.execute(
+                        "INSERT OR REPLACE INTO stocks (code, first_date, last_date, row_count, last_close, adjust, schema_version, checksum, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (item['code'], first_date, last_date, row_count, last_close, adjust, SCHEMA_VERSION, str(checksum), now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def replace_all(self, df, adjust):
+        """Rebuilds the manifest from a full long frame of the store."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM stocks")
+            conn.execute("COMMIT")
+        if not df.empty:
+            self.record_append(df, adjust)
+
+    def entries(self, codes=None):
+        """Returns the manifest as a DataFrame indexed by code (dates as Timestamps)."""
+        query = "SELECT code, first_date, last_date, row_count, last_close, adjust, schema_version, checksum, updated_at FROM stocks"
+        params = ()
+        if codes is not None:
+            codes = [str(c) for c in codes]
+            query += f" WHERE code IN ({','.join('?' * len(codes))})"
+            params = tuple(codes)
+        with self._lock:
+            df = pd.read_sql_query(query, self._connect(), params=params)
+        df['first_date'] = pd.to_datetime(df['first_date'])
+        df['last_date'] = pd.to_datetime(df['last_date'])
+        return df.set_index('code')
+
+    def stale_codes(self, codes, last_session, start_date=None, adjust=None):
+        """
+        Returns the subset of `codes` that needs a download: not cached, cached before
+        `last_session`, starting after `start_date`, or written with another adjustment
+        mode / schema version.
+        """
+        codes = [str(c) for c in codes]
+        entries = self.entries(codes)
+        fresh = entries['last_date'] >= pd.Timestamp(last_session)
+        if start_date is not None:
+            fresh &= entries['first_date'] <= pd.Timestamp(start_date)
+        if adjust is not None:
+            fresh &= entries['adjust'] == adjust
+        fresh &= entries['schema_version'] == SCHEMA_VERSION
+        fresh_codes = set(entries.index[fresh])
+        return {code for code in codes if code not in fresh_codes}
+
+    def codes_at(self, last_date, adjust=None):
+        """Codes whose cache ends exactly at `last_date`, with their last close (indexed query)."""
+        query = "SELECT code, last_close FROM stocks WHERE last_date = ? AND schema_version = ?"
+        params = [pd.Timestamp(last_date).strftime(_DATE_FORMAT), SCHEMA_VERSION]
+        if adjust is not None:
+            query += " AND adjust = ?"
+            params.append(adjust)
+        with self._lock:
+            df = pd.read_sql_query(query, self._connect(), params=tuple(params))
+        return df.set_index('code')['last_close']
+
+    def verify(self, df):
+        """Returns the codes whose stored checksum does not match `df` (a long frame of the store)."""
+        entries = self.entries()
+        mismatched = []
+        for item in summarize(df):
+            if item['code'] not in entries.index or int(entries.at[item['code'], 'checksum']) != item['checksum']:
+                mismatched.append(item['code'])
+        return mismatched
@@ -1,37 +1,19 @@
 # -*- encoding: UTF-8 -*-
 
-import akshare as ak
-import logging
 import talib as tl
 
-import concurrent.futures
-
-
-def fetch(code_name):
-    stock = code_name[0]
-    data = ak.stock_zh_a_hist(symbol=stock, period="daily", start_date="20250101", adjust="qfq")
-    # print("获取数据：", data)
-    if data is None or data.empty:
-        logging.debug("股票："+stock+" 没有数据，略过...")
-        return
-
-    data['p_change'] = tl.ROC(data['收盘'], 1)
-
-    return data
+import data_fetcher_new
+import settings
 
 
 def run(stocks):
-    stocks_data = {}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
-        future_to_stock = {executor.submit(fetch, stock): stock for stock in stocks}
-        for future in concurrent.futures.as_completed(future_to_stock):
-            stock = future_to_stock[future]
-            try:
-                data = future.result()
-                if data is not None:
-                    data = data.astype({'成交量': 'double'})
-                    stocks_data[stock] = data
-            except Exception as exc:
-                print('%s(%r) generated an exception: %s' % (stock[1], stock[0], exc))
+    # Shares the raw history store of data_fetcher_new; qfq prices are derived from its adjustment factors
+    stocks_data = data_fetcher_new.run(stocks, start_date="20250101",
+                                       cache_dir=settings.get_config().get('data_dir', 'stock_data_cache'),
+                                       max_workers=16, adjust="qfq")
+    for stock, data in stocks_data.items():
+        data = data.astype({'成交量': 'double'})
+        data['p_change'] = tl.ROC(data['收盘'], 1)
+        stocks_data[stock] = data
 
     return stocks_data
@@ -2,173 +2,346 @@
 import akshare as ak
 import pandas as pd
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
 import os
 import datetime
-from ratelimit import limits, sleep_and_retry
 import sys
-from tqdm import tqdm
+import threading
 import traceback
 
+import fetch_engine
+import profiler
+import rate_limiter
+import trading_calendar
+from adjust_factors import RAW_ADJUST, apply_adjustment
+from history_store import HistoryStore, find_legacy_files, split_by_stock, CODE_COLUMN, DEFAULT_ADJUST
+
 logger = logging.getLogger(__name__) # Get the shared logger
 
 # Configuration for data caching - CACHE_DIR will be passed from settings now
 # CACHE_DIR = "stock_data_cache" # This will be set by init()
-CACHE_FORMAT = "parquet" # Or "csv" (parquet is generally better for DataFrames)
+# Bars are kept in the consolidated, year-partitioned history store under the cache directory (see history_store.py)
+FLUSH_EVERY = 200 # Newly downloaded bars are appended to the history store in batches of this many stocks
+
+MIN_HISTORY_ROWS = 30 # Arbitrary minimum length for some common indicators (e.g., 20-period MA + buffer)
+
+PREV_CLOSE_COLUMN = '昨收' # Exchange reference price of each downloaded bar; differs from the previous close on ex-rights days
+
 
-@sleep_and_retry
-@limits(calls=5, period=60) # Limit AKShare calls to 5 per minute to avoid being blocked
-def fetch_single_stock_data(stock_code, stock_name, start_date_str="20250101", cache_dir="stock_data_cache"):
+def download_stock_data(stock_code, stock_name, start_date_str):
     """
-    Fetches historical daily stock data and manages caching (smarter update).
+    Downloads raw (unadjusted) daily bars from AKShare starting at `start_date_str` and cleans them.
+    The bars carry an extra 昨收 column used to detect corporate actions (see has_corporate_action).
+    Returns an empty DataFrame when nothing was returned.
     """
-    os.makedirs(cache_dir, exist_ok=True) # Ensure cache directory exists
-    file_name = f"{stock_code}.{CACHE_FORMAT}"
-    file_path = os.path.join(cache_dir, file_name)
-    
-    today = datetime.date.today()
-    # Assume data is up-to-date if it includes yesterday's data or today's if market is open
-    # This logic assumes end of day data is available after 3 PM
-    latest_expected_date = today if datetime.datetime.now().hour >= 15 else today - datetime.timedelta(days=1)
-    
+    logger.info(f"从AKShare下载 {stock_name}({stock_code}) 数据 (从 {start_date_str} 开始)...", extra={'stock': stock_code, 'strategy': '数据获取'})
+    # Shared 'hist' bucket paces AKShare calls across all threads to avoid being blocked
+    new_data_df = rate_limiter.call('hist', ak.stock_zh_a_hist, symbol=stock_code, period="daily", start_date=start_date_str, adjust="")
+
+    if new_data_df is None or new_data_df.empty:
+        logger.warning(f"AKShare未能获取到 {stock_name}({stock_code}) 的历史数据 (从 {start_date_str} 开始)。", extra={'stock': stock_code, 'strategy': '数据获取'})
+        return pd.DataFrame()
+
+    column_mapping = {
+        '日期': '日期', '开盘': '开盘', '收盘': '收盘', '最高': '最高',
+        '最低': '最低', '成交量': '成交量', '成交额': '成交额', '换手率': '换手率',
+        '股票代码': '股票代码', # Ensure stock code is also mapped if present
+    }
+    # Filter and rename columns
+    mapped_cols = {k:v for k,v in column_mapping.items() if k in new_data_df.columns}
+    raw_df = new_data_df
+    new_data_df = new_data_df.rename(columns=mapped_cols)[list(mapped_cols.values())].copy()
+    new_data_df[CODE_COLUMN] = stock_code
+    if '涨跌额' in raw_df.columns:
+        new_data_df[PREV_CLOSE_COLUMN] = (pd.to_numeric(raw_df['收盘'], errors='coerce') - pd.to_numeric(raw_df['涨跌额'], errors='coerce')).round(2).values
+
+    # Ensure '日期' is datetime type
+    new_data_df['日期'] = pd.to_datetime(new_data_df['日期'])
+    new_data_df = new_data_df.sort_values(by='日期').reset_index(drop=True)
+
+    # Phase 3, Item 7: More comprehensive data validation after fetch
+    # Check for NaN in critical numeric columns
+    numeric_cols_to_check = ['收盘', '开盘', '最高', '最低', '成交量', '成交额', '换手率']
+    for col in numeric_cols_to_check:
+        if col in new_data_df.columns and new_data_df[col].isnull().any():
+            logger.warning(f"下载的 {stock_name}({stock_code}) 数据在列 '{col}' 包含NaN值。尝试填充。", extra={'stock': stock_code, 'strategy': '数据获取'})
+            # Fill NaN with previous valid observation (Forward Fill), then backward fill for leading NaNs
+            # If still NaNs (e.g., all NaNs), fill with 0
+            new_data_df[col] = new_data_df[col].ffill().bfill().fillna(0)
+
+    return new_data_df
+
+
+def update_stock_data(stock_code, stock_name, start_date_str, cached_df, latest_expected_date=None):
+    """
+    Brings one stock up to date given its cached bars (possibly empty).
+    `latest_expected_date` is the last completed trading session (looked up if not given);
+    a cache that already reaches it is returned without any HTTP call.
+    Returns (full_df, new_rows_df); new_rows_df holds only bars that are not cached yet.
+    """
+    if latest_expected_date is None:
+        latest_expected_date = trading_calendar.last_completed_session().date()
     # Convert start_date_str to date object for comparison
     min_fetch_start_date = datetime.datetime.strptime(start_date_str, '%Y%m%d').date()
 
-    cached_df = pd.DataFrame() 
-    
-    # Phase 1, Item 2: Smarter Cache Update - Try to load and append
-    if os.path.exists(file_path):
-        try:
-            if CACHE_FORMAT == "parquet":
-                cached_df = pd.read_parquet(file_path)
-            elif CACHE_FORMAT == "csv":
-                cached_df = pd.read_csv(file_path)
-            
-            # Ensure '日期' column is datetime and sorted
-            cached_df['日期'] = pd.to_datetime(cached_df['日期'])
-            cached_df = cached_df.sort_values(by='日期').reset_index(drop=True)
-
-            if not cached_df.empty:
-                last_cached_date = cached_df['日期'].max().date()
-                
-                # Check if cached data is already up-to-date or covers the full requested history
-                if last_cached_date >= latest_expected_date and cached_df['日期'].min().date() <= min_fetch_start_date:
-                    logger.debug(f"从缓存加载 {stock_name}({stock_code}) 数据，最新日期: {last_cached_date}", extra={'stock': stock_code, 'strategy': '数据获取'})
-                    return cached_df
-                elif last_cached_date >= latest_expected_date: # Data is up-to-date, but history might be shorter than requested
-                    logger.info(f"缓存 {stock_name}({stock_code}) 最新日期 ({last_cached_date}) 已达最新，但起始日期 ({cached_df['日期'].min().strftime('%Y-%m-%d')}) 晚于请求的 {min_fetch_start_date.strftime('%Y-%m-%d')}。", extra={'stock': stock_code, 'strategy': '数据获取'})
-                    # We still need to fetch from min_fetch_start_date to get the full history
-                    start_date_str_for_fetch = min_fetch_start_date.strftime('%Y%m%d')
-                else: # Cached data is outdated
-                    logger.info(f"缓存 {stock_name}({stock_code}) 数据过期 ({last_cached_date})，将更新。", extra={'stock': stock_code, 'strategy': '数据获取'})
-                    start_date_str_for_fetch = (last_cached_date + datetime.timedelta(days=1)).strftime('%Y%m%d')
-                    logger.debug(f"Attempting to fetch new data from {start_date_str_for_fetch} for {stock_code}", extra={'stock': stock_code, 'strategy': '数据获取'})
-
-            else: # Cached file exists but is empty/corrupted
-                logger.warning(f"缓存文件 {file_path} 为空或损坏，将重新下载。", extra={'stock': stock_code, 'strategy': '数据获取'})
-                if os.path.exists(file_path):
-                    os.remove(file_path) # Remove corrupted file
-                start_date_str_for_fetch = start_date_str # Fetch from original start_date
-
-        except Exception as e:
-            logger.warning(f"加载缓存文件 {file_path} 失败: {e}\n{traceback.format_exc()}，将重新下载。", extra={'stock': stock_code, 'strategy': '数据获取'})
-            if os.path.exists(file_path):
-                os.remove(file_path) # Remove problematic file
-            start_date_str_for_fetch = start_date_str # Fetch from original start_date
-    else: # No cached file exists
+    if cached_df is None:
+        cached_df = pd.DataFrame()
+
+    if not cached_df.empty:
+        first_cached_date = cached_df['日期'].iloc[0].date()
+        last_cached_date = cached_df['日期'].iloc[-1].date()
+
+        # Check if cached data is already up-to-date or covers the full requested history
+        if last_cached_date >= latest_expected_date and first_cached_date <= min_fetch_start_date:
+            logger.debug(f"从缓存加载 {stock_name}({stock_code}) 数据，最新日期: {last_cached_date}", extra={'stock': stock_code, 'strategy': '数据获取'})
+            return cached_df, pd.DataFrame()
+        elif first_cached_date > min_fetch_start_date: # History is shorter than requested
+            logger.info(f"缓存 {stock_name}({stock_code}) 起始日期 ({first_cached_date}) 晚于请求的 {min_fetch_start_date}，将补齐历史。", extra={'stock': stock_code, 'strategy': '数据获取'})
+            # We still need to fetch from min_fetch_start_date to get the full history
+            start_date_str_for_fetch = start_date_str
+        else: # Cached data is outdated
+            logger.info(f"缓存 {stock_name}({stock_code}) 数据过期 ({last_cached_date})，将更新。", extra={'stock': stock_code, 'strategy': '数据获取'})
+            start_date_str_for_fetch = (last_cached_date + datetime.timedelta(days=1)).strftime('%Y%m%d')
+    else: # Nothing cached for this stock
         start_date_str_for_fetch = start_date_str
 
-    logger.info(f"从AKShare下载 {stock_name}({stock_code}) 数据 (从 {start_date_str_for_fetch} 开始)...", extra={'stock': stock_code, 'strategy': '数据获取'})
     try:
-        new_data_df = ak.stock_zh_a_hist(symbol=stock_code, period="daily", start_date=start_date_str_for_fetch, adjust="hfq")
-        
-        if new_data_df.empty:
-            logger.warning(f"AKShare未能获取到 {stock_name}({stock_code}) 的历史数据 (从 {start_date_str_for_fetch} 开始)。", extra={'stock': stock_code, 'strategy': '数据获取'})
-            return cached_df # Return existing cache if no new data was fetched (it might be old, but better than nothing)
-
-        column_mapping = {
-            '日期': '日期', '开盘': '开盘', '收盘': '收盘', '最高': '最高',
-            '最低': '最低', '成交量': '成交量', '成交额': '成交额', '换手率': '换手率',
-            '股票代码': '股票代码', # Ensure stock code is also mapped if present
-        }
-        # Filter and rename columns
-        mapped_cols = {k:v for k,v in column_mapping.items() if k in new_data_df.columns}
-        new_data_df = new_data_df.rename(columns=mapped_cols)[list(mapped_cols.values())].copy()
-        
-        # Ensure '日期' is datetime type
-        new_data_df['日期'] = pd.to_datetime(new_data_df['日期'])
-        new_data_df = new_data_df.sort_values(by='日期').reset_index(drop=True)
-
-        # Phase 3, Item 7: More comprehensive data validation after fetch
-        # Check for NaN in critical numeric columns
-        numeric_cols_to_check = ['收盘', '开盘', '最高', '最低', '成交量', '成交额', '换手率']
-        for col in numeric_cols_to_check:
-            if col in new_data_df.columns and new_data_df[col].isnull().any():
-                logger.warning(f"下载的 {stock_name}({stock_code}) 数据在列 '{col}' 包含NaN值。尝试填充。", extra={'stock': stock_code, 'strategy': '数据获取'})
-                # Fill NaN with previous valid observation (Forward Fill), then backward fill for leading NaNs
-                new_data_df[col].fillna(method='ffill', inplace=True)
-                new_data_df[col].fillna(method='bfill', inplace=True) # For any leading NaNs
-                # If still NaNs (e.g., all NaNs), fill with 0 or a very small number
-                new_data_df[col].fillna(0, inplace=True)
-                
-        # Handle cases where data might be too short after cleaning or initially
-        if new_data_df.empty or len(new_data_df) < 30: # Arbitrary minimum length for some common indicators (e.g., 20-period MA + buffer)
-             logger.warning(f"下载的 {stock_name}({stock_code}) 数据清洗后过短或为空 ({len(new_data_df)}行)。可能无法用于复杂策略。", extra={'stock': stock_code, 'strategy': '数据获取'})
-             # If new data is too short, return cached if valid, otherwise empty DF
-             return cached_df if not cached_df.empty else pd.DataFrame()
-
-
-        # Merge new data with cached data (if cached_df is not empty)
-        if not cached_df.empty:
-            # Use concat and drop_duplicates based on '日期' to handle overlaps and ensure unique dates
-            combined_df = pd.concat([cached_df, new_data_df]).drop_duplicates(subset=['日期']).sort_values(by='日期').reset_index(drop=True)
-            df_to_save = combined_df
-            logger.info(f"成功更新 {stock_name}({stock_code}) 数据，总行数: {len(df_to_save)}。", extra={'stock': stock_code, 'strategy': '数据获取'})
-        else:
-            df_to_save = new_data_df
-            logger.info(f"成功下载 {stock_name}({stock_code}) 数据，总行数: {len(df_to_save)}。", extra={'stock': stock_code, 'strategy': '数据获取'})
-
-        # Cache data
-        if CACHE_FORMAT == "parquet":
-            df_to_save.to_parquet(file_path, index=False)
-        elif CACHE_FORMAT == "csv":
-            df_to_save.to_csv(file_path, index=False)
-        
-        return df_to_save
-
+        new_data_df = download_stock_data(stock_code, stock_name, start_date_str_for_fetch)
     except Exception as e:
         logger.error(f"下载或处理 {stock_name}({stock_code}) 数据失败: {e}\n{traceback.format_exc()}", extra={'stock': stock_code, 'strategy': '数据获取'})
-        return cached_df if not cached_df.empty else pd.DataFrame() # Return existing cache or empty on failure
+        return cached_df, pd.DataFrame() # Return existing cache or empty on failure
 
-def run(stocks_list, start_date="20250101", cache_dir="stock_data_cache"):
-    """Runs data fetching for a list of stocks using a thread pool."""
-    all_stocks_data = {}
-    
-    # Ensure cache directory exists, based on the passed cache_dir
-    os.makedirs(cache_dir, exist_ok=True)
-
-    with ThreadPoolExecutor(max_workers=5) as executor: 
-        future_to_stock = {
-            executor.submit(fetch_single_stock_data, code, name, start_date, cache_dir): (code, name)
-            for code, name in stocks_list
-        }
-        for future in tqdm(as_completed(future_to_stock), 
-                           total=len(future_to_stock), 
-                           desc="Fetching stock data", 
-                           unit="stock",
-                           file=sys.stdout # Ensure tqdm prints to stdout
-                           ):
-            code, name = future_to_stock[future]
-            try:
-                data = future.result()
-                if not data.empty:
-                    all_stocks_data[(code, name)] = data
-            except Exception as exc:
-                # Exception already logged in fetch_single_stock_data, just pass here
-                pass 
-    
-    return all_stocks_data
+    if new_data_df.empty:
+        return cached_df, pd.DataFrame() # Return existing cache if no new data was fetched (it might be old, but better than nothing)
+
+    # Only bars outside the cached date range are new; the store is append-only
+    if not cached_df.empty:
+        known_dates = set(cached_df['日期'])
+        new_data_df = new_data_df[~new_data_df['日期'].isin(known_dates)].reset_index(drop=True)
+        full_df = pd.concat([cached_df, new_data_df]).sort_values(by='日期').reset_index(drop=True)
+    else:
+        full_df = new_data_df
+
+    # Handle cases where data might be too short after cleaning or initially
+    if len(full_df) < MIN_HISTORY_ROWS:
+        logger.warning(f"{stock_name}({stock_code}) 数据清洗后过短 ({len(full_df)}行)。可能无法用于复杂策略。", extra={'stock': stock_code, 'strategy': '数据获取'})
+
+    logger.info(f"成功更新 {stock_name}({stock_code}) 数据，新增 {len(new_data_df)} 行，总行数: {len(full_df)}。", extra={'stock': stock_code, 'strategy': '数据获取'})
+    return full_df, new_data_df
+
+
+def has_corporate_action(cached_df, new_rows):
+    """
+    True when a downloaded bar's 昨收 differs from the previous raw close, i.e. an
+    ex-rights/ex-dividend day happened and the stock's adjustment factors changed.
+    """
+    if new_rows is None or new_rows.empty or PREV_CLOSE_COLUMN not in new_rows.columns:
+        return False
+    closes = new_rows['收盘'].tolist()
+    previous = [cached_df['收盘'].iloc[-1] if cached_df is not None and not cached_df.empty else float('nan')] + closes[:-1]
+    diff = (new_rows[PREV_CLOSE_COLUMN] - pd.Series(previous, index=new_rows.index)).abs()
+    return bool((diff > 0.005).any())
+
+
+def fetch_single_stock_data(stock_code, stock_name, start_date_str="20250101", cache_dir="stock_data_cache", adjust=DEFAULT_ADJUST):
+    """
+    Fetches historical daily stock data and manages caching (smarter update).
+    New raw bars are appended to the consolidated history store right away; the
+    returned frame is adjusted to `adjust`.
+    """
+    store = HistoryStore(cache_dir, adjust=adjust)
+    start_ts = pd.Timestamp(datetime.datetime.strptime(start_date_str, '%Y%m%d'))
+    cached_df = store.load(codes=[stock_code], start_date=start_ts, adjust=RAW_ADJUST)
+    latest_expected_date = trading_calendar.last_completed_session(cache_dir=cache_dir).date()
+    full_df, new_rows = update_stock_data(stock_code, stock_name, start_date_str, cached_df, latest_expected_date)
+    if not new_rows.empty:
+        if has_corporate_action(cached_df, new_rows):
+            store.factors.request_refresh([stock_code])
+        store.append(new_rows, code=stock_code)
+    full_df = full_df.drop(columns=[PREV_CLOSE_COLUMN], errors='ignore')
+    if adjust == RAW_ADJUST:
+        return full_df
+    store.factors.refresh(store.factors.codes_to_refresh([stock_code]))
+    return apply_adjustment(full_df, store.factors.load([stock_code]), adjust)
+
+
+# Spot snapshot column -> daily bar column
+SPOT_BAR_MAPPING = {
+    '开盘': '开盘', '最高': '最高', '最低': '最低', '最新价': '收盘',
+    '成交量': '成交量', '成交额': '成交额', '换手率': '换手率',
+}
+
+
+def ingest_spot_snapshot(spot_df, cache_dir="stock_data_cache", trade_date=None, fetched_at=None):
+    """
+    Turns the after-close `ak.stock_zh_a_spot_em()` snapshot into today's daily bar for
+    every cached stock and appends them to the history store in one write.
+
+    A snapshot taken at `fetched_at` (default: now) shows the session on or before that
+    day, and is only a final daily bar when it was taken after that session's close; any
+    other snapshot (intraday, or a cached one from an earlier day) is skipped. An explicit
+    `trade_date` without `fetched_at` is trusted as it is (backfills, tests).
+    Only stocks whose cache ends at the session before it are updated; anything with a gap
+    (new listings, missed days) is left to the per-stock history download.
+    The cache holds raw prices, so snapshot prices are stored as they are. A 昨收 that
+    differs from the cached close means an ex-rights day: those stocks are flagged for an
+    adjustment factor refetch.
+    Returns the set of stock codes that were brought up to date.
+    """
+    calendar = trading_calendar.get_calendar(cache_dir)
+    if fetched_at is not None or trade_date is None:
+        fetched_at = fetched_at or datetime.datetime.now()
+        shown_session = calendar.session_on_or_before(fetched_at.date())
+        trade_date = shown_session if trade_date is None else trade_date
+        if (shown_session is None or pd.Timestamp(trade_date) != shown_session
+                or fetched_at < trading_calendar.session_close(shown_session)):
+            logger.info(f"实时行情快照取于 {fetched_at:%Y-%m-%d %H:%M}，不是 {pd.Timestamp(trade_date):%Y-%m-%d} 收盘后的完整日线，跳过快照入库。",
+                        extra={'stock': 'NONE', 'strategy': '快照入库'})
+            return set()
+    trade_ts = pd.Timestamp(trade_date)
+    previous_session = calendar.previous_session(trade_ts)
+
+    required_cols = set(SPOT_BAR_MAPPING) | {'代码', '昨收'}
+    if spot_df is None or spot_df.empty or not required_cols.issubset(spot_df.columns):
+        logger.warning(f"实时行情缺少快照入库所需列: {required_cols - set([] if spot_df is None else spot_df.columns)}，跳过。", extra={'stock': 'NONE', 'strategy': '快照入库'})
+        return set()
+
+    store = HistoryStore(cache_dir)
+    # Stocks cached exactly up to the previous session, with their last close, straight from the manifest
+    last_closes = store.ensure_manifest().codes_at(previous_session, adjust=RAW_ADJUST)
+    if last_closes.empty:
+        logger.info(f"没有股票的缓存截至上一交易日 {previous_session}，跳过快照入库。", extra={'stock': 'NONE', 'strategy': '快照入库'})
+        return set()
+
+    spot = spot_df[list(required_cols)].copy()
+    spot['代码'] = spot['代码'].astype(str)
+    spot = spot.set_index('代码')
+    for col in list(SPOT_BAR_MAPPING) + ['昨收']:
+        spot[col] = pd.to_numeric(spot[col], errors='coerce')
+
+    spot = spot.join(last_closes.rename('缓存收盘'), how='inner')
+    # Suspended stocks have no bar for the day
+    traded = (spot['成交量'] > 0) & (spot['开盘'] > 0) & (spot['最新价'] > 0) & (spot['昨收'] > 0)
+    spot = spot[traded & spot['缓存收盘'].notna()]
+    if spot.empty:
+        logger.info("没有可用实时行情追加日线的股票。", extra={'stock': 'NONE', 'strategy': '快照入库'})
+        return set()
+
+    bars = spot[list(SPOT_BAR_MAPPING)].rename(columns=SPOT_BAR_MAPPING)
+    bars['日期'] = trade_ts
+    ex_rights = spot.index[(spot['缓存收盘'] - spot['昨收']).abs() > 0.005]
+    if len(ex_rights):
+        store.factors.request_refresh(ex_rights)
+        logger.info(f"{len(ex_rights)} 只股票今日除权除息，已标记重新获取复权因子。", extra={'stock': 'NONE', 'strategy': '快照入库'})
+    bars = bars.rename_axis(CODE_COLUMN).reset_index()
+
+    store.append(bars)
+    logger.info(f"已用实时行情为 {len(bars)} 只股票追加 {trade_ts.strftime('%Y-%m-%d')} 日线 (上一交易日 {previous_session.strftime('%Y-%m-%d')})。", extra={'stock': 'NONE', 'strategy': '快照入库'})
+    return set(bars[CODE_COLUMN])
+
+
+class AkshareSource(fetch_engine.DataSource):
+    """
+    AKShare-backed DataSource on top of the history store: cached bars of all requested
+    stocks are read in one scan on open(), only stale stocks hit `ak.stock_zh_a_hist`,
+    and new raw bars are appended to the store in batches of FLUSH_EVERY stocks.
+    Returned frames are adjusted to `adjust`; adjustment factors are refetched only for
+    stocks that never had them or went through a corporate action.
+    """
+
+    def __init__(self, start_date="20250101", cache_dir="stock_data_cache", adjust=DEFAULT_ADJUST):
+        self.start_date = start_date
+        self.cache_dir = cache_dir
+        self.adjust = adjust
+        self.store = HistoryStore(cache_dir, adjust=adjust)
+        self._adjusted = {}
+        self._raw = {}
+        self._factors = {}
+        self._latest_expected_date = None
+        self._stale = set()
+        self._refresh = set()
+        self._pending_rows = []
+        self._lock = threading.Lock()
+
+    def open(self, stocks):
+        # Ensure cache directory exists, based on the passed cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if find_legacy_files(self.cache_dir) and not self.store.years():
+            logger.warning(f"{self.cache_dir} 中存在旧的单股票缓存文件，但历史库为空。可运行 `python history_store.py migrate --cache-dir {self.cache_dir}` 迁移。", extra={'stock': 'NONE', 'strategy': '数据获取'})
+        start_ts = pd.Timestamp(datetime.datetime.strptime(self.start_date, '%Y%m%d'))
+        codes = [code for code, _ in stocks]
+        self._latest_expected_date = trading_calendar.last_completed_session(cache_dir=self.cache_dir).date()
+        # One indexed manifest query decides which stocks need a download at all
+        self._stale = self.store.ensure_manifest().stale_codes(codes, self._latest_expected_date, start_ts, adjust=RAW_ADJUST)
+        if self.adjust != RAW_ADJUST:
+            self._refresh = self.store.factors.codes_to_refresh(codes)
+        logger.info(f"缓存清单: {len(codes) - len(self._stale)} 只股票已是最新，{len(self._stale)} 只需要下载，{len(self._refresh)} 只需要更新复权因子。", extra={'stock': 'NONE', 'strategy': '数据获取'})
+
+        with profiler.span('cache_read', stocks=len(codes)):
+            raw = self.store.load(codes=codes, start_date=start_ts, adjust=RAW_ADJUST)
+            factors = self.store.factors.load(codes)
+        # Stocks served from the cache as they are get adjusted in one vectorized pass
+        pending = raw[CODE_COLUMN].isin(self._stale | self._refresh) if not raw.empty else None
+        if pending is not None:
+            self._adjusted = split_by_stock(apply_adjustment(raw[~pending], factors, self.adjust))
+            self._raw = split_by_stock(raw[pending])
+        self._factors = split_by_stock(factors)
+
+    def fetch(self, code, name):
+        if code in self._adjusted:
+            return self._adjusted[code]
+        data = self._raw.get(code, pd.DataFrame())
+        refresh = code in self._refresh
+        if code in self._stale:
+            with profiler.span('download', code=code):
+                data, new_rows = update_stock_data(code, name, self.start_date, self._raw.get(code), self._latest_expected_date)
+            if not new_rows.empty:
+                if has_corporate_action(self._raw.get(code), new_rows):
+                    self.store.factors.request_refresh([code])
+                    refresh = True
+                with self._lock:
+                    self._pending_rows.append(new_rows)
+                    batch = self._pending_rows if len(self._pending_rows) >= FLUSH_EVERY else None
+                    if batch is not None:
+                        self._pending_rows = []
+                if batch is not None:
+                    with profiler.span('cache_write', stocks=len(batch)):
+                        self.store.append(pd.concat(batch, ignore_index=True))
+            data = data.drop(columns=[PREV_CLOSE_COLUMN], errors='ignore')
+        if data.empty or self.adjust == RAW_ADJUST:
+            return data
+        factors = self._factors.get(code)
+        if refresh and self.store.factors.refresh([code]):
+            factors = self.store.factors.load([code])
+        return apply_adjustment(data, factors, self.adjust)
+
+    def close(self):
+        with self._lock:
+            batch, self._pending_rows = self._pending_rows, []
+        if batch:
+            with profiler.span('cache_write', stocks=len(batch)):
+                self.store.append(pd.concat(batch, ignore_index=True))
+        # Fold accumulated daily deltas into the yearly base parts while the strategies run
+        self.store.compact_in_background()
+
+
+def run(stocks_list, start_date="20250101", cache_dir="stock_data_cache", max_workers=5, timeout=None, adjust=DEFAULT_ADJUST):
+    """
+    Runs data fetching for a list of stocks through the asyncio fetch engine.
+    Cached bars of all requested stocks are read from the history store in one scan;
+    only stale stocks are downloaded and their new bars are appended to the store in batches.
+    Returns {(code, name): DataFrame} with prices adjusted to `adjust` ('qfq', 'hfq' or 'none').
+    """
+    return fetch_engine.run(stocks_list, AkshareSource(start_date, cache_dir, adjust=adjust), concurrency=max_workers, timeout=timeout)
+
+
+def stream(stocks_list, start_date="20250101", cache_dir="stock_data_cache", max_workers=5, timeout=None, adjust=DEFAULT_ADJUST, maxsize=64):
+    """
+    Like run(), but yields ((code, name), DataFrame) as soon as each stock is loaded from
+    the cache or downloaded, holding at most `maxsize` frames in memory.
+    """
+    return fetch_engine.stream(stocks_list, AkshareSource(start_date, cache_dir, adjust=adjust), concurrency=max_workers,
+                               timeout=timeout, maxsize=maxsize, progress=False)
 
 if __name__ == '__main__':
     # This block is for independent testing of data_fetcher_new.py
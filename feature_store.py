@@ -0,0 +1,219 @@
+# feature_store.py
+# -*- encoding: UTF-8 -*-
+"""
+Memoized technical indicators shared by all strategies of a run.
+
+Several strategies compute the same indicator on the same stock (MA of 收盘, the
+5-day volume average, MACD/KDJ/RSI/BOLL). They ask the store instead:
+
+    ma250 = feature_store.get(code_name, data, 'MA', timeperiod=250)
+    dif, dea, hist = feature_store.get(code_name, data, 'MACD', fastperiod=12, slowperiod=26, signalperiod=9)
+
+A result is computed once per (stock, bars, indicator, params); the bars are
+identified by their count and first/last date and close, so a new day's bar (or
+a differently adjusted copy of the same bars) is a new key.
+Results are read-only arrays aligned with the rows of `data`. Entries are evicted
+least-recently-used beyond `max_mb` (settings 'feature_store') and, with `persist`,
+saved to `{data_dir}/features.pkl` so a rerun on the same day starts warm.
+"""
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import talib as tl
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+FEATURE_FILE = "features.pkl"
+DEFAULT_MAX_MB = 256
+
+
+def _column(data, column):
+    return data[column].values.astype(np.float64)
+
+
+# name -> function(data, **params) -> array or tuple of arrays (TA-Lib parameter names)
+INDICATORS = {
+    'MA': lambda data, column='收盘', timeperiod=30: tl.MA(_column(data, column), timeperiod),
+    'SMA': lambda data, column='收盘', timeperiod=30: tl.SMA(_column(data, column), timeperiod=timeperiod),
+    'MACD': lambda data, fastperiod=12, slowperiod=26, signalperiod=9: tl.MACD(
+        _column(data, '收盘'), fastperiod=fastperiod, slowperiod=slowperiod, signalperiod=signalperiod),
+    'STOCH': lambda data, fastk_period=5, slowk_period=3, slowd_period=3: tl.STOCH(
+        _column(data, '最高'), _column(data, '最低'), _column(data, '收盘'),
+        fastk_period=fastk_period, slowk_period=slowk_period, slowd_period=slowd_period),
+    'RSI': lambda data, timeperiod=14: tl.RSI(_column(data, '收盘'), timeperiod=timeperiod),
+    'BBANDS': lambda data, timeperiod=5, nbdevup=2, nbdevdn=2: tl.BBANDS(
+        _column(data, '收盘'), timeperiod=timeperiod, nbdevup=nbdevup, nbdevdn=nbdevdn),
+}
+
+
+def _nbytes(value):
+    return sum(v.nbytes for v in value) if isinstance(value, tuple) else value.nbytes
+
+
+def _read_only(value):
+    for array in (value if isinstance(value, tuple) else (value,)):
+        array.flags.writeable = False
+    return value
+
+
+class FeatureStore:
+    """LRU memo of indicator arrays keyed by (stock, bars, indicator, params), with hit/miss counters."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_MB * 1024 * 1024, path=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {}
+        self._evictions = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    @staticmethod
+    def key(code, data, name, params):
+        if len(data):
+            # First/last close tell qfq, hfq and raw bars of the same days apart
+            close = data['收盘']
+            bars = (len(data), str(data['日期'].iloc[0]), str(data['日期'].iloc[-1]), float(close.iloc[0]), float(close.iloc[-1]))
+        else:
+            bars = (0, None, None, None, None)
+        return (str(code), *bars, name, tuple(sorted(params.items())))
+
+    def _count(self, name, outcome):
+        counters = self._stats.setdefault(name, {'hit': 0, 'miss': 0})
+        counters[outcome] += 1
+
+    def get(self, code, data, name, **params):
+        """Indicator `name` (see INDICATORS) of `data` with `params`; computed on first request only."""
+        return self.compute(code, data, name, INDICATORS[name], **params)
+
+    def compute(self, code, data, name, function, **params):
+        """Memoized `function(data, **params)` stored under `name`, for series derived outside INDICATORS."""
+        if isinstance(code, tuple):
+            code = code[0]
+        key = self.key(code, data, name, params)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._count(name, 'hit')
+                return value
+            self._count(name, 'miss')
+
+        value = function(data, **params)
+        value = _read_only(tuple(value) if isinstance(value, (tuple, list)) else value)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = value
+                self._bytes += _nbytes(value)
+                self._evict()
+        return value
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, value = self._entries.popitem(last=False)
+            self._bytes -= _nbytes(value)
+            self._evictions += 1
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def stats(self):
+        """Per-indicator hit/miss counters plus totals, entry count, bytes and evictions."""
+        with self._lock:
+            stats = {name: dict(counters) for name, counters in self._stats.items()}
+            hits = sum(c['hit'] for c in stats.values())
+            misses = sum(c['miss'] for c in stats.values())
+            stats['total'] = {'hit': hits, 'miss': misses, 'entries': len(self._entries),
+                              'bytes': self._bytes, 'evictions': self._evictions}
+            return stats
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                entries = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"读取指标缓存 {self.path} 失败: {e}", extra={'stock': 'NONE', 'strategy': '指标缓存'})
+            return
+        for key, value in entries:
+            self._entries[key] = _read_only(value)
+            self._bytes += _nbytes(value)
+        self._evict()
+
+    def save(self):
+        """Writes the entries to `path` (no-op without one)."""
+        if not self.path:
+            return
+        with self._lock:
+            entries = list(self._entries.items())
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"保存指标缓存 {self.path} 失败: {e}", extra={'stock': 'NONE', 'strategy': '指标缓存'})
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide FeatureStore configured from settings 'feature_store'."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            config = settings.get_config()
+            options = config.get('feature_store', {}) or {}
+            path = os.path.join(config.get('data_dir', 'stock_data_cache'), FEATURE_FILE) if options.get('persist') else None
+            _store = FeatureStore(max_bytes=int(options.get('max_mb', DEFAULT_MAX_MB) * 1024 * 1024), path=path)
+        return _store
+
+
+def get(code, data, name, **params):
+    """`get_store().get(...)`; `code` may be the (code, name) tuple strategies receive."""
+    return get_store().get(code, data, name, **params)
+
+
+def compute(code, data, name, function, **params):
+    """`get_store().compute(...)`."""
+    return get_store().compute(code, data, name, function, **params)
+
+
+def series(code, data, name, **params):
+    """Single-output indicator as a (writable) Series on `data`'s index, for `data[...] = ...` assignments."""
+    return pd.Series(np.array(get(code, data, name, **params)), index=data.index.values)
+
+
+def save():
+    if _store is not None:
+        _store.save()
+
+
+def log_stats():
+    if _store is None:
+        return
+    for name, counters in _store.stats().items():
+        if name == 'total':
+            logger.info(f"指标缓存: 命中 {counters['hit']} 次, 计算 {counters['miss']} 次, {counters['entries']} 项 "
+                        f"{counters['bytes'] / 1024 / 1024:.1f} MB, 淘汰 {counters['evictions']} 项", extra={'stock': 'NONE', 'strategy': '指标缓存'})
+        else:
+            logger.info(f"指标缓存 [{name}]: 命中 {counters['hit']} 次, 计算 {counters['miss']} 次", extra={'stock': 'NONE', 'strategy': '指标缓存'})
+
+
+def reset():
+    """Drops the process-wide store (mainly for tests)."""
+    global _store
+    with _store_lock:
+        _store = None
@@ -0,0 +1,294 @@
+# fetch_engine.py
+# -*- encoding: UTF-8 -*-
+"""
+asyncio-based fetch engine with pluggable data sources.
+
+A DataSource turns (code, name) into a DataFrame of daily bars. Blocking sources
+(AKShare, see data_fetcher_new.AkshareSource) run in a thread pool; native async
+sources such as LocalFileSource run on the event loop. The engine bounds the number
+of in-flight requests, applies a per-request deadline (time spent waiting for a
+rate_limiter token does not count) and returns the usual
+{(code, name): DataFrame} dict, or, with `stream()`, yields each frame through a
+bounded queue as soon as it arrives so consumers can start working before the
+last download finished.
+
+Offline throughput check against a fixture directory:
+    python fetch_engine.py --path fixtures --concurrency 8 --latency 0.2
+"""
+import argparse
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from tqdm import tqdm
+
+import rate_limiter
+from history_store import HistoryStore, split_by_stock
+
+logger = logging.getLogger(__name__)
+
+
+class DataSource:
+    """Interface of a per-stock daily bar source."""
+
+    # Blocking sources are run in the engine's thread pool
+    blocking = True
+
+    def open(self, stocks):
+        """Called once before any fetch with the full (code, name) list, e.g. to bulk-load a cache."""
+
+    def fetch(self, code, name):
+        """Returns the daily bars of one stock; an empty DataFrame when there is nothing."""
+        raise NotImplementedError
+
+    async def fetch_async(self, code, name, executor=None):
+        loop = asyncio.get_running_loop()
+        # The worker thread runs in the request's context, so rate_limiter reports its waits to the engine
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(executor, functools.partial(context.run, self.fetch, code, name))
+
+    def close(self):
+        """Called once after the last fetch finished (also on cancellation)."""
+
+
+class FunctionSource(DataSource):
+    """Adapts a plain blocking `func(code, name) -> DataFrame` to the DataSource interface."""
+
+    def __init__(self, func):
+        self.func = func
+
+    def fetch(self, code, name):
+        return self.func(code, name)
+
+
+class LocalFileSource(DataSource):
+    """
+    Offline stand-in source reading a fixture directory: either a history store
+    (`{path}/bars/...`) or one `{code}.parquet` / `{code}.csv` per stock.
+    `latency` seconds are awaited per request to mimic an upstream.
+    """
+
+    blocking = False
+
+    def __init__(self, path, latency=0.0):
+        self.path = path
+        self.latency = latency
+        self._frames = None
+
+    def open(self, stocks):
+        store = HistoryStore(self.path)
+        if store.years():
+            self._frames = split_by_stock(store.load(codes=[code for code, _ in stocks]))
+
+    def fetch(self, code, name):
+        if self._frames is not None:
+            return self._frames.get(code, pd.DataFrame())
+        for ext, reader in (('parquet', pd.read_parquet), ('csv', pd.read_csv)):
+            file_path = os.path.join(self.path, f"{code}.{ext}")
+            if os.path.exists(file_path):
+                df = reader(file_path) if ext == 'parquet' else reader(file_path, dtype={'股票代码': str})
+                df['日期'] = pd.to_datetime(df['日期'])
+                return df.sort_values(by='日期').reset_index(drop=True)
+        return pd.DataFrame()
+
+    async def fetch_async(self, code, name, executor=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.fetch(code, name)
+
+
+class _Deadline:
+    """Time budget of one request; the clock stops while it waits for a rate_limiter token."""
+
+    def __init__(self, timeout):
+        self.loop = asyncio.get_running_loop()
+        self.timeout = timeout
+        self.spent = 0.0
+        self.running_since = self.loop.time()
+        self.changed = asyncio.Event()
+
+    def limiter_wait(self, waiting):
+        # Called on the worker thread by rate_limiter.call()
+        self.loop.call_soon_threadsafe(self._switch, waiting)
+
+    def _switch(self, waiting):
+        now = self.loop.time()
+        if waiting and self.running_since is not None:
+            self.spent += now - self.running_since
+            self.running_since = None
+        elif not waiting and self.running_since is None:
+            self.running_since = now
+        self.changed.set()
+
+    def remaining(self):
+        """Seconds left, or None while the clock is stopped."""
+        if self.running_since is None:
+            return None
+        return self.timeout - self.spent - (self.loop.time() - self.running_since)
+
+    async def wait(self, request):
+        """Returns the result of `request`; raises TimeoutError once the budget is used up (without cancelling it)."""
+        while True:
+            remaining = self.remaining()
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError()
+            self.changed.clear()
+            changed = asyncio.ensure_future(self.changed.wait())
+            try:
+                await asyncio.wait({request, changed}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                changed.cancel()
+            if request.done():
+                return request.result()
+
+
+def _retrieve(request):
+    # A request nobody awaits anymore (timed out) must not log "exception was never retrieved"
+    if not request.cancelled():
+        request.exception()
+
+
+async def fetch_all_async(stocks, source, concurrency=5, timeout=None, on_result=None, progress=True):
+    """
+    Fetches every (code, name) in `stocks` from `source` with at most `concurrency`
+    requests in flight. A request that exceeds `timeout` seconds, not counting its
+    waits for a rate_limiter token, is skipped. A blocking call cannot be interrupted,
+    so a timed-out request keeps its slot until its worker thread returns; later
+    requests never queue behind it. `on_result(code_name, df)` is called as soon as
+    each non-empty frame arrives. Cancelling the awaiting task cancels all pending requests.
+    """
+    results = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency) if source.blocking else None
+
+    async def fetch_one(code, name):
+        await semaphore.acquire()
+        deadline = _Deadline(timeout) if timeout is not None else None
+        if deadline is not None:
+            rate_limiter.wait_listener.set(deadline.limiter_wait)
+        request = asyncio.ensure_future(source.fetch_async(code, name, executor))
+        request.add_done_callback(lambda _: semaphore.release())
+        request.add_done_callback(_retrieve)
+        try:
+            return (code, name), await (deadline.wait(request) if deadline is not None else request)
+        except asyncio.TimeoutError:
+            if not source.blocking:
+                request.cancel()
+            logger.warning(f"获取 {name}({code}) 数据超时 ({timeout}s)，已跳过。", extra={'stock': code, 'strategy': '数据获取'})
+        except asyncio.CancelledError:
+            request.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"获取 {name}({code}) 数据失败: {e}", extra={'stock': code, 'strategy': '数据获取'})
+        return (code, name), None
+
+    source.open(stocks)
+    tasks = [asyncio.ensure_future(fetch_one(code, name)) for code, name in stocks]
+    try:
+        for next_done in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Fetching stock data",
+                              unit="stock", file=sys.stdout, disable=not progress):
+            code_name, df = await next_done
+            if df is not None and not df.empty:
+                results[code_name] = df
+                if on_result is not None:
+                    on_result(code_name, df)
+    finally:
+        for task in tasks:
+            task.cancel()
+        source.close()
+        if executor is not None:
+            # Threads already running a blocking call cannot be interrupted; don't wait for them
+            executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def run(stocks, source, concurrency=5, timeout=None, on_result=None, progress=True):
+    """Synchronous wrapper around fetch_all_async returning {(code, name): DataFrame}."""
+    return asyncio.run(fetch_all_async(stocks, source, concurrency=concurrency, timeout=timeout,
+                                       on_result=on_result, progress=progress))
+
+
+def stream(stocks, source, concurrency=5, timeout=None, maxsize=64, progress=True):
+    """
+    Generator yielding ((code, name), DataFrame) in arrival order while the fetch runs
+    on a background thread. At most `maxsize` frames wait in the queue; a slow consumer
+    holds the fetch back instead of buffering the whole market. Closing the generator
+    early cancels the remaining requests.
+    """
+    frames = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+    errors = []
+
+    def put(code_name, df):
+        while not stop.is_set():
+            try:
+                frames.put((code_name, df), timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise asyncio.CancelledError()
+
+    def produce():
+        try:
+            run(stocks, source, concurrency=concurrency, timeout=timeout, on_result=put, progress=progress)
+        except BaseException as e:
+            if not stop.is_set():
+                errors.append(e)
+        finally:
+            while True:
+                try:
+                    frames.put(done, timeout=0.1)
+                    break
+                except queue.Full:
+                    if stop.is_set():
+                        break
+
+    producer = threading.Thread(target=produce, name="fetch-stream", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        # On early close the producer notices at its next result; it is a daemon thread, so don't wait for it
+        stop.set()
+    producer.join()
+    if errors:
+        raise errors[0]
+
+
+if __name__ == '__main__':
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                            handlers=[logging.StreamHandler(sys.stdout)])
+
+    parser = argparse.ArgumentParser(description="离线测量数据获取吞吐量")
+    parser.add_argument('--path', required=True, help="本地行情目录 (历史库或 {code}.parquet/csv)")
+    parser.add_argument('--concurrency', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help="每次请求模拟的上游延迟(秒)")
+    parser.add_argument('--timeout', type=float, default=None)
+    args = parser.parse_args()
+
+    store = HistoryStore(args.path)
+    if store.years():
+        codes = sorted(store.last_dates().index)
+    else:
+        codes = sorted(f.split('.')[0] for f in os.listdir(args.path) if f.endswith(('.parquet', '.csv')))
+    stock_list = [(code, code) for code in codes]
+
+    started = time.perf_counter()
+    fetched = run(stock_list, LocalFileSource(args.path, latency=args.latency),
+                  concurrency=args.concurrency, timeout=args.timeout)
+    elapsed = time.perf_counter() - started
+    print(f"{len(fetched)}/{len(stock_list)} stocks in {elapsed:.2f}s ({len(fetched) / elapsed if elapsed else 0:.1f} stocks/s)")
@@ -0,0 +1,133 @@
+# funnel.py
+# -*- encoding: UTF-8 -*-
+"""
+Per-strategy rejection funnel of a run.
+
+Strategy checks record why a stock was rejected as a (strategy, reason) count
+instead of formatting a debug message for every stock:
+
+    if not min_rate <= turnover <= max_rate:
+        funnel.reject(STRATEGY_NAME, '换手率', code, turnover)
+        return False
+    ...
+    funnel.accept(STRATEGY_NAME)
+
+The trailing arguments are kept, unformatted, for the first `samples` rejections of
+each reason (settings 'funnel'). log_stats() reports the run once, as one table per
+strategy; per-stock messages stay behind logger.isEnabledFor(logging.DEBUG). Worker
+processes send their counts to the parent with drain()/merge().
+"""
+import logging
+import threading
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLES = 3
+
+
+class Funnel:
+    """Checked/passed counts and rejection reasons per strategy."""
+
+    def __init__(self, samples=DEFAULT_SAMPLES):
+        self.samples = samples
+        self._passed = {}    # strategy -> count
+        self._rejected = {}  # strategy -> {reason: count}
+        self._examples = {}  # (strategy, reason) -> [(code, args)]
+        self._lock = threading.Lock()
+
+    def accept(self, strategy):
+        with self._lock:
+            self._passed[strategy] = self._passed.get(strategy, 0) + 1
+
+    def reject(self, strategy, reason, code=None, *args):
+        with self._lock:
+            reasons = self._rejected.setdefault(strategy, {})
+            count = reasons[reason] = reasons.get(reason, 0) + 1
+            if count <= self.samples:
+                self._examples.setdefault((strategy, reason), []).append((code, args))
+
+    def drain(self):
+        """The counts recorded since the last drain(), as a picklable snapshot; clears them."""
+        with self._lock:
+            snapshot = (self._passed, self._rejected, self._examples)
+            self._passed, self._rejected, self._examples = {}, {}, {}
+        return snapshot
+
+    def merge(self, snapshot):
+        passed, rejected, examples = snapshot
+        with self._lock:
+            for strategy, count in passed.items():
+                self._passed[strategy] = self._passed.get(strategy, 0) + count
+            for strategy, reasons in rejected.items():
+                mine = self._rejected.setdefault(strategy, {})
+                for reason, count in reasons.items():
+                    mine[reason] = mine.get(reason, 0) + count
+            for key, samples in examples.items():
+                mine = self._examples.setdefault(key, [])
+                mine.extend(samples[:self.samples - len(mine)])
+
+    def table(self):
+        """{strategy: (checked, passed, [(reason, rejected, samples)] most frequent first)}."""
+        with self._lock:
+            result = {}
+            for strategy in sorted(set(self._passed) | set(self._rejected)):
+                reasons = self._rejected.get(strategy, {})
+                passed = self._passed.get(strategy, 0)
+                rows = [(reason, count, list(self._examples.get((strategy, reason), [])))
+                        for reason, count in sorted(reasons.items(), key=lambda item: -item[1])]
+                result[strategy] = (passed + sum(reasons.values()), passed, rows)
+            return result
+
+
+_funnel = None
+_funnel_lock = threading.Lock()
+
+
+def get_funnel():
+    global _funnel
+    if _funnel is None:
+        with _funnel_lock:
+            if _funnel is None:
+                options = settings.get_config().get('funnel', {}) or {}
+                _funnel = Funnel(samples=options.get('samples', DEFAULT_SAMPLES))
+    return _funnel
+
+
+def accept(strategy):
+    get_funnel().accept(strategy)
+
+
+def reject(strategy, reason, code=None, *args):
+    get_funnel().reject(strategy, reason, code, *args)
+
+
+def drain():
+    return get_funnel().drain()
+
+
+def merge(snapshot):
+    get_funnel().merge(snapshot)
+
+
+def _format_sample(code, args):
+    if not args:
+        return str(code)
+    return f"{code}({', '.join(f'{arg:.4g}' if isinstance(arg, float) else str(arg) for arg in args)})"
+
+
+def log_stats():
+    for strategy, (checked, passed, rows) in get_funnel().table().items():
+        logger.info(f"筛选漏斗 [{strategy}]: 检查 {checked} 只, 通过 {passed} 只", extra={'stock': 'NONE', 'strategy': strategy})
+        for reason, rejected, samples in rows:
+            example = f", 例: {' '.join(_format_sample(code, args) for code, args in samples)}" if samples else ""
+            logger.info(f"  {reason}: 淘汰 {rejected} 只 ({rejected / checked:.1%}){example}",
+                        extra={'stock': 'NONE', 'strategy': strategy})
+
+
+def reset():
+    """Starts a new run's counts."""
+    global _funnel
+    with _funnel_lock:
+        _funnel = None
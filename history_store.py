@@ -0,0 +1,461 @@
+# history_store.py
+# -*- encoding: UTF-8 -*-
+"""
+Consolidated columnar store for daily bars of the whole universe.
+
+Instead of one `{code}.parquet` per stock, all bars live in a single
+year-partitioned Parquet dataset under the existing cache directory:
+
+    {cache_dir}/bars/year=2024/part-<write time in ns>-1a2b3c4d.parquet
+    {cache_dir}/bars/year=2025/part-...
+
+Bars are stored unadjusted; qfq/hfq prices are computed at load time from the
+per-stock factors in adjust_factors.py, so daily updates never rewrite history.
+
+Every part file holds rows of many stocks, identified by the 股票代码 column.
+Writes only ever add new small delta parts (append-only, written to a temp file and
+renamed into place); reads scan the dataset once and split the result per stock.
+Once a year has collected too many deltas, compaction folds them into one base part
+(`part-<stamp>-base.parquet`), again via temp file + rename:
+
+    python history_store.py compact --cache-dir data [--force]
+
+A per-stock manifest (cache_manifest.py) is updated after every write, so freshness
+checks never have to open the data files.
+
+All HistoryStore instances of one cache directory in a process share its locks: writes
+are serialized, and compaction only replaces and removes parts while no scan is reading
+them. A scan that still finds a part gone (a compaction in another process) is retried.
+
+Migration of an existing per-stock cache:
+    python history_store.py migrate --cache-dir data [--remove]
+"""
+import argparse
+import glob
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from adjust_factors import PRICE_COLUMNS, RAW_ADJUST, FactorStore, apply_adjustment
+from cache_manifest import CacheManifest
+from ohlcv import split_long_frame
+
+logger = logging.getLogger(__name__)
+
+# Holds raw bars; the earlier `history/` directory held hfq prices and is no longer read
+HISTORY_DIR = "bars"
+CODE_COLUMN = '股票代码'
+DATE_COLUMN = '日期'
+BAR_COLUMNS = ['日期', '开盘', '收盘', '最高', '最低', '成交量', '成交额', '换手率']
+HISTORY_COLUMNS = [CODE_COLUMN] + BAR_COLUMNS
+
+# Adjustment mode of the prices returned by load() unless asked otherwise
+DEFAULT_ADJUST = 'hfq'
+
+# Roughly 242 A-share sessions a year; used to pick how many year partitions a "last N bars" read needs.
+SESSIONS_PER_YEAR = 240
+
+# A year is compacted once it has more delta parts than this, or its delta rows outgrow the base
+COMPACT_MAX_DELTAS = 16
+COMPACT_MAX_DELTA_RATIO = 0.5
+_BASE_SUFFIX = "-base.parquet"
+_TMP_SUFFIX = ".tmp"
+
+_LEGACY_FILE_PATTERN = re.compile(r'^(\d{6})\.parquet$')
+# Scans of a dataset whose parts were removed underneath them are retried this often
+SCAN_ATTEMPTS = 3
+
+
+class _ReadWriteLock:
+    """Any number of readers or one writer; waiting writers go first."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writing = False
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+_locks = {}  # cache directory -> (write lock, part files lock)
+_locks_lock = threading.Lock()
+
+
+def _store_locks(cache_dir):
+    key = os.path.abspath(cache_dir)
+    with _locks_lock:
+        if key not in _locks:
+            _locks[key] = (threading.Lock(), _ReadWriteLock())
+        return _locks[key]
+
+
+def _normalize(df, code=None):
+    """Returns a copy of `df` restricted to the history schema with consistent dtypes."""
+    df = df.copy()
+    if code is not None:
+        df[CODE_COLUMN] = code
+    if CODE_COLUMN not in df.columns:
+        raise ValueError(f"写入历史库的数据缺少 '{CODE_COLUMN}' 列")
+    for col in BAR_COLUMNS:
+        if col not in df.columns:
+            df[col] = float('nan')
+    df = df[HISTORY_COLUMNS]
+    df[CODE_COLUMN] = df[CODE_COLUMN].astype(str).str.zfill(6)
+    df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN]).astype('datetime64[ns]')
+    for col in BAR_COLUMNS[1:]:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    return df
+
+
+def _ts_scalar(ts):
+    return pa.scalar(pd.Timestamp(ts).to_pydatetime(), pa.timestamp('ns'))
+
+
+def _write_atomic(table, path):
+    # Readers only pick up *.parquet, so a half-written temp file is never seen
+    tmp_path = path + _TMP_SUFFIX
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _part_stamp(path):
+    return int(os.path.basename(path).split('-')[1])
+
+
+class HistoryStore:
+    """
+    Year-partitioned Parquet dataset holding the raw daily bars of all stocks.
+    `adjust` is the price mode load() returns by default ('qfq', 'hfq' or 'none').
+    """
+
+    def __init__(self, cache_dir="stock_data_cache", adjust=DEFAULT_ADJUST):
+        self.cache_dir = cache_dir
+        self.adjust = adjust
+        self.root = os.path.join(cache_dir, HISTORY_DIR)
+        self.manifest = CacheManifest(cache_dir)
+        self.factors = FactorStore(cache_dir)
+        # Shared with every other instance on the same directory
+        self._write_lock, self._files_lock = _store_locks(cache_dir)
+        self._last_stamp = 0
+
+    def _part_files(self, year='*'):
+        # Part names start with a write timestamp, so sorting by file name gives write order within a year
+        files = glob.glob(os.path.join(self.root, f'year={year}', '*.parquet'))
+        return sorted(files, key=lambda path: (os.path.dirname(path), os.path.basename(path)))
+
+    def _dataset(self):
+        files = self._part_files()
+        if not files:
+            return None
+        return ds.dataset(files, format="parquet", partitioning="hive", partition_base_dir=self.root)
+
+    def _next_stamp(self):
+        # Strictly increasing nanosecond stamp, so two writes within the same clock tick keep their order
+        stamp = max(time.time_ns(), self._last_stamp + 1)
+        self._last_stamp = stamp
+        return stamp
+
+    def years(self):
+        """Returns the sorted list of year partitions present on disk."""
+        years = []
+        for path in glob.glob(os.path.join(self.root, 'year=*')):
+            try:
+                years.append(int(os.path.basename(path).split('=', 1)[1]))
+            except ValueError:
+                continue
+        return sorted(years)
+
+    def append(self, df, code=None):
+        """
+        Appends raw (unadjusted) bars to the store as new part files, one per year touched.
+        `df` must carry a 股票代码 column unless `code` is given.
+        Returns the number of rows written.
+        """
+        if df is None or df.empty:
+            return 0
+        df = _normalize(df, code=code)
+        df = df.dropna(subset=[DATE_COLUMN])
+        if df.empty:
+            return 0
+
+        with self._write_lock:
+            stamp = self._next_stamp()
+            for year, year_df in df.groupby(df[DATE_COLUMN].dt.year):
+                part_dir = os.path.join(self.root, f"year={int(year)}")
+                os.makedirs(part_dir, exist_ok=True)
+                part_path = os.path.join(part_dir, f"part-{stamp:020d}-{uuid.uuid4().hex[:8]}.parquet")
+                table = pa.Table.from_pandas(year_df.reset_index(drop=True), preserve_index=False)
+                _write_atomic(table, part_path)
+            # After the data files, so a crash in between only makes the manifest lag behind (stocks get refetched)
+            # Bars rewritten over cached dates make the manifest re-summarize those stocks from the store
+            self.manifest.record_append(df, RAW_ADJUST, load=lambda codes: self.load(codes=codes, adjust=RAW_ADJUST))
+        logger.debug(f"历史库写入 {len(df)} 行 ({df[CODE_COLUMN].nunique()} 只股票)。", extra={'stock': 'NONE', 'strategy': '历史库'})
+        return len(df)
+
+    def segments(self, year):
+        """Returns (base parts, delta parts) of one year partition, each in write order."""
+        files = self._part_files(year)
+        bases = [path for path in files if path.endswith(_BASE_SUFFIX)]
+        return bases, [path for path in files if not path.endswith(_BASE_SUFFIX)]
+
+    def needs_compaction(self, year):
+        with self._files_lock.reading():
+            bases, deltas = self.segments(year)
+            if len(bases) > 1 or len(deltas) > COMPACT_MAX_DELTAS:
+                return True
+            if not deltas:
+                return False
+            # Row counts come from the Parquet footers, no data is read
+            base_rows = sum(pq.ParquetFile(path).metadata.num_rows for path in bases)
+            return sum(pq.ParquetFile(path).metadata.num_rows for path in deltas) > base_rows * COMPACT_MAX_DELTA_RATIO
+
+    def compact(self, force=False):
+        """
+        Folds the delta parts of every year that needs it (all years with deltas when
+        `force`) into a single base part. Parts written while compacting are kept as
+        deltas. Returns {year: number of parts folded}.
+        """
+        compacted = {}
+        for year in self.years():
+            with self._write_lock:
+                bases, deltas = self.segments(year)
+                files = bases + deltas
+                if len(files) <= 1 or not (force or self.needs_compaction(year)):
+                    continue
+                table = ds.dataset(files, format="parquet").to_table(columns=HISTORY_COLUMNS)
+                df = table.to_pandas().drop_duplicates(subset=[CODE_COLUMN, DATE_COLUMN], keep='last')
+                df = df.sort_values([CODE_COLUMN, DATE_COLUMN], kind='stable').reset_index(drop=True)
+                # The base takes the stamp of the newest part it contains, so it sorts after everything it replaces
+                stamp = max(_part_stamp(path) for path in files)
+                base_path = os.path.join(self.root, f"year={year}", f"part-{stamp:020d}{_BASE_SUFFIX}")
+                # Running scans finish on the old parts first; new ones see only the base
+                with self._files_lock.writing():
+                    _write_atomic(pa.Table.from_pandas(df, preserve_index=False), base_path)
+                    for path in files:
+                        if path != base_path:
+                            os.remove(path)
+                for tmp_path in glob.glob(os.path.join(self.root, f"year={year}", f"*{_TMP_SUFFIX}")):
+                    os.remove(tmp_path)
+            compacted[year] = len(files)
+            logger.info(f"历史库 {year} 年: 已把 {len(files)} 个分段合并为 1 个 ({len(df)} 行)。", extra={'stock': 'NONE', 'strategy': '历史库'})
+        return compacted
+
+    def compact_in_background(self):
+        """
+        Runs compact() on a background thread if any year needs it (None otherwise).
+        The thread is never a daemon (even when started from one): interpreter exit
+        waits for it instead of tearing down pyarrow mid-scan.
+        """
+        if not any(self.needs_compaction(year) for year in self.years()):
+            return None
+        thread = threading.Thread(target=self.compact, name="history-compaction", daemon=False)
+        thread.start()
+        return thread
+
+    def _scan(self, columns, expr):
+        """Lists the parts and reads them as one table (None for an empty store)."""
+        for attempt in range(SCAN_ATTEMPTS):
+            with self._files_lock.reading():
+                dataset = self._dataset()
+                if dataset is None:
+                    return None
+                try:
+                    return dataset.to_table(columns=columns, filter=expr)
+                except FileNotFoundError:
+                    if attempt == SCAN_ATTEMPTS - 1:
+                        raise
+            logger.debug("历史库分段在读取时被合并，重新扫描。", extra={'stock': 'NONE', 'strategy': '历史库'})
+
+    def load(self, codes=None, start_date=None, end_date=None, columns=None, adjust=None):
+        """
+        Reads bars for `codes` (all stocks if None) in one dataset scan.
+        Returns a long DataFrame sorted by (股票代码, 日期) with duplicate bars
+        resolved in favour of the most recently written row, and prices adjusted
+        to `adjust` (defaults to the store's mode; 'none' for raw bars).
+        """
+        columns = list(columns) if columns else list(HISTORY_COLUMNS)
+        for col in (CODE_COLUMN, DATE_COLUMN):
+            if col not in columns:
+                columns.insert(0, col)
+
+        expr = None
+        if codes is not None:
+            expr = ds.field(CODE_COLUMN).isin([str(c) for c in codes])
+        if start_date is not None:
+            start_ts = pd.Timestamp(start_date)
+            cond = (ds.field('year') >= start_ts.year) & (ds.field(DATE_COLUMN) >= _ts_scalar(start_ts))
+            expr = cond if expr is None else expr & cond
+        if end_date is not None:
+            end_ts = pd.Timestamp(end_date)
+            cond = (ds.field('year') <= end_ts.year) & (ds.field(DATE_COLUMN) <= _ts_scalar(end_ts))
+            expr = cond if expr is None else expr & cond
+
+        table = self._scan(columns, expr)
+        if table is None:
+            return pd.DataFrame(columns=columns)
+        df = table.to_pandas()
+        if df.empty:
+            return df
+        # Later part files win when the same bar was written twice (e.g. a re-run on the same day)
+        df = df.drop_duplicates(subset=[CODE_COLUMN, DATE_COLUMN], keep='last')
+        df = df.sort_values([CODE_COLUMN, DATE_COLUMN], kind='stable').reset_index(drop=True)
+        adjust = self.adjust if adjust is None else adjust
+        if adjust != RAW_ADJUST:
+            df = apply_adjustment(df, self.factors.load(codes), adjust)
+        return df
+
+    def load_last_n(self, n, codes=None, end_date=None, adjust=None):
+        """
+        Returns the last `n` bars of every stock (or of `codes`) as one long DataFrame.
+        Only the year partitions that can contain those bars are scanned.
+        """
+        years = self.years()
+        if not years:
+            return pd.DataFrame(columns=HISTORY_COLUMNS)
+        last_year = years[-1] if end_date is None else min(years[-1], pd.Timestamp(end_date).year)
+        first_year = last_year - (n // SESSIONS_PER_YEAR + 1)
+        df = self.load(codes=codes, start_date=f"{first_year}-01-01", end_date=end_date, adjust=adjust)
+        if df.empty:
+            return df
+        return df.groupby(CODE_COLUMN, sort=False).tail(n).reset_index(drop=True)
+
+    def ensure_manifest(self):
+        """Builds the manifest from the data files when it is missing (e.g. stores written before it existed)."""
+        if self.years() and self.manifest.is_empty():
+            logger.info("缓存清单为空，正在根据历史库重建...", extra={'stock': 'NONE', 'strategy': '历史库'})
+            self.manifest.replace_all(self.load(adjust=RAW_ADJUST), RAW_ADJUST)
+        return self.manifest
+
+    def last_dates(self, codes=None):
+        """Returns a Series mapping 股票代码 to its latest cached 日期 (answered from the manifest)."""
+        entries = self.ensure_manifest().entries(codes)
+        return entries['last_date'].rename_axis(CODE_COLUMN).rename(DATE_COLUMN)
+
+    def load_stocks(self, codes=None, start_date=None, end_date=None, adjust=None):
+        """Loads bars in one scan and splits them into a {code: DataFrame} dict."""
+        return split_by_stock(self.load(codes=codes, start_date=start_date, end_date=end_date, adjust=adjust))
+
+    def load_compact(self, codes=None, start_date=None, end_date=None, adjust=None):
+        """Like load_stocks() but returns {code: ohlcv.OHLCVFrame} typed arrays."""
+        return split_long_frame(self.load(codes=codes, start_date=start_date, end_date=end_date, adjust=adjust))
+
+
+def split_by_stock(df):
+    """Splits a long history frame into {code: per-stock DataFrame} with a fresh index."""
+    if df is None or df.empty:
+        return {}
+    return {code: group.reset_index(drop=True) for code, group in df.groupby(CODE_COLUMN, sort=False)}
+
+
+def find_legacy_files(cache_dir):
+    """Returns {code: path} for the old one-file-per-stock cache entries in `cache_dir`."""
+    legacy = {}
+    if not os.path.isdir(cache_dir):
+        return legacy
+    for file_name in os.listdir(cache_dir):
+        match = _LEGACY_FILE_PATTERN.match(file_name)
+        if match:
+            legacy[match.group(1)] = os.path.join(cache_dir, file_name)
+    return legacy
+
+
+def migrate_per_stock_files(cache_dir, remove=False, source_adjust=DEFAULT_ADJUST):
+    """
+    Folds the legacy `{code}.parquet` files of `cache_dir` into the history store
+    with a single append. The legacy cache holds `source_adjust` prices (hfq for
+    data_fetcher_new); they are converted back to raw bars with the stocks'
+    adjustment factors, which are downloaded first where missing.
+    Returns the number of stocks migrated.
+    """
+    legacy = find_legacy_files(cache_dir)
+    if not legacy:
+        logger.info(f"{cache_dir} 中没有需要迁移的单股票缓存文件。", extra={'stock': 'NONE', 'strategy': '历史库'})
+        return 0
+
+    frames = []
+    migrated_paths = []
+    for code, path in sorted(legacy.items()):
+        try:
+            frames.append(_normalize(pd.read_parquet(path), code=code))
+            migrated_paths.append(path)
+        except Exception as e:
+            logger.warning(f"读取旧缓存文件 {path} 失败: {e}，跳过。", extra={'stock': code, 'strategy': '历史库'})
+
+    if not frames:
+        return 0
+
+    store = HistoryStore(cache_dir)
+    bars = pd.concat(frames, ignore_index=True)
+    if source_adjust != RAW_ADJUST:
+        codes = sorted(bars[CODE_COLUMN].unique())
+        store.factors.refresh(store.factors.codes_to_refresh(codes))
+        bars = apply_adjustment(bars, store.factors.load(codes), source_adjust, inverse=True)
+        bars[PRICE_COLUMNS] = bars[PRICE_COLUMNS].round(2)
+    rows = store.append(bars)
+    logger.info(f"已迁移 {len(migrated_paths)} 只股票共 {rows} 行数据到 {store.root}。", extra={'stock': 'NONE', 'strategy': '历史库'})
+
+    if remove:
+        for path in migrated_paths:
+            os.remove(path)
+    return len(migrated_paths)
+
+
+if __name__ == '__main__':
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                            handlers=[logging.StreamHandler(sys.stdout)])
+
+    parser = argparse.ArgumentParser(description="Sequoia 历史行情库工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help="把旧的 {code}.parquet 缓存迁移到合并历史库")
+    migrate_parser.add_argument('--cache-dir', default="data")
+    migrate_parser.add_argument('--remove', action='store_true', help="迁移成功后删除旧文件")
+    migrate_parser.add_argument('--source-adjust', default=DEFAULT_ADJUST, choices=['qfq', 'hfq', RAW_ADJUST],
+                                help="旧缓存的复权方式，迁移时换算回不复权价格")
+    compact_parser = subparsers.add_parser('compact', help="把每年的增量分段合并为一个基础文件")
+    compact_parser.add_argument('--cache-dir', default="data")
+    compact_parser.add_argument('--force', action='store_true', help="不论分段数量都合并")
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        migrate_per_stock_files(args.cache_dir, remove=args.remove, source_adjust=args.source_adjust)
+    elif args.command == 'compact':
+        HistoryStore(args.cache_dir).compact(force=args.force)
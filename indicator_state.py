@@ -0,0 +1,390 @@
+# indicator_state.py
+# -*- encoding: UTF-8 -*-
+"""
+Incremental indicator state, so a daily run advances each indicator by one bar
+instead of recomputing it over the whole history.
+
+For every (stock, indicator, params) the store keeps the recursive state TA-Lib
+would carry from one bar to the next (EMA accumulators, Wilder averages, the ring
+buffer and running total of a moving window) plus the last `keep` outputs:
+
+    dif, dea, hist = indicator_state.tail(code, data, 'MACD', fastperiod=12, slowperiod=26, signalperiod=9)
+
+returns the last min(keep, len(data)) values aligned with the last rows of `data`.
+When `data` extends the bars the state was built on, only the new bars are stepped.
+Anything else (adjusted prices that changed, missing or rewritten bars, a NaN in a
+new bar, history still shorter than the indicator's warm-up) rebuilds the state
+from TA-Lib over the full history. Stepped values match TA-Lib to floating point
+rounding.
+
+States persist to `{data_dir}/indicator_state.pkl` (settings 'indicator_state').
+"""
+import logging
+import math
+import os
+import pickle
+import threading
+from collections import deque
+
+import numpy as np
+import talib as tl
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "indicator_state.pkl"
+DEFAULT_KEEP = 30
+# More new bars than this are recomputed with TA-Lib rather than stepped in Python
+MAX_STEPS = 64
+
+
+def _ema_step(prev, value, k):
+    # TA-Lib's EMA recursion, term for term
+    return (value - prev) * k + prev
+
+
+class _Sma:
+    """SMA / MA(matype=0) of one column: window ring buffer and running total."""
+
+    def __init__(self, column='收盘', timeperiod=30):
+        self.columns = (column,)
+        self.period = timeperiod
+        self.lookback = timeperiod - 1
+
+    def reset(self, values):
+        (x,) = values
+        self.window = deque(x[-self.period:].tolist(), maxlen=self.period)
+        self.total = math.fsum(self.window)
+        return tl.SMA(x, timeperiod=self.period)
+
+    def step(self, value):
+        self.total += value - self.window[0]
+        self.window.append(value)
+        return self.total / self.period
+
+
+class _Macd:
+    """MACD: fast and slow EMA of 收盘 and the signal EMA of their difference."""
+
+    def __init__(self, fastperiod=12, slowperiod=26, signalperiod=9):
+        self.columns = ('收盘',)
+        if slowperiod < fastperiod:
+            fastperiod, slowperiod = slowperiod, fastperiod
+        self.fast, self.slow, self.signal = fastperiod, slowperiod, signalperiod
+        self.k_fast, self.k_slow, self.k_signal = 2.0 / (fastperiod + 1), 2.0 / (slowperiod + 1), 2.0 / (signalperiod + 1)
+        self.lookback = (slowperiod - 1) + (signalperiod - 1)
+
+    def reset(self, values):
+        (x,) = values
+        dif, dea, hist = tl.MACD(x, fastperiod=self.fast, slowperiod=self.slow, signalperiod=self.signal)
+        if len(x) > self.lookback:
+            # TA-Lib seeds the fast EMA so that it starts on the same bar as the slow one
+            self.fast_ema = float(tl.EMA(x[self.slow - self.fast:], timeperiod=self.fast)[-1])
+            self.slow_ema = float(tl.EMA(x, timeperiod=self.slow)[-1])
+            self.signal_ema = float(dea[-1])
+        return dif, dea, hist
+
+    def step(self, value):
+        self.fast_ema = _ema_step(self.fast_ema, value, self.k_fast)
+        self.slow_ema = _ema_step(self.slow_ema, value, self.k_slow)
+        dif = self.fast_ema - self.slow_ema
+        self.signal_ema = _ema_step(self.signal_ema, dif, self.k_signal)
+        return dif, self.signal_ema, dif - self.signal_ema
+
+
+class _Stoch:
+    """STOCH with SMA smoothing: highs/lows of the %K window and the last raw and slow %K."""
+
+    def __init__(self, fastk_period=5, slowk_period=3, slowd_period=3):
+        self.columns = ('最高', '最低', '收盘')
+        self.fastk_period, self.slowk_period, self.slowd_period = fastk_period, slowk_period, slowd_period
+        self.lookback = (fastk_period - 1) + (slowk_period - 1) + (slowd_period - 1)
+
+    def reset(self, values):
+        high, low, close = values
+        slowk, slowd = tl.STOCH(high, low, close, fastk_period=self.fastk_period,
+                                slowk_period=self.slowk_period, slowd_period=self.slowd_period)
+        fastk, _ = tl.STOCHF(high, low, close, fastk_period=self.fastk_period, fastd_period=1)
+        self.highs = deque(high[-self.fastk_period:].tolist(), maxlen=self.fastk_period)
+        self.lows = deque(low[-self.fastk_period:].tolist(), maxlen=self.fastk_period)
+        self.fastk = deque(fastk[-self.slowk_period:].tolist(), maxlen=self.slowk_period)
+        # STOCH only outputs %K from where %D starts; the state needs the bars before that too
+        self.slowk = deque(tl.SMA(fastk, timeperiod=self.slowk_period)[-self.slowd_period:].tolist(), maxlen=self.slowd_period)
+        return slowk, slowd
+
+    def step(self, value):
+        high, low, close = value
+        self.highs.append(high)
+        self.lows.append(low)
+        highest, lowest = max(self.highs), min(self.lows)
+        diff = (highest - lowest) / 100.0
+        self.fastk.append((close - lowest) / diff if diff != 0.0 else 0.0)
+        self.slowk.append(sum(self.fastk) / self.slowk_period)
+        return self.slowk[-1], sum(self.slowk) / self.slowd_period
+
+
+def _rsi(gain, loss):
+    total = gain + loss
+    # TA_IS_ZERO
+    return 100.0 * (gain / total) if not -1e-8 < total < 1e-8 else 0.0
+
+
+class _Rsi:
+    """Wilder RSI: previous close and the smoothed average gain and loss."""
+
+    def __init__(self, timeperiod=14):
+        self.columns = ('收盘',)
+        self.period = timeperiod
+        self.lookback = timeperiod
+
+    def reset(self, values):
+        (x,) = values
+        closes = x.tolist()
+        n = self.period
+        self.prev, self.gain, self.loss = closes[0], 0.0, 0.0
+        for close in closes[1:n + 1]:
+            self._accumulate(close)
+        self.gain /= n
+        self.loss /= n
+        for close in closes[n + 1:]:
+            self.step(close)
+        return tl.RSI(x, timeperiod=n)
+
+    def _accumulate(self, close):
+        change = close - self.prev
+        self.prev = close
+        if change < 0:
+            self.loss -= change
+        else:
+            self.gain += change
+
+    def step(self, value):
+        n = self.period
+        self.gain *= (n - 1)
+        self.loss *= (n - 1)
+        self._accumulate(value)
+        self.gain /= n
+        self.loss /= n
+        return _rsi(self.gain, self.loss)
+
+
+class _Bbands:
+    """BBANDS with SMA middle band: the window of closes."""
+
+    def __init__(self, timeperiod=5, nbdevup=2, nbdevdn=2):
+        self.columns = ('收盘',)
+        self.period, self.nbdevup, self.nbdevdn = timeperiod, nbdevup, nbdevdn
+        self.lookback = timeperiod - 1
+
+    def reset(self, values):
+        (x,) = values
+        self.window = deque(x[-self.period:].tolist(), maxlen=self.period)
+        return tl.BBANDS(x, timeperiod=self.period, nbdevup=self.nbdevup, nbdevdn=self.nbdevdn)
+
+    def step(self, value):
+        self.window.append(value)
+        mean = sum(self.window) / self.period
+        variance = sum(v * v for v in self.window) / self.period - mean * mean
+        deviation = math.sqrt(variance) if variance > 0 else 0.0
+        return mean + deviation * self.nbdevup, mean, mean - deviation * self.nbdevdn
+
+
+# feature_store.INDICATORS name -> incremental implementation (same parameter names)
+INCREMENTAL = {'MA': _Sma, 'SMA': _Sma, 'MACD': _Macd, 'STOCH': _Stoch, 'RSI': _Rsi, 'BBANDS': _Bbands}
+
+
+class _Bars:
+    """Column arrays of one stock's frame, extracted once for all of its indicators."""
+
+    def __init__(self, data):
+        self.data = data
+        self._columns = {}
+        self.dates = data['日期'].values
+        self.close = self._columns['收盘'] = data['收盘'].values
+
+    def __len__(self):
+        return len(self.dates)
+
+    def column(self, name, start=0):
+        """float64 values of column `name` from row `start` on; only that part is converted."""
+        values = self._columns.get(name)
+        if values is None:
+            values = self._columns[name] = self.data[name].values
+        return np.asarray(values[start:], dtype=np.float64)
+
+    def fingerprint(self, i):
+        return self.dates[i], float(self.close[i])
+
+
+class _Entry:
+    """One indicator of one stock: its state, the bars it has seen and its recent outputs."""
+
+    def __init__(self, indicator, keep):
+        self.indicator = indicator
+        self.keep = keep
+        self.ready = False
+
+    def inputs(self, bars, start=0):
+        return tuple(bars.column(column, start) for column in self.indicator.columns)
+
+    def reset(self, bars):
+        values = self.inputs(bars)
+        outputs = self.indicator.reset(values)
+        outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        self.tails = [deque(np.asarray(output)[-self.keep:].tolist(), maxlen=self.keep) for output in outputs]
+        self.bars = len(bars)
+        self.first, self.last = bars.fingerprint(0), bars.fingerprint(-1)
+        # Stepping needs the full warm-up and a history TA-Lib ran over without gaps
+        self.ready = len(bars) > self.indicator.lookback and not any(np.isnan(v).any() for v in values)
+
+    def can_step(self, bars):
+        if not self.ready:
+            return False
+        new = len(bars) - self.bars
+        return 0 <= new <= MAX_STEPS and bars.fingerprint(0) == self.first and bars.fingerprint(self.bars - 1) == self.last
+
+    def advance(self, bars):
+        """Steps the bars after the ones already seen; False if they contain NaN."""
+        values = self.inputs(bars, start=self.bars)
+        if any(np.isnan(v).any() for v in values):
+            return False
+        single = len(values) == 1
+        for row in zip(*(v.tolist() for v in values)):
+            outputs = self.indicator.step(row[0] if single else row)
+            for tail, output in zip(self.tails, outputs if isinstance(outputs, tuple) else (outputs,)):
+                tail.append(output)
+        self.bars = len(bars)
+        self.last = bars.fingerprint(-1)
+        return True
+
+    def result(self, length):
+        arrays = tuple(np.array(tail)[-length:] if length else np.empty(0) for tail in self.tails)
+        return arrays if len(arrays) > 1 else arrays[0]
+
+
+class IndicatorStateStore:
+    """Per (stock, indicator, params) incremental states with step/recompute counters."""
+
+    def __init__(self, keep=DEFAULT_KEEP, path=None):
+        self.keep = keep
+        self.path = path
+        self._entries = {}
+        self._stats = {'step': 0, 'recompute': 0}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def tails(self, code, data, specs):
+        """
+        tail() of every (name, params) in `specs` on the same `data`, as a list; the
+        frame's columns are read once for all of them.
+        """
+        if isinstance(code, tuple):
+            code = code[0]
+        keys = [(str(code), name, tuple(sorted(params.items()))) for name, params in specs]
+        with self._lock:
+            entries = [self._entries.pop(key, None) for key in keys]
+
+        bars = _Bars(data)
+        length = min(self.keep, len(bars))
+        results, outcomes = [], []
+        for i, (name, params) in enumerate(specs):
+            entry = entries[i]
+            if entry is None or entry.keep != self.keep:
+                entry = entries[i] = _Entry(INCREMENTAL[name](**params), self.keep)
+            if not length:
+                results.append(entry.result(0))
+                continue
+            if entry.can_step(bars) and entry.advance(bars):
+                outcomes.append('step')
+            else:
+                entry.reset(bars)
+                outcomes.append('recompute')
+            results.append(entry.result(length))
+
+        with self._lock:
+            self._entries.update(zip(keys, entries))
+            for outcome in outcomes:
+                self._stats[outcome] += 1
+        return results
+
+    def tail(self, code, data, name, **params):
+        """Last min(keep, len(data)) values of indicator `name`, aligned with the last rows of `data`."""
+        return self.tails(code, data, [(name, params)])[0]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                self._entries = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"读取指标状态 {self.path} 失败: {e}", extra={'stock': 'NONE', 'strategy': '指标状态'})
+
+    def save(self):
+        """Writes the states to `path` (no-op without one)."""
+        if not self.path:
+            return
+        with self._lock:
+            entries = dict(self._entries)
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"保存指标状态 {self.path} 失败: {e}", extra={'stock': 'NONE', 'strategy': '指标状态'})
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def enabled():
+    return bool((settings.get_config().get('indicator_state', {}) or {}).get('enabled', False))
+
+
+def get_store():
+    """Process-wide IndicatorStateStore configured from settings 'indicator_state'."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            config = settings.get_config()
+            options = config.get('indicator_state', {}) or {}
+            path = os.path.join(config.get('data_dir', 'stock_data_cache'), STATE_FILE)
+            _store = IndicatorStateStore(keep=int(options.get('keep', DEFAULT_KEEP)), path=path)
+        return _store
+
+
+def tail(code, data, name, **params):
+    """`get_store().tail(...)`; `code` may be the (code, name) tuple strategies receive."""
+    return get_store().tail(code, data, name, **params)
+
+
+def tails(code, data, specs):
+    """`get_store().tails(...)`."""
+    return get_store().tails(code, data, specs)
+
+
+def save():
+    if _store is not None:
+        _store.save()
+
+
+def log_stats():
+    if _store is None:
+        return
+    stats = _store.stats()
+    logger.info(f"指标状态: 增量推进 {stats['step']} 次, 全量重算 {stats['recompute']} 次, {stats['entries']} 项",
+                extra={'stock': 'NONE', 'strategy': '指标状态'})
+
+
+def reset():
+    """Drops the process-wide store (mainly for tests)."""
+    global _store
+    with _store_lock:
+        _store = None
@@ -12,7 +12,7 @@ from pathlib import Path
 
 
 def job():
-    if utils.is_weekday():
+    if utils.is_trading_day():
         work_flow.prepare()
         work_flow_new.prepare()
 
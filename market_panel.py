@@ -0,0 +1,173 @@
+# market_panel.py
+# -*- encoding: UTF-8 -*-
+"""
+Market panel: the whole cached universe as aligned stocks × trading-days arrays.
+
+Each field (open/close/high/low/volume/amount/turnover) is one C-ordered 2-D array,
+row i = stock `codes[i]`, column j = session `dates[j]`. Days on which a stock has no
+bar (not listed yet, suspended, delisted) are NaN, so cross-sectional questions are
+plain column operations:
+
+    panel = MarketPanel.from_store("data")
+    close = panel.field('close')
+    rising = panel.cross_section('close', '2025-06-30') > panel.cross_section('close', '2025-06-27')
+
+`as_of()` / `window()` slice columns and `stock_view()` slices one row, all without
+copying. `stock_frame()` rebuilds the legacy per-stock DataFrame expected by
+`check_enter(code_tuple, df, end_date)`.
+"""
+import numpy as np
+import pandas as pd
+
+from history_store import CODE_COLUMN, DATE_COLUMN, HistoryStore
+from ohlcv import COLUMN_FIELDS, FIELDS, OHLCVFrame
+
+# float64 throughout: check_universe forms compare percent changes and ratios with
+# thresholds (涨幅 >= 2, <= -9.5, ...) and must see the same bars as the per-stock checks,
+# which float32 prices (3.06 -> 3.0599999) would move across a threshold
+FIELD_DTYPES = {
+    'open': np.float64, 'close': np.float64, 'high': np.float64, 'low': np.float64,
+    'volume': np.float64, 'amount': np.float64, 'turnover': np.float64,
+}
+PANEL_FIELDS = tuple(FIELD_DTYPES)
+
+
+def _to_day(value):
+    return np.datetime64(pd.Timestamp(value).date(), 'D')
+
+
+class MarketPanel:
+    """Aligned 2-D arrays (stocks × sessions) per field with code/date index maps."""
+
+    __slots__ = ('codes', 'dates', 'code_index', 'fields')
+
+    def __init__(self, codes, dates, fields):
+        self.codes = np.asarray(codes, dtype=object)
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.fields = fields
+
+    @classmethod
+    def from_long_frame(cls, df, sessions=None):
+        """
+        Builds a panel from a long (股票代码, 日期, bar columns...) frame. `sessions`
+        fixes the date axis (e.g. calendar sessions); by default it is every date present.
+        """
+        if df is None or df.empty:
+            return cls([], [], {field: np.empty((0, 0), dtype=dtype) for field, dtype in FIELD_DTYPES.items()})
+        row, codes = pd.factorize(df[CODE_COLUMN].astype(str), sort=True)
+        days = pd.to_datetime(df[DATE_COLUMN]).values.astype('datetime64[D]')
+        dates = np.unique(days) if sessions is None else np.unique(np.asarray(sessions, dtype='datetime64[D]'))
+        # Bars on days outside a given session axis are dropped
+        col = np.minimum(np.searchsorted(dates, days), max(len(dates) - 1, 0))
+        on_axis = dates[col] == days if len(dates) else np.zeros(len(days), dtype=bool)
+        row, col = row[on_axis], col[on_axis]
+
+        fields = {}
+        for column, field in COLUMN_FIELDS.items():
+            values = np.full((len(codes), len(dates)), np.nan, dtype=FIELD_DTYPES[field])
+            if column in df.columns:
+                values[row, col] = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)[on_axis]
+            fields[field] = values
+        return cls(list(codes), dates, fields)
+
+    @classmethod
+    def from_frames(cls, frames, sessions=None):
+        """Builds a panel from {code or (code, name): per-stock DataFrame}, e.g. data_fetcher_new.run()'s result."""
+        parts = []
+        for key, df in frames.items():
+            if df is None or df.empty:
+                continue
+            code = key[0] if isinstance(key, tuple) else key
+            parts.append(df.assign(**{CODE_COLUMN: code}))
+        return cls.from_long_frame(pd.concat(parts, ignore_index=True) if parts else None, sessions=sessions)
+
+    @classmethod
+    def from_store(cls, cache_dir="stock_data_cache", codes=None, start_date=None, end_date=None, sessions=None):
+        """Loads the panel from the history store in a single scan."""
+        df = HistoryStore(cache_dir).load(codes=codes, start_date=start_date, end_date=end_date)
+        return cls.from_long_frame(df, sessions=sessions)
+
+    @property
+    def shape(self):
+        return len(self.codes), len(self.dates)
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.fields.values())
+
+    def field(self, name):
+        return self.fields[name]
+
+    def row(self, code):
+        """Row of `code`; KeyError if it is not in the panel."""
+        return self.code_index[str(code)]
+
+    def column(self, date):
+        """Column of session `date`; KeyError if it is not on the date axis."""
+        day = _to_day(date)
+        j = int(np.searchsorted(self.dates, day))
+        if j >= len(self.dates) or self.dates[j] != day:
+            raise KeyError(date)
+        return j
+
+    def column_as_of(self, date):
+        """Column of the last session on or before `date` (-1 if there is none)."""
+        return int(np.searchsorted(self.dates, _to_day(date), side='right')) - 1
+
+    def window(self, start_date=None, end_date=None):
+        """Zero-copy panel restricted to sessions in [start_date, end_date]."""
+        lo = 0 if start_date is None else int(np.searchsorted(self.dates, _to_day(start_date), side='left'))
+        hi = len(self.dates) if end_date is None else int(np.searchsorted(self.dates, _to_day(end_date), side='right'))
+        panel = MarketPanel.__new__(MarketPanel)
+        panel.codes, panel.code_index = self.codes, self.code_index
+        panel.dates = self.dates[lo:hi]
+        panel.fields = {name: values[:, lo:hi] for name, values in self.fields.items()}
+        return panel
+
+    def as_of(self, end_date):
+        """Zero-copy panel of everything known at the close of `end_date`."""
+        return self.window(end_date=end_date)
+
+    def cross_section(self, name, date):
+        """One field of every stock on one session, as a Series indexed by code."""
+        return pd.Series(self.fields[name][:, self.column(date)], index=self.codes, name=name)
+
+    def bar_counts(self, end_date=None):
+        """Number of bars every stock has up to `end_date` (len() of its legacy frame)."""
+        stop = len(self.dates) if end_date is None else self.column_as_of(end_date) + 1
+        return (~np.isnan(self.fields['close'][:, :stop])).sum(axis=1)
+
+    def last_bars(self, name, n, end_date=None):
+        """
+        float64 (stocks × n) array of each stock's last `n` bars of field `name` up to
+        `end_date`, skipping days without a bar (what `data.tail(n)` gives per stock).
+        Stocks with fewer bars are NaN-padded on the left.
+        """
+        stop = len(self.dates) if end_date is None else self.column_as_of(end_date) + 1
+        present = ~np.isnan(self.fields['close'][:, :stop])
+        # Bars at or after each column, so the newest bar is 1
+        from_end = np.cumsum(present[:, ::-1], axis=1)[:, ::-1]
+        rows, cols = np.nonzero(present & (from_end <= n))
+        out = np.full((len(self.codes), n), np.nan)
+        out[rows, n - from_end[rows, cols]] = self.fields[name][rows, cols]
+        return out
+
+    def stock_view(self, code, end_date=None):
+        """
+        Zero-copy OHLCVFrame over one stock's row, trimmed to its first..last bar (up to
+        `end_date`). Suspension days inside that range stay NaN.
+        """
+        i = self.row(code)
+        stop = len(self.dates) if end_date is None else self.column_as_of(end_date) + 1
+        present = np.flatnonzero(~np.isnan(self.fields['close'][i, :stop]))
+        lo, hi = (present[0], present[-1] + 1) if len(present) else (0, 0)
+        arrays = {field: self.fields[field][i, lo:hi] for field in PANEL_FIELDS}
+        return OHLCVFrame(str(self.codes[i]), (self.dates[lo:hi] - np.datetime64('1970-01-01', 'D')).astype(np.int32),
+                          *(arrays[field] for field in FIELDS[1:]))
+
+    def stock_frame(self, code, end_date=None, with_code=True):
+        """Legacy per-stock DataFrame (bars only, float64, sorted by 日期) for `check_enter(code_tuple, df, end_date)`."""
+        view = self.stock_view(code, end_date=end_date)
+        df = view.to_frame(with_code=with_code)
+        return df[df['收盘'].notna()].reset_index(drop=True)
@@ -1,5 +1,8 @@
+import argparse
+import contextlib
 import utils
 import logging
+import replay
 import work_flow_new
 import settings
 import schedule
@@ -7,10 +10,15 @@ import time
 from pathlib import Path
 import sys
 
-def configure_logging():
+# DEBUG adds the per-stock rejection messages of the strategies; at INFO they are never
+# formatted and only the per-run funnel (funnel.py) is logged
+LOG_LEVEL = logging.INFO
+
+def configure_logging(level=LOG_LEVEL):
     """Configures the root logger to output to both file and console."""
     logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG) # Set to DEBUG for development/debugging, INFO for production
+    # On the root logger too: logger.isEnabledFor() checks the logger level, not the handlers'
+    logger.setLevel(level)
 
     # Clear existing handlers to prevent duplicate logs if re-run in same session
     # This is crucial for environments like Jupyter notebooks or repeated runs
@@ -20,14 +28,14 @@ def configure_logging():
 
     # File Handler
     file_handler = logging.FileHandler('sequoia.log', encoding='utf-8')
-    file_handler.setLevel(logging.INFO) # File logs INFO and above
+    file_handler.setLevel(level)
     file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     file_handler.setFormatter(file_formatter)
     logger.addHandler(file_handler)
 
     # Console Handler
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO) # Console logs INFO and above
+    console_handler.setLevel(level)
     console_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%H:%M:%S')
     console_handler.setFormatter(console_formatter)
     logger.addHandler(console_handler)
@@ -39,16 +47,33 @@ logger = logging.getLogger(__name__) # Get the main logger for main.py's own use
 # Initialize your settings AFTER logging is configured
 settings.init()
 
+parser = argparse.ArgumentParser(description="Sequoia 选股")
+parser.add_argument('--profile', metavar='STAGE', help="以 cProfile 运行该阶段 (spot, ingest, lhb, evaluate, universe, backtest, push)，结果写入运行报告")
+parser.add_argument('--profile-memory', metavar='STAGE', help="以 tracemalloc 追踪该阶段的内存分配，结果写入运行报告")
+parser.add_argument('--record', metavar='DIR', help="把本次运行的实时行情、龙虎榜和个股行情记录到该目录")
+parser.add_argument('--replay', metavar='DIR', help="不联网重放 --record 记录的运行 (不检查交易日)")
+parser.add_argument('--latency', type=float, help="回放时每只股票模拟的上游延迟(秒)，默认取配置 replay.latency")
+args = parser.parse_args()
+profile_options = settings.get_config().setdefault('profile', {})
+if args.profile:
+    profile_options['cprofile'] = args.profile
+if args.profile_memory:
+    profile_options['tracemalloc'] = args.profile_memory
+
 def job():
     """The main job to be scheduled or run immediately."""
-    if utils.is_weekday():
+    if utils.is_trading_day():
         logger.info("Running stock analysis job.", extra={'stock': 'NONE', 'strategy': '调度'})
-        work_flow_new.prepare()
+        with replay.recording(args.record) if args.record else contextlib.nullcontext():
+            work_flow_new.prepare()
     else:
-        logger.info("Today is not a weekday, skipping stock analysis job.", extra={'stock': 'NONE', 'strategy': '调度'})
+        logger.info("Today is not a trading day, skipping stock analysis job.", extra={'stock': 'NONE', 'strategy': '调度'})
 
 # Access config using settings.get_config()
-if settings.get_config().get('cron', False):
+if args.replay:
+    with replay.playback(args.replay, latency=args.latency):
+        work_flow_new.prepare()
+elif settings.get_config().get('cron', False):
     EXEC_TIME = "15:15"
     logger.info(f"Scheduling job to run daily at {EXEC_TIME}.", extra={'stock': 'NONE', 'strategy': '调度'})
     schedule.every().day.at(EXEC_TIME).do(job)
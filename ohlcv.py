@@ -0,0 +1,162 @@
+# ohlcv.py
+# -*- encoding: UTF-8 -*-
+"""
+Compact typed in-memory representation of one stock's daily bars.
+
+Compared with the DataFrame returned by the fetcher (float64 everywhere, datetime64
+日期, sometimes a per-row 股票代码 object column) an OHLCVFrame stores:
+
+    dates     int32   days since 1970-01-01
+    open/high/low/close/amount/turnover   float32
+    volume    int32 (int64 only if a value does not fit)
+
+and no per-row code. Fields are plain NumPy arrays, `as_of()` slices are views, and
+`to_frame()` rebuilds the legacy DataFrame (float64, Chinese column names) for
+strategies that expect it.
+
+    python ohlcv.py --cache-dir data     # memory per stock before/after
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Legacy column name -> OHLCVFrame field
+COLUMN_FIELDS = {
+    '开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low',
+    '成交量': 'volume', '成交额': 'amount', '换手率': 'turnover',
+}
+FLOAT_FIELDS = ('open', 'high', 'low', 'close', 'amount', 'turnover')
+FIELDS = ('dates',) + FLOAT_FIELDS[:4] + ('volume',) + FLOAT_FIELDS[4:]
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+_INT32_MAX = np.iinfo(np.int32).max
+
+
+def to_day_numbers(dates):
+    """datetime-like values -> int32 days since 1970-01-01."""
+    return (pd.to_datetime(dates).values.astype('datetime64[D]') - _EPOCH).astype(np.int32)
+
+
+def from_day_numbers(days):
+    """int32 days since 1970-01-01 -> datetime64[ns] array."""
+    return (np.asarray(days).astype('timedelta64[D]') + _EPOCH).astype('datetime64[ns]')
+
+
+def _volume_array(values):
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0)
+    if len(values) and np.abs(values).max() > _INT32_MAX:
+        return np.rint(values).astype(np.int64)
+    return np.rint(values).astype(np.int32)
+
+
+class OHLCVFrame:
+    """Daily bars of one stock as typed NumPy arrays."""
+
+    __slots__ = ('code', 'dates', 'open', 'high', 'low', 'close', 'volume', 'amount', 'turnover')
+
+    def __init__(self, code, dates, open, high, low, close, volume, amount, turnover):
+        self.code = code
+        self.dates = dates
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.amount = amount
+        self.turnover = turnover
+
+    @classmethod
+    def from_frame(cls, df, code=None):
+        """Builds a compact frame from a legacy per-stock DataFrame (sorted by 日期)."""
+        if code is None and '股票代码' in df.columns and len(df):
+            code = str(df['股票代码'].iloc[0])
+        arrays = {}
+        for column, field in COLUMN_FIELDS.items():
+            if column not in df.columns:
+                values = np.zeros(len(df)) if field == 'volume' else np.full(len(df), np.nan)
+            else:
+                values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            arrays[field] = _volume_array(values) if field == 'volume' else values.astype(np.float32)
+        return cls(code, to_day_numbers(df['日期']), **arrays)
+
+    def to_frame(self, with_code=False):
+        """Rebuilds the legacy DataFrame (float64 columns) for strategies written against it."""
+        data = {'日期': from_day_numbers(self.dates)}
+        for column, field in COLUMN_FIELDS.items():
+            data[column] = getattr(self, field).astype(np.float64)
+        df = pd.DataFrame(data)
+        if with_code:
+            df.insert(0, '股票代码', self.code)
+        return df
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, field).nbytes for field in FIELDS)
+
+    def _slice(self, start, stop):
+        return OHLCVFrame(self.code, *(getattr(self, field)[start:stop] for field in FIELDS))
+
+    def as_of(self, end_date):
+        """Zero-copy view of the bars up to and including `end_date`."""
+        stop = int(np.searchsorted(self.dates, to_day_numbers([end_date])[0], side='right'))
+        return self._slice(0, stop)
+
+    def tail(self, n):
+        """Zero-copy view of the last `n` bars."""
+        return self._slice(max(0, len(self) - n), len(self))
+
+
+def split_long_frame(df, code_column='股票代码'):
+    """Splits a long (股票代码, 日期)-sorted history frame into {code: OHLCVFrame} without per-stock pandas work."""
+    if df is None or df.empty:
+        return {}
+    codes = df[code_column].to_numpy()
+    boundaries = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    stops = np.concatenate((boundaries, [len(df)]))
+
+    dates = to_day_numbers(df['日期'])
+    columns = {}
+    for column, field in COLUMN_FIELDS.items():
+        values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        columns[field] = _volume_array(values) if field == 'volume' else values.astype(np.float32)
+
+    return {
+        str(codes[start]): OHLCVFrame(str(codes[start]), dates[start:stop],
+                                      *(columns[field][start:stop] for field in FIELDS[1:]))
+        for start, stop in zip(starts, stops)
+    }
+
+
+def memory_report(df, code=None):
+    """Deep memory of a legacy frame vs. its compact representation, in bytes."""
+    compact = OHLCVFrame.from_frame(df, code=code)
+    before = int(df.memory_usage(deep=True, index=True).sum())
+    return {'rows': len(df), 'dataframe_bytes': before, 'compact_bytes': compact.nbytes,
+            'ratio': round(before / compact.nbytes, 2) if compact.nbytes else None}
+
+
+if __name__ == '__main__':
+    from history_store import HistoryStore, split_by_stock
+
+    parser = argparse.ArgumentParser(description="比较单只股票 DataFrame 与紧凑表示的内存占用")
+    parser.add_argument('--cache-dir', default="data")
+    parser.add_argument('--limit', type=int, default=50, help="最多统计多少只股票")
+    args = parser.parse_args()
+
+    frames = split_by_stock(HistoryStore(args.cache_dir).load())
+    reports = [memory_report(frame) for frame in list(frames.values())[:args.limit]]
+    if not reports:
+        print("历史库为空")
+        sys.exit(0)
+    rows = sum(r['rows'] for r in reports)
+    before = sum(r['dataframe_bytes'] for r in reports)
+    after = sum(r['compact_bytes'] for r in reports)
+    print(f"{len(reports)} stocks, {rows / len(reports):.0f} bars/stock: "
+          f"DataFrame {before / len(reports) / 1024:.1f} KiB/stock -> compact {after / len(reports) / 1024:.1f} KiB/stock "
+          f"({before / after:.1f}x smaller)")
@@ -0,0 +1,303 @@
+# profiler.py
+# -*- encoding: UTF-8 -*-
+"""
+Where a run spends its time: stage timers, spans, per-strategy latency histograms.
+
+The pipeline marks its stages, lower layers mark the spans worth seeing (cache reads,
+downloads, rate-limiter waits), and every strategy check is timed per stock:
+
+    profiler.start('work_flow_new')
+    with profiler.stage('spot'):
+        all_data = snapshot_cache.spot_snapshot()
+    with profiler.span('download', code=code):
+        ...
+    profiler.record_check(strategy_name, code, seconds)
+    profiler.finish()
+
+finish() logs the stage times and p50/p95/max per strategy and, with settings
+'profile' enabled, writes `run-<time>.json` (stages, spans, strategy latencies and
+whatever was attach()ed) and `run-<time>.trace.json`, a Chrome trace_event file for
+chrome://tracing or Perfetto, to `dir` (default `{data_dir}/runs`). Naming a stage in
+`cprofile` / `tracemalloc` (newmain.py --profile / --profile-memory) also runs that
+stage under cProfile (`run-<time>.prof` plus the top functions in the report) or
+tracemalloc (top allocation sites). cProfile only sees the thread running the stage.
+
+Worker processes hand their spans and checks to the parent with drain()/merge().
+"""
+import cProfile
+import datetime
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Trace events kept per run; spans beyond it are still aggregated
+DEFAULT_MAX_EVENTS = 200_000
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 20
+
+
+def _now_us():
+    return time.perf_counter_ns() // 1000
+
+
+class Profiler:
+    """Span aggregates, strategy latencies and trace events of one run."""
+
+    def __init__(self, name='run', max_events=DEFAULT_MAX_EVENTS):
+        self.name = name
+        self.max_events = max_events
+        self.started_at = datetime.datetime.now()
+        self.started_us = _now_us()
+        self.attached = {}
+        self.profiled = {}    # stage -> cProfile top functions / tracemalloc top sites
+        self.cprofiles = {}   # stage -> cProfile.Profile
+        self._spans = {}      # (cat, name) -> [count, seconds, max seconds]
+        self._latencies = {}  # strategy -> [seconds]
+        self._events = []
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, cat='span', end_us=None, **args):
+        """A span of `seconds` that ended at `end_us` (perf_counter µs; default now)."""
+        end_us = _now_us() if end_us is None else end_us
+        with self._lock:
+            aggregate = self._spans.get((cat, name))
+            if aggregate is None:
+                aggregate = self._spans[(cat, name)] = [0, 0.0, 0.0]
+            aggregate[0] += 1
+            aggregate[1] += seconds
+            aggregate[2] = max(aggregate[2], seconds)
+            self._add_event(name, cat, end_us, seconds, args)
+
+    def record_check(self, strategy, code, seconds):
+        end_us = _now_us()
+        with self._lock:
+            self._latencies.setdefault(strategy, []).append(seconds)
+            self._add_event(strategy, 'strategy', end_us, seconds, {'code': code})
+
+    def _add_event(self, name, cat, end_us, seconds, args):
+        if len(self._events) >= self.max_events:
+            self._dropped += 1
+            return
+        duration_us = int(seconds * 1e6)
+        self._events.append({'name': name, 'cat': cat, 'ph': 'X', 'ts': end_us - duration_us, 'dur': duration_us,
+                             'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+
+    def attach(self, key, value):
+        """Adds `value` (JSON-serializable) to the run report under `key`."""
+        with self._lock:
+            self.attached[key] = value
+
+    def drain(self):
+        """Spans, checks and events recorded since the last drain(), as a picklable snapshot; clears them."""
+        with self._lock:
+            snapshot = (self._spans, self._latencies, self._events, self._dropped)
+            self._spans, self._latencies, self._events, self._dropped = {}, {}, [], 0
+        return snapshot
+
+    def merge(self, snapshot):
+        spans, latencies, events, dropped = snapshot
+        with self._lock:
+            for key, (count, seconds, longest) in spans.items():
+                aggregate = self._spans.setdefault(key, [0, 0.0, 0.0])
+                aggregate[0] += count
+                aggregate[1] += seconds
+                aggregate[2] = max(aggregate[2], longest)
+            for strategy, values in latencies.items():
+                self._latencies.setdefault(strategy, []).extend(values)
+            room = max(0, self.max_events - len(self._events))
+            self._events.extend(events[:room])
+            self._dropped += dropped + max(0, len(events) - room)
+
+    def spans(self, cat=None):
+        """{name: {'count', 'seconds', 'max_seconds'}} of the spans of category `cat` (all if None)."""
+        with self._lock:
+            return {name: {'count': count, 'seconds': round(seconds, 6), 'max_seconds': round(longest, 6)}
+                    for (span_cat, name), (count, seconds, longest) in self._spans.items() if cat in (None, span_cat)}
+
+    def latencies(self):
+        """{strategy: {'count', 'p50_ms', 'p95_ms', 'max_ms', 'total_s'}} of the per-stock checks."""
+        with self._lock:
+            latencies = {strategy: np.array(values) for strategy, values in self._latencies.items()}
+        return {strategy: {'count': len(values),
+                           'p50_ms': round(float(np.percentile(values, 50)) * 1e3, 3),
+                           'p95_ms': round(float(np.percentile(values, 95)) * 1e3, 3),
+                           'max_ms': round(float(values.max()) * 1e3, 3),
+                           'total_s': round(float(values.sum()), 6)}
+                for strategy, values in latencies.items() if len(values)}
+
+    def report(self):
+        return {
+            'name': self.name,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'seconds': round((_now_us() - self.started_us) / 1e6, 6),
+            'stages': self.spans('stage'),
+            'spans': self.spans('span'),
+            'strategies': self.latencies(),
+            'profiled': self.profiled,
+            'trace_events_dropped': self._dropped,
+            **self.attached,
+        }
+
+    def trace(self):
+        """Chrome trace_event document; timestamps relative to the start of the run."""
+        with self._lock:
+            events = [dict(event, ts=event['ts'] - self.started_us) for event in self._events]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'name': self.name}}
+
+
+_profiler = Profiler()
+_profiler_lock = threading.Lock()
+
+
+def _options():
+    return settings.get_config().get('profile', {}) or {}
+
+
+def get_profiler():
+    return _profiler
+
+
+def start(name='run'):
+    """Starts a new run's profile."""
+    global _profiler
+    with _profiler_lock:
+        _profiler = Profiler(name, max_events=_options().get('max_events', DEFAULT_MAX_EVENTS))
+    return _profiler
+
+
+def record(name, seconds, cat='span', **args):
+    _profiler.record(name, seconds, cat, **args)
+
+
+def record_check(strategy, code, seconds):
+    _profiler.record_check(strategy, code, seconds)
+
+
+def attach(key, value):
+    _profiler.attach(key, value)
+
+
+def drain():
+    return _profiler.drain()
+
+
+def merge(snapshot):
+    _profiler.merge(snapshot)
+
+
+@contextmanager
+def span(name, cat='span', **args):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _profiler.record(name, time.perf_counter() - started, cat, **args)
+
+
+def _top_functions(profile):
+    stats = pstats.Stats(profile)
+    rows = []
+    for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({'function': f"{os.path.basename(filename)}:{line}({function})", 'calls': calls,
+                     'own_s': round(own, 6), 'cumulative_s': round(cumulative, 6)})
+    return sorted(rows, key=lambda row: -row['cumulative_s'])[:TOP_FUNCTIONS]
+
+
+@contextmanager
+def stage(name):
+    """A pipeline stage; also profiled when named by settings profile.cprofile / profile.tracemalloc."""
+    options = _options()
+    profile = cProfile.Profile() if options.get('cprofile') == name else None
+    trace_memory = options.get('tracemalloc') == name and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+    if profile is not None:
+        profile.enable()
+    try:
+        with span(name, cat='stage'):
+            yield
+    finally:
+        profiler = _profiler
+        if profile is not None:
+            profile.disable()
+            profiler.profiled.setdefault(name, {})['cprofile'] = _top_functions(profile)
+            profiler.cprofiles[name] = profile
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            allocations = [{'site': str(stat.traceback), 'kb': round(stat.size / 1024, 1), 'count': stat.count}
+                           for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]]
+            profiler.profiled.setdefault(name, {})['tracemalloc'] = {'peak_kb': round(peak / 1024, 1),
+                                                                     'top': allocations}
+
+
+def _output_dir():
+    options = _options()
+    return options.get('dir') or os.path.join(settings.get_config().get('data_dir', 'stock_data_cache'), 'runs')
+
+
+def _prune(directory, keep):
+    reports = sorted(name for name in os.listdir(directory) if name.startswith('run-') and name.endswith('.json')
+                     and not name.endswith('.trace.json'))
+    for report in reports[:max(0, len(reports) - keep)]:
+        stem = report[:-len('.json')]
+        for suffix in ('.json', '.trace.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, stem + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def write(profiler=None, directory=None):
+    """Writes the run report, trace and cProfile dumps; returns the report path."""
+    profiler = profiler or _profiler
+    directory = directory or _output_dir()
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, f"run-{profiler.started_at.strftime('%Y%m%d-%H%M%S')}")
+    for stage_name, profile in profiler.cprofiles.items():
+        profile.dump_stats(f"{stem}.prof")
+        profiler.profiled[stage_name]['cprofile_file'] = f"{stem}.prof"
+    with open(f"{stem}.json", 'w', encoding='utf-8') as f:
+        json.dump(profiler.report(), f, ensure_ascii=False, indent=1, default=str)
+    if _options().get('trace', True):
+        with open(f"{stem}.trace.json", 'w', encoding='utf-8') as f:
+            json.dump(profiler.trace(), f, ensure_ascii=False, default=str)
+    return f"{stem}.json"
+
+
+def log_stats():
+    profiler = _profiler
+    for stage_name, s in profiler.spans('stage').items():
+        logger.info(f"阶段 [{stage_name}]: {s['seconds']:.3f}s", extra={'stock': 'NONE', 'strategy': '性能'})
+    for strategy, s in profiler.latencies().items():
+        logger.info(f"策略耗时 [{strategy}]: {s['count']} 只, p50 {s['p50_ms']}ms, p95 {s['p95_ms']}ms, "
+                    f"最大 {s['max_ms']}ms, 合计 {s['total_s']:.3f}s", extra={'stock': 'NONE', 'strategy': strategy})
+
+
+def finish():
+    """Logs the run's timings and, with settings profile.enabled, writes its report; returns the report path or None."""
+    log_stats()
+    options = _options()
+    if not options.get('enabled', True):
+        return None
+    try:
+        path = write()
+        _prune(os.path.dirname(path), options.get('keep', 30))
+        logger.info(f"运行报告已写入 {path}", extra={'stock': 'NONE', 'strategy': '性能'})
+        return path
+    except Exception as e:
+        logger.warning(f"写入运行报告失败: {e}", extra={'stock': 'NONE', 'strategy': '性能'})
+        return None
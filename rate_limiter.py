@@ -0,0 +1,187 @@
+# rate_limiter.py
+# -*- encoding: UTF-8 -*-
+"""
+Process-wide adaptive rate limiting for upstream (AKShare / Eastmoney) traffic.
+
+Each upstream endpoint has a named token bucket ('hist', 'spot', 'lhb', ...).
+Callers queue on a bucket in FIFO order instead of sleeping independently, and the
+bucket adjusts its rate between configured bounds with AIMD: a successful, fast call
+adds `increase_step` calls/minute, an error or a slow call multiplies the rate by
+`decrease_factor`.
+
+Usage:
+    df = rate_limiter.call('hist', ak.stock_zh_a_hist, symbol=code, ...)
+
+Bucket settings come from the `rate_limits` section of config.yaml and fall back to
+DEFAULT_BUCKETS. A caller can set `wait_listener` to be told when call() starts and
+stops waiting for a token (fetch_engine keeps the wait out of a request's deadline).
+"""
+import contextvars
+import logging
+import threading
+import time
+
+import profiler
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Rates are in calls per minute
+DEFAULT_BUCKETS = {
+    'hist': {'rate': 5, 'min_rate': 2, 'max_rate': 60, 'burst': 1, 'target_latency': 5.0},
+    'spot': {'rate': 2, 'min_rate': 1, 'max_rate': 6, 'burst': 1, 'target_latency': 30.0},
+    'lhb': {'rate': 2, 'min_rate': 1, 'max_rate': 6, 'burst': 1, 'target_latency': 30.0},
+    'factor': {'rate': 5, 'min_rate': 2, 'max_rate': 60, 'burst': 1, 'target_latency': 5.0},
+    # Strategies with RESOURCE_CLASS = 'network' (strategy_scheduler.py)
+    'strategy': {'rate': 10, 'min_rate': 2, 'max_rate': 30, 'burst': 1, 'target_latency': 10.0},
+    'calendar': {'rate': 2, 'min_rate': 1, 'max_rate': 6, 'burst': 1, 'target_latency': 30.0},
+}
+DEFAULT_BUCKET = {'rate': 5, 'min_rate': 1, 'max_rate': 30, 'burst': 1, 'target_latency': 10.0}
+
+# Called with True before call() waits for a token and with False once it got one
+wait_listener = contextvars.ContextVar('rate_limiter_wait_listener', default=None)
+
+_buckets = {}
+_registry_lock = threading.Lock()
+
+
+class AdaptiveTokenBucket:
+    """Token bucket with FIFO waiting and AIMD rate adaptation."""
+
+    def __init__(self, name, rate, min_rate=None, max_rate=None, burst=1, target_latency=None,
+                 increase_step=1.0, decrease_factor=0.5):
+        self.name = name
+        self.min_rate = float(min_rate if min_rate is not None else rate)
+        self.max_rate = float(max_rate if max_rate is not None else rate)
+        self.rate = min(max(float(rate), self.min_rate), self.max_rate)
+        self.burst = max(1, int(burst))
+        self.target_latency = target_latency
+        self.increase_step = float(increase_step)
+        self.decrease_factor = float(decrease_factor)
+
+        self._cond = threading.Condition()
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._next_ticket = 0
+        self._serving = 0
+
+        self.calls = 0
+        self.errors = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_latency = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(float(self.burst), self._tokens + elapsed * self.rate / 60.0)
+
+    def acquire(self):
+        """Blocks until this caller's turn comes and a token is available. Returns the seconds waited."""
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if ticket == self._serving and self._tokens >= 1.0:
+                    break
+                if ticket == self._serving:
+                    # Head of the queue sleeps exactly until the next token is due
+                    self._cond.wait((1.0 - self._tokens) * 60.0 / self.rate)
+                else:
+                    self._cond.wait()
+            self._tokens -= 1.0
+            self._serving += 1
+            waited = time.monotonic() - start
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self._cond.notify_all()
+        return waited
+
+    def record(self, latency, error=False):
+        """Feeds the outcome of one call back into the AIMD controller."""
+        with self._cond:
+            self.calls += 1
+            self.total_latency += latency
+            old_rate = self.rate
+            too_slow = self.target_latency is not None and latency > self.target_latency
+            if error:
+                self.errors += 1
+            if error or too_slow:
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+            if self.rate != old_rate:
+                # A new rate changes when the head of the queue may proceed
+                self._cond.notify_all()
+        if error or too_slow:
+            logger.debug(f"限流器 [{self.name}] 降速: {old_rate:.1f} -> {self.rate:.1f} 次/分钟 (error={error}, latency={latency:.2f}s)", extra={'stock': 'NONE', 'strategy': '限流'})
+
+    def stats(self):
+        with self._cond:
+            return {
+                'rate_per_min': round(self.rate, 2),
+                'calls': self.calls,
+                'errors': self.errors,
+                'waiting': self._next_ticket - self._serving,
+                'total_wait_s': round(self.total_wait, 3),
+                'max_wait_s': round(self.max_wait, 3),
+                'avg_latency_s': round(self.total_latency / self.calls, 3) if self.calls else 0.0,
+            }
+
+
+def get_bucket(name):
+    """Returns the process-wide bucket called `name`, creating it from config on first use."""
+    with _registry_lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            params = dict(DEFAULT_BUCKETS.get(name, DEFAULT_BUCKET))
+            params.update(settings.get_config().get('rate_limits', {}).get(name, {}) or {})
+            bucket = AdaptiveTokenBucket(name, **params)
+            _buckets[name] = bucket
+        return bucket
+
+
+def call(bucket_name, func, *args, **kwargs):
+    """Runs `func(*args, **kwargs)` once a token of `bucket_name` is available and records its outcome."""
+    bucket = get_bucket(bucket_name)
+    listener = wait_listener.get()
+    if listener is not None:
+        listener(True)
+    try:
+        waited = bucket.acquire()
+    finally:
+        if listener is not None:
+            listener(False)
+    if waited > 0:
+        profiler.record('limiter_wait', waited, bucket=bucket_name)
+    start = time.monotonic()
+    error = True
+    try:
+        result = func(*args, **kwargs)
+        error = False
+        return result
+    finally:
+        elapsed = time.monotonic() - start
+        bucket.record(elapsed, error=error)
+        profiler.record(f"upstream.{bucket_name}", elapsed)
+
+
+def stats():
+    """Returns {bucket name: counters} for every bucket used so far."""
+    with _registry_lock:
+        buckets = list(_buckets.values())
+    return {bucket.name: bucket.stats() for bucket in buckets}
+
+
+def log_stats():
+    for name, bucket_stats in stats().items():
+        logger.info(f"限流器 [{name}] 统计: {bucket_stats}", extra={'stock': 'NONE', 'strategy': '限流'})
+
+
+def reset():
+    """Drops all buckets so they are rebuilt from the current config (mainly for tests)."""
+    with _registry_lock:
+        _buckets.clear()
@@ -0,0 +1,241 @@
+# replay.py
+# -*- encoding: UTF-8 -*-
+"""
+Records one run of work_flow_new.prepare() into a snapshot directory and replays it offline.
+
+work_flow_new reads its upstream data and its clock through this module:
+
+    spot_entry()           the spot table and when it was taken (snapshot_cache.spot_entry)
+    lhb_statistic(symbol)  the Dragon-Tiger table (snapshot_cache.lhb_statistic)
+    stream(stocks, ...)    per-stock history (data_fetcher_new.stream)
+    now()                  the run's date and time
+
+Outside a session these are the live calls. Inside `recording(path)` the live results
+are also written to `path`:
+
+    meta.json               run time, stocks and the strategy settings of the run
+    spot.parquet, lhb-<symbol>.parquet
+    stocks/<code>.parquet   each stock's frame as handed to the strategies
+    trade_calendar.parquet
+
+Inside `playback(path)` they are served from `path` without network access: the clock
+stands still at the recorded time, the stocks are read through fetch_engine.LocalFileSource,
+the spot ingest is skipped and pushes are off. data_dir points at a fresh scratch directory
+holding the recorded calendar, so caches start cold and every replay does the same work.
+Run reports go to `{path}/runs`. To mimic the upstream, `latency` seconds (settings
+'replay') are awaited per stock request and `table_latency` seconds per spot/LHB request.
+
+    python newmain.py --record snapshots/2026-10-16
+    python newmain.py --replay snapshots/2026-10-16 --latency 0.2 --profile evaluate
+"""
+import datetime
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+import data_fetcher_new
+import feature_store
+import fetch_engine
+import indicator_state
+import settings
+import snapshot_cache
+import trading_calendar
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "meta.json"
+STOCKS_DIR = "stocks"
+RUNS_DIR = "runs"
+# Settings a replay takes over from the recorded run, so it runs the same strategies
+RECORDED_SETTINGS = ('enabled_strategies', 'strategies', 'target_stock_count', 'run_limit_up_backtest')
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _table_file(key):
+    return f"{key.replace(':', '-')}.parquet"
+
+
+class Recording:
+    """Writes the upstream data of a live run into `path`."""
+
+    def __init__(self, path):
+        self.path = path
+        self.started_at = datetime.datetime.now()
+        self.stocks = []
+        self.tables = []
+        os.makedirs(os.path.join(path, STOCKS_DIR), exist_ok=True)
+
+    def now(self):
+        return self.started_at
+
+    def save(self, key, df):
+        try:
+            df.to_parquet(os.path.join(self.path, _table_file(key)), index=False)
+            self.tables.append(key)
+        except Exception as e:
+            logger.warning(f"记录 {key} 失败: {e}", extra={'stock': 'NONE', 'strategy': '回放'})
+        return df
+
+    def record(self, frames):
+        for (code, name), df in frames:
+            self.stocks.append([code, name])
+            try:
+                df.to_parquet(os.path.join(self.path, STOCKS_DIR, f"{code}.parquet"), index=False)
+            except Exception as e:
+                logger.warning(f"记录 {name}({code}) 行情失败: {e}", extra={'stock': code, 'strategy': '回放'})
+            yield (code, name), df
+
+    def finish(self):
+        config = settings.get_config()
+        calendar = trading_calendar.get_calendar(config.get('data_dir', 'stock_data_cache'))
+        pd.DataFrame({'trade_date': calendar.sessions}).to_parquet(
+            os.path.join(self.path, trading_calendar.CALENDAR_FILE), index=False)
+        meta = {'time': self.started_at.isoformat(), 'stocks': self.stocks, 'tables': self.tables,
+                'approximate_calendar': calendar.approximate,
+                'settings': {key: config[key] for key in RECORDED_SETTINGS if key in config}}
+        with open(os.path.join(self.path, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1, default=str)
+        logger.info(f"已记录 {len(self.stocks)} 只股票的行情到 {self.path}", extra={'stock': 'NONE', 'strategy': '回放'})
+
+
+class Playback:
+    """Serves a recorded run from `path`; `latency` / `table_latency` seconds are awaited per request."""
+
+    def __init__(self, path, latency=0.0, table_latency=0.0):
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.latency = latency
+        self.table_latency = table_latency
+        self.started_at = datetime.datetime.fromisoformat(self.meta['time'])
+
+    def now(self):
+        return self.started_at
+
+    def table(self, key):
+        if self.table_latency:
+            time.sleep(self.table_latency)
+        file_path = os.path.join(self.path, _table_file(key))
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"快照 {self.path} 中没有 {key}")
+        return pd.read_parquet(file_path)
+
+    def stream(self, stocks, max_workers=5, timeout=None, maxsize=64):
+        source = fetch_engine.LocalFileSource(os.path.join(self.path, STOCKS_DIR), latency=self.latency)
+        return fetch_engine.stream(stocks, source, concurrency=max_workers, timeout=timeout, maxsize=maxsize,
+                                   progress=False)
+
+    def write_calendar(self, cache_dir):
+        """The recorded sessions, continued by weekdays to the end of this year so the calendar needs no download."""
+        sessions = pd.read_parquet(os.path.join(self.path, trading_calendar.CALENDAR_FILE))['trade_date']
+        sessions = pd.DatetimeIndex(sessions)
+        future = pd.bdate_range(sessions.max() + pd.Timedelta(days=1), datetime.date(datetime.date.today().year, 12, 31))
+        pd.DataFrame({'trade_date': sessions.append(future)}).to_parquet(
+            os.path.join(cache_dir, trading_calendar.CALENDAR_FILE), index=False)
+
+
+def session():
+    """The active Recording or Playback, or None."""
+    return _session
+
+
+def is_playback():
+    return isinstance(_session, Playback)
+
+
+def now():
+    """The run's current time: frozen at the recorded time in a playback."""
+    return _session.now() if _session is not None else datetime.datetime.now()
+
+
+def spot_entry(fetched_after=None):
+    """(fetched_at, spot table), see snapshot_cache.spot_entry(); a replayed table counts as fetched at the recorded time."""
+    if is_playback():
+        return _session.now(), _session.table('spot')
+    fetched_at, df = snapshot_cache.spot_entry(fetched_after=fetched_after)
+    return fetched_at, (_session.save('spot', df) if _session is not None else df)
+
+
+def lhb_statistic(symbol="近三月"):
+    if is_playback():
+        return _session.table(f'lhb:{symbol}')
+    df = snapshot_cache.lhb_statistic(symbol)
+    return _session.save(f'lhb:{symbol}', df) if _session is not None else df
+
+
+def stream(stocks, cache_dir="stock_data_cache", max_workers=5, timeout=None, maxsize=64):
+    """data_fetcher_new.stream() of `stocks`, or their recorded frames in a playback."""
+    if is_playback():
+        return _session.stream(stocks, max_workers=max_workers, timeout=timeout, maxsize=maxsize)
+    frames = data_fetcher_new.stream(stocks, cache_dir=cache_dir, max_workers=max_workers, timeout=timeout,
+                                     maxsize=maxsize)
+    return _session.record(frames) if _session is not None else frames
+
+
+def _activate(new_session):
+    global _session
+    with _session_lock:
+        if _session is not None:
+            raise RuntimeError("已有进行中的记录或回放")
+        _session = new_session
+
+
+def _deactivate():
+    global _session
+    with _session_lock:
+        _session = None
+
+
+@contextmanager
+def recording(path):
+    """Records the upstream data of the runs inside the block into `path`."""
+    _activate(Recording(path))
+    try:
+        yield _session
+        _session.finish()
+    finally:
+        _deactivate()
+
+
+@contextmanager
+def playback(path, latency=None, table_latency=None):
+    """Serves the runs inside the block from the snapshot in `path` (latencies default to settings 'replay')."""
+    options = settings.get_config().get('replay', {}) or {}
+    replayed = Playback(path,
+                        latency=options.get('latency', 0.0) if latency is None else latency,
+                        table_latency=options.get('table_latency', 0.0) if table_latency is None else table_latency)
+    config = settings.get_config()
+    saved = {key: config.get(key) for key in ('data_dir', 'daily_bar_source', 'push', 'profile') + RECORDED_SETTINGS}
+    scratch = tempfile.mkdtemp(prefix="sequoia-replay-")
+    replayed.write_calendar(scratch)
+    config.update(replayed.meta.get('settings', {}))
+    config.update(data_dir=scratch, daily_bar_source='hist', push={'enable': False},
+                  profile={**(config.get('profile') or {}),
+                           'dir': (config.get('profile') or {}).get('dir') or os.path.join(path, RUNS_DIR)})
+    # The process-wide stores are bound to data_dir
+    feature_store.reset()
+    indicator_state.reset()
+    _activate(replayed)
+    logger.info(f"回放 {path} 中 {replayed.started_at:%Y-%m-%d %H:%M} 的运行，每只股票延迟 {replayed.latency}s",
+                extra={'stock': 'NONE', 'strategy': '回放'})
+    try:
+        yield replayed
+    finally:
+        _deactivate()
+        for key, value in saved.items():
+            if value is None:
+                config.pop(key, None)
+            else:
+                config[key] = value
+        feature_store.reset()
+        indicator_state.reset()
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,216 @@
+# rule_engine.py
+# -*- encoding: UTF-8 -*-
+"""
+Declarative per-stock rules evaluated cheapest-and-most-selective first.
+
+A strategy lists its conditions as rules with the values they need; the values
+(indicators, derived series) are computed by providers on first use, so a stock
+rejected by a cheap rule never pays for MACD or KDJ:
+
+    ENGINE = rule_engine.RuleEngine("短线", rules=[
+        Rule('换手率', lambda ctx: 3 <= ctx['data']['换手率'].iloc[-1] <= 25),
+        Rule('MACD金叉', macd_cross, needs=('MACD',)),
+    ], providers={'MACD': lambda ctx: feature_store.get(ctx['code'], ctx['data'], 'MACD')})
+    passed, failed_rule = ENGINE.evaluate(code=code, data=data)
+
+The engine measures each rule's cost (including the values it made the context
+compute) and how often it rejects, and every `reorder_every` evaluations re-sorts
+the rules by cost / rejection rate, the order minimizing the expected cost of a
+conjunction. The counters persist to `{data_dir}/rule_stats.json`, so a run starts
+from the order recent runs settled on; the per-run pass/reject funnel is
+reported by log_stats().
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+STATS_FILE = "rule_stats.json"
+# Counters carried over from past runs are halved at load, so recent runs weigh more
+HISTORY_DECAY = 0.5
+
+
+class Rule:
+    """A named predicate over a Context, with the provider values it reads."""
+
+    __slots__ = ('name', 'predicate', 'needs')
+
+    def __init__(self, name, predicate, needs=()):
+        self.name = name
+        self.predicate = predicate
+        self.needs = tuple(needs)
+
+
+class Context:
+    """Inputs of one evaluation plus provider values computed on first access."""
+
+    __slots__ = ('_providers', '_values')
+
+    def __init__(self, providers, inputs):
+        self._providers = providers
+        self._values = inputs
+
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            value = self._values[name] = self._providers[name](self)
+            return value
+
+
+class RuleEngine:
+    """Short-circuiting conjunction of rules, reordered from measured cost and rejection rate."""
+
+    def __init__(self, name, rules, providers=None, reorder_every=256):
+        self.name = name
+        self.rules = list(rules)
+        self.providers = dict(providers or {})
+        self.reorder_every = reorder_every
+        self._order = list(self.rules)
+        # rule name -> [evaluated, passed, seconds]: this run, and carried over from past runs
+        self._run = {rule.name: [0, 0, 0.0] for rule in self.rules}
+        self._history = {rule.name: [0, 0, 0.0] for rule in self.rules}
+        self._evaluations = 0
+        self._history_loaded = False
+        self._lock = threading.Lock()
+        with _engines_lock:
+            _engines[name] = self
+
+    def evaluate(self, **inputs):
+        """(passed, name of the rejecting rule or None)."""
+        if not self._history_loaded:
+            self._load_history()
+        context = Context(self.providers, inputs)
+        measured = []
+        failed = None
+        for rule in self._order:
+            start = time.perf_counter()
+            for need in rule.needs:
+                context[need]
+            passed = bool(rule.predicate(context))
+            measured.append((rule.name, passed, time.perf_counter() - start))
+            if not passed:
+                failed = rule.name
+                break
+
+        with self._lock:
+            for rule_name, passed, seconds in measured:
+                counters = self._run[rule_name]
+                counters[0] += 1
+                counters[1] += passed
+                counters[2] += seconds
+            self._evaluations += 1
+            if self._evaluations % self.reorder_every == 0:
+                self._reorder()
+        return failed is None, failed
+
+    def _estimates(self):
+        totals = {}
+        for rule in self.rules:
+            run, history = self._run[rule.name], self._history[rule.name]
+            totals[rule.name] = [run[i] + history[i] for i in range(3)]
+        costs = [seconds / evaluated for evaluated, _, seconds in totals.values() if evaluated]
+        default_cost = sum(costs) / len(costs) if costs else 0.0
+        estimates = {}
+        for rule_name, (evaluated, passed, seconds) in totals.items():
+            cost = seconds / evaluated if evaluated else default_cost
+            # Laplace-smoothed rejection rate, so an unseen rule counts as a coin flip
+            reject = (evaluated - passed + 1) / (evaluated + 2)
+            estimates[rule_name] = cost / reject
+        return estimates
+
+    def _reorder(self):
+        estimates = self._estimates()
+        # Stable: rules without measurements keep their declared order
+        self._order = sorted(self.rules, key=lambda rule: estimates[rule.name])
+
+    @property
+    def order(self):
+        return [rule.name for rule in self._order]
+
+    def funnel(self):
+        """[(rule name, evaluated, passed, mean µs)] of this run, in evaluation order."""
+        with self._lock:
+            rows = []
+            for rule in self._order:
+                evaluated, passed, seconds = self._run[rule.name]
+                rows.append((rule.name, evaluated, passed, seconds / evaluated * 1e6 if evaluated else 0.0))
+            return rows
+
+    def _load_history(self):
+        with self._lock:
+            if self._history_loaded:
+                return
+            self._history_loaded = True
+            for rule_name, counters in _load_stats().get(self.name, {}).items():
+                if rule_name in self._history:
+                    self._history[rule_name] = [value * HISTORY_DECAY for value in counters]
+            self._reorder()
+
+    def history(self):
+        """This run's counters added to the carried-over ones, as saved by save()."""
+        with self._lock:
+            return {rule_name: [run[i] + self._history[rule_name][i] for i in range(3)]
+                    for rule_name, run in self._run.items()}
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def engines():
+    """{name: RuleEngine} of the engines that evaluated something in this process."""
+    with _engines_lock:
+        return {name: engine for name, engine in _engines.items() if engine._evaluations}
+
+
+def _stats_path():
+    return os.path.join(settings.get_config().get('data_dir', 'stock_data_cache'), STATS_FILE)
+
+
+def _load_stats():
+    path = _stats_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"读取规则统计 {path} 失败: {e}", extra={'stock': 'NONE', 'strategy': '规则引擎'})
+        return {}
+
+
+def save():
+    """Writes the counters of every engine used in this run to data_dir/rule_stats.json."""
+    with _engines_lock:
+        engines = [engine for engine in _engines.values() if engine._evaluations]
+    if not engines:
+        return
+    path = _stats_path()
+    stats = _load_stats()
+    for engine in engines:
+        stats[engine.name] = engine.history()
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"保存规则统计 {path} 失败: {e}", extra={'stock': 'NONE', 'strategy': '规则引擎'})
+
+
+def log_stats():
+    with _engines_lock:
+        engines = list(_engines.values())
+    for engine in engines:
+        if not engine._evaluations:
+            continue
+        for rule_name, evaluated, passed, micros in engine.funnel():
+            logger.info(f"规则漏斗 [{engine.name}] {rule_name}: 检查 {evaluated} 只, 通过 {passed} 只, "
+                        f"淘汰 {evaluated - passed} 只, 平均 {micros:.1f} µs", extra={'stock': 'NONE', 'strategy': engine.name})
@@ -34,6 +34,44 @@ def init():
             'to_addr': ""
         },
         'run_limit_up_backtest': True,
+        # 'spot': 收盘后用实时行情快照一次性生成当日日线; 'hist': 逐只调用历史行情接口
+        'daily_bar_source': 'spot',
+        'fetch_concurrency': 5, # 同时进行的行情请求数
+        'stream_queue_size': 64, # 已获取、等待策略计算的股票数上限
+        'fetch_timeout': None, # 单只股票获取超时(秒，不含限流排队时间)，None 表示不限
+        # 每个上游接口一个自适应令牌桶，速率单位：次/分钟 (见 rate_limiter.py)
+        'rate_limits': {
+            'hist': {'rate': 5, 'min_rate': 2, 'max_rate': 60, 'burst': 1, 'target_latency': 5.0},
+            'spot': {'rate': 2, 'min_rate': 1, 'max_rate': 6, 'burst': 1, 'target_latency': 30.0},
+            'lhb': {'rate': 2, 'min_rate': 1, 'max_rate': 6, 'burst': 1, 'target_latency': 30.0},
+            'factor': {'rate': 5, 'min_rate': 2, 'max_rate': 60, 'burst': 1, 'target_latency': 5.0},
+            'strategy': {'rate': 10, 'min_rate': 2, 'max_rate': 30, 'burst': 1, 'target_latency': 10.0},
+        },
+        # 按策略声明的 RESOURCE_CLASS 分配线程数，cpu 为 None 时取 CPU 核数 (见 strategy_scheduler.py)
+        'strategy_workers': {'cpu': None, 'io': 16, 'network': 4},
+        # 'thread': 所有策略在线程池中执行; 'process': cpu 类策略在多进程中执行，行情经共享内存传递
+        'strategy_backend': 'thread',
+        # process 后端: processes 为 None 时取 CPU 核数; batch_size 为每块共享内存包含的股票数
+        'strategy_process': {'processes': None, 'batch_size': 32, 'start_method': None},
+        # 策略共享的技术指标缓存 (见 feature_store.py)，超过 max_mb 按最近最少使用淘汰；persist 时保存到 data_dir/features.pkl
+        'feature_store': {'max_mb': 256, 'persist': False},
+        # 增量指标状态 (见 indicator_state.py)：每日只推进新K线，保存到 data_dir/indicator_state.pkl；keep 为保留的最近指标值个数
+        'indicator_state': {'enabled': False, 'keep': 30},
+        # 每个策略的淘汰原因统计 (见 funnel.py)，samples: 每个原因保留的示例股票数
+        'funnel': {'samples': 3},
+        # 运行报告 (见 profiler.py)：各阶段耗时、每个策略的单股耗时分位数，写入 dir (默认 data_dir/runs)，保留最近 keep 次
+        # cprofile / tracemalloc: 对指定阶段 (spot, ingest, lhb, evaluate, universe, backtest, push) 启用 cProfile / 内存追踪
+        'profile': {'enabled': True, 'dir': None, 'keep': 30, 'trace': True, 'cprofile': None, 'tracemalloc': None},
+        # 离线回放 (见 replay.py，newmain.py --record / --replay)：每只股票、每张全市场表 (实时行情/龙虎榜) 模拟的请求延迟(秒)
+        'replay': {'latency': 0.0, 'table_latency': 0.0},
+        # 全市场快照(实时行情/龙虎榜)缓存，ttl 单位：秒 (见 snapshot_cache.py)
+        'snapshot_cache': {
+            'stale_while_revalidate': False,
+            'datasets': {
+                'spot': {'ttl': 300, 'final_after_close': True},
+                'lhb': {'ttl': 21600, 'final_after_close': True},
+            },
+        },
         # Add the default here
         'target_stock_count': 30, # Default value for target_stock_count
         'strategies': {
@@ -0,0 +1,86 @@
+# shared_bars.py
+# -*- encoding: UTF-8 -*-
+"""
+A batch of per-stock bar frames packed into one `multiprocessing.shared_memory` block.
+
+The parent writes the bars of many stocks once; strategy worker processes attach to
+the block by name and read their stocks' rows in place instead of receiving a pickled
+DataFrame per task. Layout of a block holding `n` bars:
+
+    int64   [n]        日期 as nanoseconds since the epoch
+    float64 [k, n]     one contiguous row per value column (开盘, 收盘, ...)
+
+Stock i occupies bars offsets[i]:offsets[i+1]. Only the columns in BAR_COLUMNS are
+carried over.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from history_store import BAR_COLUMNS, DATE_COLUMN
+
+VALUE_COLUMNS = [column for column in BAR_COLUMNS if column != DATE_COLUMN]
+
+
+class SharedBarBlock:
+    """Bars of a batch of stocks in one shared memory segment (owned by the creating process)."""
+
+    def __init__(self, shm, offsets, owner):
+        self.shm = shm
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.owner = owner
+        n = int(self.offsets[-1])
+        self.dates = np.ndarray((n,), dtype=np.int64, buffer=shm.buf)
+        self.values = np.ndarray((len(VALUE_COLUMNS), n), dtype=np.float64, buffer=shm.buf, offset=n * 8)
+        if not owner:
+            self.dates.flags.writeable = False
+            self.values.flags.writeable = False
+
+    @classmethod
+    def create(cls, frames):
+        """Copies `frames` (list of per-stock bar DataFrames) into a new segment."""
+        lengths = [len(df) for df in frames]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        n = int(offsets[-1])
+        # A zero-sized segment is not allowed
+        shm = shared_memory.SharedMemory(create=True, size=max(n * 8 * (1 + len(VALUE_COLUMNS)), 8))
+        block = cls(shm, offsets, owner=True)
+        for df, start, stop in zip(frames, offsets[:-1], offsets[1:]):
+            if start == stop:
+                continue
+            block.dates[start:stop] = pd.to_datetime(df[DATE_COLUMN]).values.astype('datetime64[ns]').view(np.int64)
+            for k, column in enumerate(VALUE_COLUMNS):
+                if column in df.columns:
+                    block.values[k, start:stop] = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                else:
+                    block.values[k, start:stop] = np.nan
+        return block
+
+    @classmethod
+    def attach(cls, name, offsets):
+        """Read-only view of a segment created by another process."""
+        return cls(shared_memory.SharedMemory(name=name), offsets, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def frame(self, i):
+        """Bars of stock i as the legacy DataFrame (a private copy strategies may modify)."""
+        start, stop = int(self.offsets[i]), int(self.offsets[i + 1])
+        data = {DATE_COLUMN: self.dates[start:stop].view('datetime64[ns]').copy()}
+        for k, column in enumerate(VALUE_COLUMNS):
+            data[column] = self.values[k, start:stop].copy()
+        return pd.DataFrame(data)[BAR_COLUMNS]
+
+    def close(self):
+        """Detaches; the creating process also removes the segment."""
+        # Views must go before the buffer can be released
+        self.dates = self.values = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
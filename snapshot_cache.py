@@ -0,0 +1,230 @@
+# snapshot_cache.py
+# -*- encoding: UTF-8 -*-
+"""
+TTL cache for whole-market snapshot tables (spot quotes, Dragon-Tiger list).
+
+Results are kept in memory for the process, so `work_flow` and `work_flow_new`
+running back to back share one download, and persisted as Parquet under
+`{data_dir}/snapshots/{key}.parquet` so a rerun on the same afternoon is served
+from disk. Each dataset has its own TTL (settings 'snapshot_cache'); datasets marked
+`final_after_close` taken after the close stay valid until the next session opens.
+With `stale_while_revalidate` an expired entry is returned at once while a
+background thread refreshes it. Callers that need a snapshot taken after a given time
+(the spot ingest turns it into daily bars) use get_entry(..., fetched_after=...), which
+also returns when the snapshot was taken.
+"""
+import datetime
+import logging
+import os
+import threading
+
+import akshare as ak
+import pandas as pd
+
+import rate_limiter
+import settings
+import trading_calendar
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = "snapshots"
+DEFAULT_DATASETS = {
+    # Quotes change every few seconds intraday but are final once the session closed
+    'spot': {'ttl': 300, 'final_after_close': True},
+    'lhb': {'ttl': 6 * 3600, 'final_after_close': True},
+}
+DEFAULT_DATASET = {'ttl': 300, 'final_after_close': False}
+# Market opens (call auction) at 09:15; a final after-close snapshot is valid until then
+SESSION_OPEN = datetime.time(9, 15)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class SnapshotCache:
+    """Keyed DataFrame cache with per-dataset TTLs, disk persistence and hit/miss counters."""
+
+    def __init__(self, cache_dir="stock_data_cache", datasets=None, stale_while_revalidate=False):
+        self.cache_dir = cache_dir
+        self.root = os.path.join(cache_dir, SNAPSHOT_DIR)
+        self.datasets = datasets if datasets is not None else DEFAULT_DATASETS
+        self.stale_while_revalidate = stale_while_revalidate
+        self._entries = {}  # key -> (fetched_at datetime, DataFrame)
+        self._refreshing = set()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _dataset(self, key):
+        return {**DEFAULT_DATASET, **self.datasets.get(key.split(':', 1)[0], {})}
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key.replace(':', '-')}.parquet")
+
+    def _count(self, key, outcome):
+        counters = self._stats.setdefault(key, {'hit': 0, 'stale': 0, 'miss': 0, 'refresh': 0, 'error': 0})
+        counters[outcome] += 1
+
+    def expires_at(self, key, fetched_at):
+        """When an entry fetched at `fetched_at` stops being fresh."""
+        dataset = self._dataset(key)
+        expires = fetched_at + datetime.timedelta(seconds=dataset['ttl'])
+        if dataset['final_after_close']:
+            calendar = trading_calendar.get_calendar(self.cache_dir)
+            day = fetched_at.date()
+            after_close = not calendar.is_session(day) or fetched_at.hour >= trading_calendar.SESSION_CLOSE_HOUR
+            if after_close:
+                next_session = calendar.next_session(day)
+                if next_session is not None:
+                    expires = max(expires, datetime.datetime.combine(next_session.date(), SESSION_OPEN))
+        return expires
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return datetime.datetime.fromtimestamp(os.path.getmtime(path)), pd.read_parquet(path)
+        except Exception as e:
+            logger.warning(f"读取快照缓存 {path} 失败: {e}", extra={'stock': 'NONE', 'strategy': '快照缓存'})
+            return None
+
+    def _write_disk(self, key, df):
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = self._path(key) + ".tmp"
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            logger.warning(f"保存快照缓存 {key} 失败: {e}", extra={'stock': 'NONE', 'strategy': '快照缓存'})
+
+    def _store(self, key, df):
+        fetched_at = datetime.datetime.now()
+        with self._lock:
+            self._entries[key] = (fetched_at, df)
+        self._write_disk(key, df)
+        return fetched_at
+
+    def _refresh_in_background(self, key, loader):
+        def refresh():
+            try:
+                self._store(key, loader())
+                with self._lock:
+                    self._count(key, 'refresh')
+            except Exception as e:
+                with self._lock:
+                    self._count(key, 'error')
+                logger.warning(f"后台刷新快照 {key} 失败: {e}", extra={'stock': 'NONE', 'strategy': '快照缓存'})
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=refresh, name=f"snapshot-refresh-{key}", daemon=True).start()
+
+    def get(self, key, loader, now=None):
+        """
+        Returns a copy of the DataFrame cached under `key`, calling `loader()` when it
+        is missing or expired. If the loader fails, an expired entry is served instead.
+        """
+        return self.get_entry(key, loader, now=now)[1]
+
+    def get_entry(self, key, loader, now=None, fetched_after=None):
+        """
+        Like get(), but returns (fetched_at, DataFrame). With `fetched_after`, an entry
+        fetched before it is never served, not even while revalidating or after a failed
+        fetch.
+        """
+        now = now or datetime.datetime.now()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = self._read_disk(key)
+            if entry is not None:
+                with self._lock:
+                    self._entries.setdefault(key, entry)
+        if entry is not None and fetched_after is not None and entry[0] < fetched_after:
+            entry = None
+
+        if entry is not None:
+            fetched_at, df = entry
+            if now < self.expires_at(key, fetched_at):
+                with self._lock:
+                    self._count(key, 'hit')
+                return fetched_at, df.copy()
+            if self.stale_while_revalidate:
+                with self._lock:
+                    self._count(key, 'stale')
+                self._refresh_in_background(key, loader)
+                return fetched_at, df.copy()
+
+        with self._lock:
+            self._count(key, 'miss')
+        try:
+            df = loader()
+        except Exception as e:
+            if entry is None:
+                raise
+            with self._lock:
+                self._count(key, 'error')
+            logger.warning(f"获取 {key} 失败: {e}，使用 {entry[0]:%Y-%m-%d %H:%M} 的缓存。", extra={'stock': 'NONE', 'strategy': '快照缓存'})
+            return entry[0], entry[1].copy()
+        return self._store(key, df), df.copy()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    def stats(self):
+        """Per-key counters: hit, stale (served expired while refreshing), miss, refresh, error."""
+        with self._lock:
+            return {key: dict(counters) for key, counters in self._stats.items()}
+
+
+def get_cache(cache_dir=None):
+    """Process-wide SnapshotCache of `cache_dir` (settings 'data_dir' by default)."""
+    config = settings.get_config()
+    cache_dir = cache_dir or config.get('data_dir', 'stock_data_cache')
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            options = config.get('snapshot_cache', {}) or {}
+            datasets = {name: {**DEFAULT_DATASETS.get(name, DEFAULT_DATASET), **(params or {})}
+                        for name, params in (options.get('datasets') or {}).items()}
+            cache = SnapshotCache(cache_dir, datasets={**DEFAULT_DATASETS, **datasets},
+                                  stale_while_revalidate=options.get('stale_while_revalidate', False))
+            _caches[cache_dir] = cache
+        return cache
+
+
+def spot_snapshot(cache_dir=None):
+    """`ak.stock_zh_a_spot_em()` through the cache."""
+    return spot_entry(cache_dir)[1]
+
+
+def spot_entry(cache_dir=None, fetched_after=None):
+    """(fetched_at, spot snapshot); with `fetched_after`, only a snapshot taken after it is returned."""
+    return get_cache(cache_dir).get_entry('spot', lambda: rate_limiter.call('spot', ak.stock_zh_a_spot_em),
+                                          fetched_after=fetched_after)
+
+
+def lhb_statistic(symbol="近三月", cache_dir=None):
+    """`ak.stock_lhb_stock_statistic_em(symbol)` through the cache."""
+    return get_cache(cache_dir).get(f'lhb:{symbol}', lambda: rate_limiter.call('lhb', ak.stock_lhb_stock_statistic_em, symbol=symbol))
+
+
+def log_stats():
+    for cache in list(_caches.values()):
+        for key, counters in cache.stats().items():
+            logger.info(f"快照缓存 [{key}]: 命中 {counters['hit']} 次, 过期直接返回 {counters['stale']} 次, 未命中 {counters['miss']} 次, "
+                        f"后台刷新 {counters['refresh']} 次, 失败 {counters['error']} 次", extra={'stock': 'NONE', 'strategy': '快照缓存'})
+
+
+def reset():
+    """Drops all in-process caches (mainly for tests)."""
+    with _caches_lock:
+        _caches.clear()
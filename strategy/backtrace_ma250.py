@@ -3,6 +3,9 @@
 import talib as tl
 import pandas as pd
 import logging
+
+import feature_store
+from strategy import kernels
 from datetime import datetime, timedelta
 
 
@@ -17,7 +20,7 @@ def check(code_name, data, end_date=None, threshold=60):
     if len(data) < 250:
         logging.debug("{0}:样本小于250天...\n".format(code_name))
         return
-    data['ma250'] = pd.Series(tl.MA(data['收盘'].values, 250), index=data.index.values)
+    data['ma250'] = feature_store.series(code_name, data, 'MA', timeperiod=250)
 
     begin_date = data.iloc[0].日期
     if end_date is not None:
@@ -25,61 +28,43 @@ def check(code_name, data, end_date=None, threshold=60):
             logging.debug("{}在{}时还未上市".format(code_name, end_date))
             return False
 
-    if end_date is not None:
-        mask = (data['日期'] <= end_date)
-        data = data.loc[mask]
-
-    data = data.tail(n=threshold)
-
-    last_close = data.iloc[-1]['收盘']
-
-    # 区间最低点
-    lowest_row = data.iloc[-1]
-    # 区间最高点
-    highest_row = data.iloc[-1]
+    data = kernels.as_of(data, end_date).tail(n=threshold)
 
-    # 近期低点
-    recent_lowest_row = data.iloc[-1]
+    close = data['收盘'].values.astype(float)
+    ma250 = data['ma250'].values.astype(float)
+    volume = data['成交量'].values
+    dates = data['日期'].values
 
-    # 计算区间最高、最低价格
-    for index, row in data.iterrows():
-        if row['收盘'] > highest_row['收盘']:
-            highest_row = row
-        elif row['收盘'] < lowest_row['收盘']:
-            lowest_row = row
+    # 区间最高、最低点
+    highest = kernels.scan_argmax(close)
+    lowest = kernels.scan_argmin(close)
 
-    if lowest_row['成交量'] == 0 or highest_row['成交量'] == 0:
+    if volume[lowest] == 0 or volume[highest] == 0:
         return False
 
-    data_front = data.loc[(data['日期'] < highest_row['日期'])]
-    data_end = data.loc[(data['日期'] >= highest_row['日期'])]
-
-    if data_front.empty:
+    # 最高点之前为前半段
+    if highest == 0:
         return False
     # 前半段由年线以下向上突破
-    if not (data_front.iloc[0]['收盘'] < data_front.iloc[0]['ma250'] and
-            data_front.iloc[-1]['收盘'] > data_front.iloc[-1]['ma250']):
+    if not (close[0] < ma250[0] and close[highest - 1] > ma250[highest - 1]):
         return False
 
-    if not data_end.empty:
-        # 后半段必须在年线以上运行（回踩年线）
-        for index, row in data_end.iterrows():
-            if row['收盘'] < row['ma250']:
-                return False
-            if row['收盘'] < recent_lowest_row['收盘']:
-                recent_lowest_row = row
+    # 后半段必须在年线以上运行（回踩年线）
+    if (close[highest:] < ma250[highest:]).any():
+        return False
+    # 近期低点
+    recent_lowest = highest + kernels.scan_argmin(close[highest:])
 
-    date_diff = datetime.date(datetime.strptime(recent_lowest_row['日期'], '%Y-%m-%d')) - \
-                datetime.date(datetime.strptime(highest_row['日期'], '%Y-%m-%d'))
+    date_diff = datetime.date(datetime.strptime(dates[recent_lowest], '%Y-%m-%d')) - \
+                datetime.date(datetime.strptime(dates[highest], '%Y-%m-%d'))
 
     if not(timedelta(days=10) <= date_diff <= timedelta(days=50)):
         return False
     # 回踩伴随缩量
-    vol_ratio = highest_row['成交量']/recent_lowest_row['成交量']
-    back_ratio = recent_lowest_row['收盘'] / highest_row['收盘']
+    vol_ratio = float(volume[highest]) / float(volume[recent_lowest])
+    back_ratio = float(close[recent_lowest]) / float(close[highest])
 
     if not (vol_ratio > 2 and back_ratio < 0.8) :
         return False
 
     return True
-
@@ -3,7 +3,11 @@
 import talib as tl
 import pandas as pd
 import logging
+
+import feature_store
 from strategy import enter
+from strategy import kernels
+from strategy.context import AsOfContext
 
 
 # 平台突破策略
@@ -12,36 +16,22 @@ def check(code_name, data, end_date=None, threshold=60):
     if len(data) < threshold:
         logging.debug("{0}:样本小于{1}天...\n".format(code_name, threshold))
         return
-    data['ma60'] = pd.Series(tl.MA(data['收盘'].values, 60), index=data.index.values)
-
-    if end_date is not None:
-        mask = (data['日期'] <= end_date)
-        data = data.loc[mask]
-
-    data = data.tail(n=threshold)
-
-    breakthrough_row = None
-
-    for index, row in data.iterrows():
-        if row['开盘'] < row['ma60'] <= row['收盘']:
-            if enter.check_volume(code_name, origin_data, row['日期'], threshold):
-                breakthrough_row = row
-
-    if breakthrough_row is None:
+    ma60 = feature_store.get(code_name, data, 'MA', timeperiod=60)
+
+    # 区间内各天在原始数据中的位置
+    stop = len(kernels.as_of(data, end_date))
+    start = max(stop - threshold, 0)
+    ma60 = ma60[start:stop]
+    open_ = origin_data['开盘'].values[start:stop].astype(float)
+    close = origin_data['收盘'].values[start:stop].astype(float)
+
+    # 开盘在60日均线下、收盘在其上，且当天放量
+    volume_ok = AsOfContext(code_name, origin_data).signal(enter.check_volume, threshold=threshold)[start:stop]
+    breakthrough = (open_ < ma60) & (ma60 <= close) & volume_ok
+    if not breakthrough.any():
         return False
+    breakthrough_index = len(breakthrough) - 1 - int(breakthrough[::-1].argmax())
 
-    data_front = data.loc[(data['日期'] < breakthrough_row['日期'])]
-    data_end = data.loc[(data['日期'] >= breakthrough_row['日期'])]
-
-    for index, row in data_front.iterrows():
-        if not (-0.05 < (row['ma60'] - row['收盘']) / row['ma60'] < 0.2):
-            return False
-
-    return True
-
-
-
-
-
-
-
+    # 突破前一直在60日均线附近整理
+    front = (ma60[:breakthrough_index] - close[:breakthrough_index]) / ma60[:breakthrough_index]
+    return bool(((-0.05 < front) & (front < 0.2)).all())
@@ -4,13 +4,16 @@ import talib as tl
 import pandas as pd
 import logging
 
+import feature_store
+import universe
+
 
 def check(code_name, data, end_date=None, threshold=60):
     if len(data) < threshold:
         logging.debug("{0}:样本小于250天...\n".format(code_name))
         return False
 
-    data['vol_ma5'] = pd.Series(tl.MA(data['成交量'].values, 5), index=data.index.values)
+    data['vol_ma5'] = feature_store.series(code_name, data, 'MA', column='成交量', timeperiod=5)
 
     if end_date is not None:
         mask = (data['日期'] <= end_date)
@@ -49,3 +52,13 @@ def check(code_name, data, end_date=None, threshold=60):
     else:
         return False
 
+
+def check_universe(panel, as_of=None, threshold=60):
+    """check for every stock of a MarketPanel at once (see universe.py)."""
+    close = panel.last_bars('close', 2, as_of)
+    volume = panel.last_bars('volume', 6, as_of)
+    p_change = universe.pct_change(close)[:, -1]
+    amount = close[:, -1] * volume[:, -1] * 100
+    # vol_ma5 of the day before the last one
+    vol_ratio = volume[:, -1] / volume[:, :5].mean(axis=1)
+    return (panel.bar_counts(as_of) >= threshold + 1) & (p_change <= -9.5) & (amount >= 200000000) & (vol_ratio >= 4)
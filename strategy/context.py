@@ -0,0 +1,60 @@
+# -*- encoding: UTF-8 -*-
+"""
+As-of evaluation context for strategies that ask another check about past days.
+
+`breakthrough_platform` wants to know whether `enter.check_volume` held on each day
+of its window, `parking_apron` the same of `turtle_trade.check_enter`. Calling the
+check once per day re-masks and re-scans the whole history every time. Instead the
+check's per-day form `<check>_each_day(code_name, data, **params)` computes its answer
+for every bar in one pass, and the context looks days up in that array:
+
+    context = AsOfContext(code_name, data)
+    if context.was(enter.check_volume, row_date, threshold=60): ...
+    volume_ok = context.signal(enter.check_volume, threshold=60)   # one bool per bar
+
+Signals are memoized in the feature store, so every strategy of the run asking about
+the same stock and bars shares one computation. Frames that are not sorted by 日期
+fall back to calling the check itself once per day.
+"""
+import sys
+
+import numpy as np
+
+import feature_store
+
+
+def each_day_form(check):
+    """The `<check>_each_day` counterpart of a per-stock check, or None."""
+    module = sys.modules.get(getattr(check, '__module__', None) or '')
+    each_day = getattr(module, f"{getattr(check, '__name__', '')}_each_day", None)
+    return each_day if callable(each_day) else None
+
+
+class AsOfContext:
+    """Whole-history signals of one stock, looked up by date."""
+
+    def __init__(self, code_name, data):
+        self.code_name = code_name
+        self.data = data
+        self.dates = data['日期']
+        self.sorted = self.dates.is_monotonic_increasing and self.dates.is_unique
+
+    def position(self, date):
+        """Row of the last bar on or before `date` (-1 if there is none); `data` must be sorted."""
+        return int(self.dates.searchsorted(date, side='right')) - 1
+
+    def signal(self, check, **params):
+        """bool per bar of `data`: whether `check(code_name, data, end_date=that bar's 日期, **params)` holds."""
+        each_day = each_day_form(check)
+        if self.sorted and each_day is not None:
+            name = f"{check.__module__}.{check.__name__}"
+            return feature_store.compute(self.code_name, self.data, name,
+                                         lambda data, **kwargs: each_day(self.code_name, data, **kwargs), **params)
+        return np.array([bool(check(self.code_name, self.data, date, **params)) for date in self.dates], dtype=bool)
+
+    def was(self, check, date, **params):
+        """Whether `check` held as of `date`."""
+        if not self.sorted or each_day_form(check) is None:
+            return bool(check(self.code_name, self.data, date, **params))
+        i = self.position(date)
+        return i >= 0 and bool(self.signal(check, **params)[i])
@@ -4,15 +4,17 @@ import talib as tl
 import pandas as pd
 import logging
 
+import numpy as np
+
+import feature_store
+import universe
+from strategy import kernels
+
 
 # TODO 真实波动幅度（ATR）放大
 # 最后一个交易日收市价从下向上突破指定区间内最高价
 def check_breakthrough(code_name, data, end_date=None, threshold=30):
-    max_price = 0
-    if end_date is not None:
-        mask = (data['日期'] <= end_date)
-        data = data.loc[mask]
-    data = data.tail(n=threshold+1)
+    data = kernels.as_of(data, end_date).tail(n=threshold+1)
     if len(data) < threshold + 1:
         logging.debug("{0}:样本小于{1}天...\n".format(code_name, threshold))
         return False
@@ -21,12 +23,9 @@ def check_breakthrough(code_name, data, end_date=None, threshold=30):
     last_close = float(data.iloc[-1]['收盘'])
     last_open = float(data.iloc[-1]['开盘'])
 
-    data = data.head(n=threshold)
-    second_last_close = data.iloc[-1]['收盘']
-
-    for index, row in data.iterrows():
-        if row['收盘'] > max_price:
-            max_price = float(row['收盘'])
+    close = data['收盘'].values[:threshold]
+    second_last_close = close[-1]
+    max_price = max(0.0, float(close[kernels.first_argmax(close)]))
 
     if last_close > max_price > second_last_close and max_price > last_open \
             and last_close / last_open > 1.06:
@@ -42,11 +41,9 @@ def check_ma(code_name, data, end_date=None, ma_days=250):
         return False
 
     ma_tag = 'ma' + str(ma_days)
-    data[ma_tag] = pd.Series(tl.MA(data['收盘'].values, ma_days), index=data.index.values)
+    data[ma_tag] = feature_store.series(code_name, data, 'MA', timeperiod=ma_days)
 
-    if end_date is not None:
-        mask = (data['日期'] <= end_date)
-        data = data.loc[mask]
+    data = kernels.as_of(data, end_date)
 
     last_close = data.iloc[-1]['收盘']
     last_ma = data.iloc[-1][ma_tag]
@@ -76,11 +73,9 @@ def check_volume(code_name, data, end_date=None, threshold=60):
     if len(data) < threshold:
         logging.debug("{0}:样本小于250天...\n".format(code_name))
         return False
-    data['vol_ma5'] = pd.Series(tl.MA(data['成交量'].values, 5), index=data.index.values)
+    data['vol_ma5'] = feature_store.series(code_name, data, 'MA', column='成交量', timeperiod=5)
 
-    if end_date is not None:
-        mask = (data['日期'] <= end_date)
-        data = data.loc[mask]
+    data = kernels.as_of(data, end_date)
     if data.empty:
         return False
     p_change = data.iloc[-1]['p_change']
@@ -116,14 +111,41 @@ def check_volume(code_name, data, end_date=None, threshold=60):
         return False
 
 
+def check_volume_each_day(code_name, data, threshold=60):
+    """check_volume with `end_date` at every bar of `data` (sorted by 日期, one bar per day)."""
+    n = len(data)
+    if n < threshold:
+        return np.zeros(n, dtype=bool)
+    vol_ma5 = feature_store.get(code_name, data, 'MA', column='成交量', timeperiod=5)
+    close = data['收盘'].values.astype(np.float64)
+    volume = data['成交量'].values.astype(np.float64)
+    p_change = data['p_change'].values.astype(np.float64)
+    # vol_ma5 of the day before
+    mean_vol = np.concatenate(([np.nan], vol_ma5[:-1]))
+    # The legacy checks reject on `<`, so NaN passes them
+    return (np.arange(n) >= threshold) & ~(p_change < 2) & ~(close < data['开盘'].values.astype(np.float64)) & \
+        ~(close * volume * 100 < 200000000) & (volume / mean_vol >= 2)
+
+
+def check_volume_universe(panel, as_of=None, threshold=60):
+    """check_volume for every stock of a MarketPanel at once (see universe.py)."""
+    close = panel.last_bars('close', 2, as_of)
+    open_ = panel.last_bars('open', 1, as_of)[:, -1]
+    volume = panel.last_bars('volume', 6, as_of)
+    p_change = universe.pct_change(close)[:, -1]
+    amount = close[:, -1] * volume[:, -1] * 100
+    # vol_ma5 of the day before the last one
+    vol_ratio = volume[:, -1] / volume[:, :5].mean(axis=1)
+    return (panel.bar_counts(as_of) >= threshold + 1) & (p_change >= 2) & (close[:, -1] >= open_) & \
+        (amount >= 200000000) & (vol_ratio >= 2)
+
+
 # 量比大于3.0
 def check_continuous_volume(code_name, data, end_date=None, threshold=60, window_size=3):
     stock = code_name[0]
     name = code_name[1]
-    data['vol_ma5'] = pd.Series(tl.MA(data['成交量'].values, 5), index=data.index.values)
-    if end_date is not None:
-        mask = (data['日期'] <= end_date)
-        data = data.loc[mask]
+    data['vol_ma5'] = feature_store.series(code_name, data, 'MA', column='成交量', timeperiod=5)
+    data = kernels.as_of(data, end_date)
     data = data.tail(n=threshold + window_size)
     if len(data) < threshold + window_size:
         logging.debug("{0}:样本小于{1}天...\n".format(code_name, threshold+window_size))
@@ -134,14 +156,10 @@ def check_continuous_volume(code_name, data, end_date=None, threshold=60, window
     # 最后一天成交量
     last_vol = data.iloc[-1]['成交量']
 
-    data_front = data.head(n=threshold)
-    data_end = data.tail(n=window_size)
-
-    mean_vol = data_front.iloc[-1]['vol_ma5']
-
-    for index, row in data_end.iterrows():
-        if float(row['成交量']) / mean_vol < 3.0:
-            return False
+    mean_vol = data.iloc[threshold - 1]['vol_ma5']
+    vol_ratio = data['成交量'].values[-window_size:].astype(float) / mean_vol
+    if (vol_ratio < 3.0).any():
+        return False
 
     msg = "*{0} 量比：{1:.2f}\n\t收盘价：{2}\n".format(code_name, last_vol/mean_vol, last_close)
     logging.debug(msg)
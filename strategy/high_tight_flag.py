@@ -1,14 +1,16 @@
 # -*- encoding: UTF-8 -*-
 import logging
+
+import numpy as np
+
 import settings
+import universe
+from strategy import kernels
 
 
 # 高而窄的旗形
 def check(code_name, data, end_date=None, threshold=60):
-    if end_date is not None:
-        mask = (data['日期'] <= end_date)
-        data = data.loc[mask]
-    data = data.tail(n=threshold)
+    data = kernels.as_of(data, end_date).tail(n=threshold)
 
     if len(data) < threshold:
         logging.debug("{0}:样本小于{1}天...\n".format(code_name, threshold))
@@ -20,15 +22,15 @@ def check(code_name, data, end_date=None, threshold=60):
     if ratio_increase < 1.9:
         return False
 
-    previous_p_change = 0.0
     # 连续两天涨幅大于等于10%
-    for _p_change in data['p_change'].values:
-        if _p_change >= 9.5:
-            if previous_p_change >= 9.5:
-                return True
-            else:
-                previous_p_change = _p_change
-        else:
-            previous_p_change = 0.0
-
-    return False
+    return bool((kernels.run_length(data['p_change'].values >= 9.5) >= 2).any())
+
+
+def check_universe(panel, as_of=None, threshold=60):
+    """check for every stock of a MarketPanel at once (see universe.py)."""
+    high = panel.last_bars('high', 14, as_of)
+    low = panel.last_bars('low', 14, as_of)
+    # One more close for the first bar's 涨跌幅
+    limit_up = universe.pct_change(panel.last_bars('close', 15, as_of)) >= 9.5
+    two_days = (limit_up[:, 1:] & limit_up[:, :-1]).any(axis=1)
+    return (panel.bar_counts(as_of) >= threshold) & (high[:, -1] / np.fmin.reduce(low, axis=1) >= 1.9) & two_days
@@ -4,13 +4,16 @@ import talib as tl
 import pandas as pd
 import logging
 
+import feature_store
+import universe
+
 
 # 持续上涨（MA30向上）
 def check(code_name, data, end_date=None, threshold=30):
     if len(data) < threshold:
         logging.debug("{0}:样本小于{1}天...\n".format(code_name, threshold))
         return
-    data['ma30'] = pd.Series(tl.MA(data['收盘'].values, 30), index=data.index.values)
+    data['ma30'] = feature_store.series(code_name, data, 'MA', timeperiod=30)
 
     if end_date is not None:
         mask = (data['日期'] <= end_date)
@@ -27,3 +30,12 @@ def check(code_name, data, end_date=None, threshold=30):
     else:
         return False
 
+
+def check_universe(panel, as_of=None, threshold=30):
+    """check for every stock of a MarketPanel at once (see universe.py)."""
+    # 29 earlier bars complete the first MA30 of the window
+    ma30 = universe.rolling_mean(panel.last_bars('close', threshold + 29, as_of), 30)
+    step1 = round(threshold/3)
+    step2 = round(threshold*2/3)
+    return (ma30[:, 0] < ma30[:, step1]) & (ma30[:, step1] < ma30[:, step2]) & (ma30[:, step2] < ma30[:, -1]) & \
+        (ma30[:, -1] > 1.2*ma30[:, 0])
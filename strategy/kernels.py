@@ -0,0 +1,125 @@
+# -*- encoding: UTF-8 -*-
+"""
+Array primitives for per-stock strategies.
+
+The classic strategies used to walk their window with `data.iterrows()` or an
+`iloc` loop to find highs and lows, cross-ups, runs of limit-up days and drawdown
+bars. These kernels answer the same questions on the column arrays in one pass:
+
+    close = kernels.as_of(data, end_date)['收盘'].values[-60:]
+    highest = kernels.scan_argmax(close)
+
+NaN compares False everywhere, as it did in the row loops.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def as_of(data, end_date):
+    """`data.loc[data['日期'] <= end_date]`, sliced by binary search when 日期 is sorted."""
+    if end_date is None:
+        return data
+    dates = data['日期']
+    if dates.is_monotonic_increasing:
+        try:
+            return data.iloc[:int(dates.searchsorted(end_date, side='right'))]
+        except TypeError:
+            pass
+    return data.loc[dates <= end_date]
+
+
+def _filled(values, fill):
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isnan(values), fill, values)
+
+
+def first_argmax(values):
+    """Index of the first maximum, skipping NaN (0 if every value is NaN)."""
+    return int(np.argmax(_filled(values, -np.inf)))
+
+
+def first_argmin(values):
+    """Index of the first minimum, skipping NaN (0 if every value is NaN)."""
+    return int(np.argmin(_filled(values, np.inf)))
+
+
+def scan_argmax(values):
+    """
+    Index the legacy scan `best = last; for v in values: if v > best: best = v` ends
+    on: the first maximum if it beats the last value, else the last index.
+    """
+    i = first_argmax(values)
+    return i if values[i] > values[-1] else len(values) - 1
+
+
+def scan_argmin(values):
+    """scan_argmax for `if v < best`."""
+    i = first_argmin(values)
+    return i if values[i] < values[-1] else len(values) - 1
+
+
+def rolling_argmax(values, window):
+    """Per bar, index of the first maximum of the `window` bars ending there (-1 before the first full window)."""
+    out = np.full(len(values), -1, dtype=np.int64)
+    if len(values) >= window:
+        out[window - 1:] = sliding_window_view(_filled(values, -np.inf), window).argmax(axis=1) + np.arange(len(values) - window + 1)
+    return out
+
+
+def rolling_argmin(values, window):
+    """rolling_argmax for the minimum."""
+    out = np.full(len(values), -1, dtype=np.int64)
+    if len(values) >= window:
+        out[window - 1:] = sliding_window_view(_filled(values, np.inf), window).argmin(axis=1) + np.arange(len(values) - window + 1)
+    return out
+
+
+def _take(values, index):
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(index >= 0, values[np.maximum(index, 0)], np.nan)
+
+
+def rolling_max(values, window):
+    """Max of the `window` bars ending at each bar, skipping NaN; NaN before the first full window."""
+    return _take(values, rolling_argmax(values, window))
+
+
+def rolling_min(values, window):
+    """rolling_max for the minimum."""
+    return _take(values, rolling_argmin(values, window))
+
+
+def cross_up(fast, slow):
+    """True on the bars where `fast` closes above `slow` after being at or below it the bar before."""
+    fast, slow = np.asarray(fast, dtype=np.float64), np.asarray(slow, dtype=np.float64)
+    out = np.zeros(len(fast), dtype=bool)
+    out[1:] = (fast[:-1] <= slow[:-1]) & (fast[1:] > slow[1:])
+    return out
+
+
+def crossed_up_within(fast, slow, k):
+    """Whether `fast` crossed above `slow` on one of the last `k` bars."""
+    return k > 0 and bool(cross_up(fast, slow)[-k:].any())
+
+
+def run_length(condition):
+    """Per bar, how many bars in a row up to and including it satisfy `condition`."""
+    condition = np.asarray(condition, dtype=bool)
+    index = np.arange(len(condition))
+    last_break = np.maximum.accumulate(np.where(condition, -1, index)) if len(condition) else index
+    return index - last_break
+
+
+def _segment_counts(condition, starts, stops):
+    counts = np.concatenate(([0], np.cumsum(np.asarray(condition, dtype=np.int64))))
+    return counts[np.asarray(stops)] - counts[np.asarray(starts)]
+
+
+def segment_all(condition, starts, stops):
+    """Per segment [starts[i], stops[i]), whether `condition` holds on every bar (True if empty)."""
+    return _segment_counts(condition, starts, stops) == np.asarray(stops) - np.asarray(starts)
+
+
+def segment_any(condition, starts, stops):
+    """Per segment [starts[i], stops[i]), whether `condition` holds on some bar."""
+    return _segment_counts(condition, starts, stops) > 0
@@ -3,6 +3,11 @@ import pandas as pd
 import talib as tl
 import logging
 
+import numpy as np
+
+import feature_store
+from strategy import kernels
+
 
 # 低ATR成长策略
 def check_low_increase(code_name, data, end_date=None, ma_short=30, ma_long=250, threshold=10):
@@ -12,54 +17,39 @@ def check_low_increase(code_name, data, end_date=None, ma_short=30, ma_long=250,
         logging.debug("{0}:样本小于{1}天...\n".format(code_name, ma_long))
         return False
 
-    data['ma_short'] = pd.Series(tl.MA(data['收盘'].values, ma_short), index=data.index.values)
-    data['ma_long'] = pd.Series(tl.MA(data['收盘'].values, ma_long), index=data.index.values)
+    data['ma_short'] = feature_store.series(code_name, data, 'MA', timeperiod=ma_short)
+    data['ma_long'] = feature_store.series(code_name, data, 'MA', timeperiod=ma_long)
 
-    if end_date is not None:
-        mask = (data['日期'] <= end_date)
-        data = data.loc[mask]
-    data = data.tail(n=threshold)
-    inc_days = 0
-    dec_days = 0
+    data = kernels.as_of(data, end_date).tail(n=threshold)
     if len(data) < threshold:
         logging.debug("{0}:样本小于{1}天...\n".format(code_name, threshold))
         return False
 
-    # 区间最低点
-    lowest_row = data.iloc[-1]
-    # 区间最高点
-    highest_row = data.iloc[-1]
-
+    close = data['收盘'].values.astype(float)
     days_count = len(data)
-    total_change = 0.0
-    for index, row in data.iterrows():
-        if 'p_change' in row:
-            p_change = float(row['p_change'])
-            if abs(p_change) > 0:
-                total_change += abs(p_change)
-            # if p_change < -7:
-            #     return False
-            # if row['ma_short'] < row['ma_long']:
-            #     return False
-
-            if p_change > 0:
-                inc_days = inc_days + 1
-            if p_change < 0:
-                dec_days = dec_days + 1
-
-            if row['收盘'] > highest_row['收盘']:
-                highest_row = row
-            if row['收盘'] < lowest_row['收盘']:
-                lowest_row = row
+    if 'p_change' in data.columns:
+        p_change = data['p_change'].values.astype(float)
+        inc_days = int((p_change > 0).sum())
+        dec_days = int((p_change < 0).sum())
+        # Accumulated in row order like the original loop, so the average is bit-identical
+        total_change = float(np.cumsum(np.where(np.isnan(p_change), 0.0, np.abs(p_change)))[-1])
+        # 区间最高点、最低点
+        highest = kernels.scan_argmax(close)
+        lowest = kernels.scan_argmin(close)
+    else:
+        inc_days = dec_days = 0
+        total_change = 0.0
+        highest = lowest = days_count - 1
 
     atr = total_change / days_count
     if atr > 10:
         return False
 
-    ratio = (highest_row['收盘'] - lowest_row['收盘']) / lowest_row['收盘']
+    ratio = (close[highest] - close[lowest]) / close[lowest]
 
     if ratio > 1.1:
-        logging.debug("股票：{0}（{1}）  最低:{2}, 最高:{3}, 涨跌比率:{4}       上涨天数:{5}， 下跌天数:{6}".format(name, stock, lowest_row['日期'], highest_row['日期'], ratio, inc_days, dec_days))
+        dates = data['日期'].values
+        logging.debug("股票：{0}（{1}）  最低:{2}, 最高:{3}, 涨跌比率:{4}       上涨天数:{5}， 下跌天数:{6}".format(name, stock, dates[lowest], dates[highest], ratio, inc_days, dec_days))
         return True
 
     return False
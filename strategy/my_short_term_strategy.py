@@ -4,11 +4,18 @@ import logging
 import talib
 import numpy as np
 import settings # Import settings to get global config
+import feature_store
+import funnel
+import indicator_state
+import rule_engine
+from strategy import kernels
 
 logger = logging.getLogger(__name__) # Get the shared logger
 
 # Define a display name for the strategy
 STRATEGY_NAME = "东方财富短线策略"
+# Pure DataFrame/TA-Lib computation (see strategy_scheduler.py)
+RESOURCE_CLASS = 'cpu'
 
 # --- Strategy Configuration Defaults ---
 DEFAULT_STRATEGY_CONFIG = {
@@ -43,8 +50,8 @@ def get_strategy_config():
     """
     return settings.get_config().get('strategies', {}).get(STRATEGY_NAME, DEFAULT_STRATEGY_CONFIG)
 
-def calculate_indicators(data: pd.DataFrame):
-    """Calculates all necessary technical indicators for the strategy."""
+def prepare(data: pd.DataFrame):
+    """Sorts `data` by 日期 and coerces the value columns the indicators read (in place where possible)."""
     data['日期'] = pd.to_datetime(data['日期'])
     data = data.sort_values(by='日期').reset_index(drop=True)
 
@@ -56,34 +63,184 @@ def calculate_indicators(data: pd.DataFrame):
             data[col] = data[col].ffill()
         else:
             data[col] = data[col].fillna(0)
+    return data
+
+
+def indicator_specs(config):
+    """[(frame columns, feature_store.INDICATORS name, params)] of the strategy's indicators."""
+    return [
+        (('MA5',), 'SMA', {'timeperiod': 5}),
+        (('MA10',), 'SMA', {'timeperiod': 10}),
+        (('MA20',), 'SMA', {'timeperiod': 20}),
+        (('MACD_DIF', 'MACD_DEA', 'MACD_HIST'), 'MACD', {'fastperiod': 12, 'slowperiod': 26, 'signalperiod': 9}),
+        (('KDJ_K', 'KDJ_D'), 'STOCH', {'fastk_period': 9, 'slowk_period': 3, 'slowd_period': 3}),
+        (('RSI',), 'RSI', {'timeperiod': config['rsi_period']}),
+        (('BOLL_UPPER', 'BOLL_MIDDLE', 'BOLL_LOWER'), 'BBANDS', {'timeperiod': 20, 'nbdevup': 2, 'nbdevdn': 2}),
+        (('VOL_MA5',), 'SMA', {'column': '成交量', 'timeperiod': config['volume_ratio_to_5day_avg_days']}),
+    ]
 
-    close = data['收盘'].values.astype(np.float64)
-    high = data['最高'].values.astype(np.float64)
-    low = data['最低'].values.astype(np.float64)
-    volume = data['成交量'].values.astype(np.float64)
 
-    data['MA5'] = talib.SMA(close, timeperiod=5)
-    data['MA10'] = talib.SMA(close, timeperiod=10)
-    data['MA20'] = talib.SMA(close, timeperiod=20)
+def _indicator_values(code, data, name, params):
+    if code is not None and indicator_state.enabled():
+        # Incremental states only hold the last `keep` values; check_enter reads the latest few rows
+        return indicator_state.tail(code, data, name, **params)
+    if code is not None:
+        return feature_store.get(code, data, name, **params)
+    return feature_store.INDICATORS[name](data, **params)
 
-    data['MACD_DIF'], data['MACD_DEA'], data['MACD_HIST'] = talib.MACD(
-        close, fastperiod=12, slowperiod=26, signalperiod=9
-    )
 
-    data['KDJ_K'], data['KDJ_D'] = talib.STOCH(
-        high, low, close, fastk_period=9, slowk_period=3, slowd_period=3
-    )
+def calculate_indicators(data: pd.DataFrame, code=None):
+    """
+    Calculates all necessary technical indicators for the strategy. With `code` the
+    indicators come from the shared feature store (see feature_store.py), or from the
+    incremental indicator states when settings 'indicator_state' is enabled (see
+    indicator_state.py; then only the last `keep` rows carry values).
+    """
+    data = prepare(data)
+    for columns, name, params in indicator_specs(get_strategy_config()):
+        value = _indicator_values(code, data, name, params)
+        for column, array in zip(columns, value if isinstance(value, tuple) else (value,)):
+            # Cached arrays are read-only and tails are short; the frame gets its own full-length copies
+            column_values = np.full(len(data), np.nan)
+            if len(array):
+                column_values[-len(array):] = array
+            data[column] = column_values
     data['KDJ_J'] = 3 * data['KDJ_K'] - 2 * data['KDJ_D']
 
-    data['RSI'] = talib.RSI(close, timeperiod=get_strategy_config()['rsi_period'])
+    return data
 
-    data['BOLL_UPPER'], data['BOLL_MIDDLE'], data['BOLL_LOWER'] = talib.BBANDS(
-        close, timeperiod=20, nbdevup=2, nbdevdn=2
-    )
 
-    data['VOL_MA5'] = talib.SMA(volume, timeperiod=get_strategy_config()['volume_ratio_to_5day_avg_days'])
+# --- Entry rules (see rule_engine.py) ---
+# Each rule reads ctx['data'] (prepared bars), ctx['config'] and the indicators it
+# declares; indicators are (possibly short) arrays ending at the last bar.
 
-    return data
+def _provider(name, params_of):
+    def provide(ctx):
+        value = _indicator_values(ctx['code'], ctx['data'], name, params_of(ctx['config']))
+        return value if isinstance(value, tuple) else (value,)
+    return provide
+
+
+PROVIDERS = {
+    'MA5': _provider('SMA', lambda config: {'timeperiod': 5}),
+    'MA10': _provider('SMA', lambda config: {'timeperiod': 10}),
+    'MA20': _provider('SMA', lambda config: {'timeperiod': 20}),
+    'MACD': _provider('MACD', lambda config: {'fastperiod': 12, 'slowperiod': 26, 'signalperiod': 9}),
+    'KDJ': _provider('STOCH', lambda config: {'fastk_period': 9, 'slowk_period': 3, 'slowd_period': 3}),
+    'RSI': _provider('RSI', lambda config: {'timeperiod': config['rsi_period']}),
+    'BOLL': _provider('BBANDS', lambda config: {'timeperiod': 20, 'nbdevup': 2, 'nbdevdn': 2}),
+    'VOL_MA5': _provider('SMA', lambda config: {'column': '成交量', 'timeperiod': config['volume_ratio_to_5day_avg_days']}),
+}
+
+
+def _last(ctx, column, i=-1):
+    return ctx['data'][column].values[i]
+
+
+def _limit_up(ctx):
+    if not ctx['config']['check_limit_up']:
+        return True
+    # NaN compares False
+    return _last(ctx, '涨跌幅') >= ctx['config']['limit_up_threshold']
+
+
+def _avg_turnover_amount(ctx):
+    config = ctx['config']
+    amount = ctx['data']['成交额'].values[-config['avg_turnover_days']:]
+    return len(amount) > 0 and amount.mean() >= config['min_avg_daily_turnover_amount']
+
+
+def _turnover_rate(ctx):
+    config = ctx['config']
+    return config['min_daily_turnover_rate'] <= _last(ctx, '换手率') <= config['max_daily_turnover_rate']
+
+
+def _bars_complete(ctx):
+    return not ctx['data'].iloc[-2:].isnull().values.any()
+
+
+def _indicators_complete(ctx):
+    arrays = [array for name in PROVIDERS for array in ctx[name]]
+    return all(len(array) >= 2 and not np.isnan(array[-2:]).any() for array in arrays)
+
+
+def _ma5_cross_ma10(ctx):
+    (ma5,), (ma10,) = ctx['MA5'], ctx['MA10']
+    return kernels.crossed_up_within(ma5, ma10, ctx['config']['ma5_cross_ma10_period'])
+
+
+def _close_above_ma20(ctx):
+    return not ctx['config']['close_above_ma20'] or _last(ctx, '收盘') > ctx['MA20'][0][-1]
+
+
+def _macd_gold_cross(ctx):
+    dif, dea, _ = ctx['MACD']
+    return kernels.crossed_up_within(dif, dea, ctx['config']['macd_gold_cross_within_days'])
+
+
+def _macd_above_zero(ctx):
+    dif, dea, _ = ctx['MACD']
+    return not ctx['config']['macd_dif_above_dea_and_zero'] or (dif[-1] > dea[-1] and dif[-1] > 0)
+
+
+def _volume_ratio(ctx):
+    config = ctx['config']
+    vol_ma5 = ctx['VOL_MA5'][0][-1]
+    if not vol_ma5 > 0:
+        return False
+    return config['volume_ratio_to_5day_avg_min'] <= _last(ctx, '成交量') / vol_ma5 <= config['volume_ratio_to_5day_avg_max']
+
+
+def _boll_break_middle(ctx):
+    if not ctx['config']['boll_break_middle_band']:
+        return True
+    middle = ctx['BOLL'][1]
+    return _last(ctx, '收盘', -2) <= middle[-2] and _last(ctx, '收盘') > middle[-1]
+
+
+def _rsi_cross(ctx):
+    config = ctx['config']
+    (rsi,) = ctx['RSI']
+    return not config['rsi_cross_30'] or (rsi[-2] <= config['rsi_lower_limit'] < rsi[-1])
+
+
+def _rsi_band(ctx):
+    config = ctx['config']
+    return config['rsi_lower_limit'] <= ctx['RSI'][0][-1] <= config['rsi_upper_limit']
+
+
+def _kdj_gold_cross(ctx):
+    k, d = ctx['KDJ']
+    return not ctx['config']['kdj_gold_cross'] or (k[-2] <= d[-2] and k[-1] > d[-1])
+
+
+def _kdj_j_band(ctx):
+    config = ctx['config']
+    k, d = ctx['KDJ']
+    j = 3 * k[-1] - 2 * d[-1]
+    return config['kdj_j_lower_limit'] <= j < config['kdj_j_upper_limit']
+
+
+# Declared cheapest first; the engine reorders by measured cost and rejection rate
+RULES = [
+    rule_engine.Rule('涨停', _limit_up),
+    rule_engine.Rule('换手率', _turnover_rate),
+    rule_engine.Rule('日均成交额', _avg_turnover_amount),
+    rule_engine.Rule('数据完整', _bars_complete),
+    rule_engine.Rule('均线金叉', _ma5_cross_ma10, needs=('MA5', 'MA10')),
+    rule_engine.Rule('站上20日线', _close_above_ma20, needs=('MA20',)),
+    rule_engine.Rule('放量', _volume_ratio, needs=('VOL_MA5',)),
+    rule_engine.Rule('MACD金叉', _macd_gold_cross, needs=('MACD',)),
+    rule_engine.Rule('MACD多头', _macd_above_zero, needs=('MACD',)),
+    rule_engine.Rule('RSI上穿', _rsi_cross, needs=('RSI',)),
+    rule_engine.Rule('RSI区间', _rsi_band, needs=('RSI',)),
+    rule_engine.Rule('KDJ金叉', _kdj_gold_cross, needs=('KDJ',)),
+    rule_engine.Rule('KDJ J值', _kdj_j_band, needs=('KDJ',)),
+    rule_engine.Rule('布林中轨', _boll_break_middle, needs=('BOLL',)),
+    # Every indicator must have values on the last two bars
+    rule_engine.Rule('指标完整', _indicators_complete, needs=tuple(PROVIDERS)),
+]
+ENGINE = rule_engine.RuleEngine(STRATEGY_NAME, RULES, PROVIDERS)
 
 
 def check_enter(stock_code_tuple, stock_data, end_date=None):
@@ -93,9 +250,8 @@ def check_enter(stock_code_tuple, stock_data, end_date=None):
     code, name = stock_code_tuple
     config = get_strategy_config()
 
-    logger.debug(f"[{name}({code})]: 开始检查东方财富App短线策略。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-
     if not isinstance(stock_data, pd.DataFrame) or stock_data.empty:
+        funnel.reject(STRATEGY_NAME, '数据为空', code)
         logger.warning(f"[{name}({code})]: 策略收到空或非DataFrame数据，跳过。", extra={'stock': code, 'strategy': STRATEGY_NAME})
         return False
     
@@ -103,6 +259,7 @@ def check_enter(stock_code_tuple, stock_data, end_date=None):
     required_cols_for_strategy = {'日期', '收盘', '开盘', '最高', '最低', '成交量', '换手率', '成交额', '涨跌幅'} # ADD '涨跌幅'
     if not required_cols_for_strategy.issubset(stock_data.columns):
         missing_cols = required_cols_for_strategy - set(stock_data.columns)
+        funnel.reject(STRATEGY_NAME, '缺少列', code)
         logger.warning(f"[{name}({code})]: 数据缺少策略所需关键列: {missing_cols}，跳过。", extra={'stock': code, 'strategy': STRATEGY_NAME})
         return False
 
@@ -134,122 +291,20 @@ def check_enter(stock_code_tuple, stock_data, end_date=None):
         config.get('min_listed_days', 60)
     ) + 5
 
+    # Also covers the 上市天数 (min_listed_days) condition
     if len(data) < min_required_len:
-        logger.debug(f"[{name}({code})]: 数据长度不足 {min_required_len} 天 ({len(data)}天)，无法计算所有指标，跳过。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-
-    data = calculate_indicators(data) 
-
-    if len(data) < 2 or data.iloc[-1].isnull().any() or data.iloc[-2].isnull().any():
-        logger.debug(f"[{name}({code})]: 计算指标后数据不足两天或包含NaN值，无法进行前后日比较，跳过。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-
-    latest_data = data.iloc[-1]
-    prev_data = data.iloc[-2]
-
-    # --- NEW: Check for Limit Up (涨停) condition ---
-    if config['check_limit_up']:
-        # Ensure '涨跌幅' is not NaN before checking
-        if pd.isna(latest_data['涨跌幅']):
-            logger.debug(f"[{name}({code})]: '涨跌幅'数据为NaN，无法判断涨停。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-            return False
-
-        # For A-shares, 10% is the normal limit, but often 9.9% or 9.95% is used for a strict check
-        # We use the configurable 'limit_up_threshold'
-        if latest_data['涨跌幅'] < config['limit_up_threshold']:
-            logger.debug(f"[{name}({code})]: 涨跌幅 ({latest_data['涨跌幅']:.2f}%) 未达到涨停阈值 ({config['limit_up_threshold']:.2f}%)。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-            return False
-
-    # --- Basic Screening Conditions ---
-    listed_days = len(data)
-    if listed_days < config['min_listed_days']:
-        logger.debug(f"[{name}({code})]: 上市天数不足 {config['min_listed_days']} 天 ({listed_days}天)。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-
-    avg_daily_turnover_amount_series = data['成交额'].iloc[-config['avg_turnover_days']:]
-    if avg_daily_turnover_amount_series.empty:
-        logger.debug(f"[{name}({code})]: 近{config['avg_turnover_days']}天成交额数据不足，跳过。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-    avg_daily_turnover_amount = avg_daily_turnover_amount_series.mean()
-
-    if pd.isna(avg_daily_turnover_amount) or avg_daily_turnover_amount < config['min_avg_daily_turnover_amount']:
-        logger.debug(f"[{name}({code})]: 日均成交额 ({avg_daily_turnover_amount/1_000_000:.2f}亿) 低于 {config['min_avg_daily_turnover_amount']/1_000_000:.2f}亿。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-
-    # --- Technical Indicator Screening (Core Logic) ---
-
-    ma5_cross_ma10 = False
-    lookback_start_idx = max(0, len(data) - config['ma5_cross_ma10_period'] - 1)
-    for i in range(lookback_start_idx, len(data) - 1):
-        if data['MA5'].iloc[i] <= data['MA10'].iloc[i] and data['MA5'].iloc[i+1] > data['MA10'].iloc[i+1]:
-            ma5_cross_ma10 = True
-            break
-    if not ma5_cross_ma10:
-        logger.debug(f"[{name}({code})]: 近{config['ma5_cross_ma10_period']}天未发生5日均线上穿10日均线。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-
-    if config['close_above_ma20'] and not (latest_data['收盘'] > latest_data['MA20']):
-        logger.debug(f"[{name}({code})]: 股价 ({latest_data['收盘']:.2f}) 未高于20日均线 ({latest_data['MA20']:.2f})。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-
-    macd_gold_cross = False
-    lookback_start_idx_macd = max(0, len(data) - config['macd_gold_cross_within_days'] - 1)
-    for i in range(lookback_start_idx_macd, len(data) - 1):
-        if data['MACD_DIF'].iloc[i] <= data['MACD_DEA'].iloc[i] and \
-           data['MACD_DIF'].iloc[i+1] > data['MACD_DEA'].iloc[i+1]:
-            macd_gold_cross = True
-            break
-    if not macd_gold_cross:
-        logger.debug(f"[{name}({code})]: 近{config['macd_gold_cross_within_days']}天未发生MACD金叉。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-    if config['macd_dif_above_dea_and_zero'] and not (latest_data['MACD_DIF'] > latest_data['MACD_DEA'] and latest_data['MACD_DIF'] > 0):
-        logger.debug(f"[{name}({code})]: MACD不满足 DIF > DEA 且 DIF > 0。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False 
-    
-    if latest_data['VOL_MA5'] <= 0 or pd.isna(latest_data['VOL_MA5']):
-        logger.debug(f"[{name}({code})]: 5日均量为零、负或NaN，无法计算放量比。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-    
-    volume_ratio = latest_data['成交量'] / latest_data['VOL_MA5']
-    if not (config['volume_ratio_to_5day_avg_min'] <= volume_ratio <= config['volume_ratio_to_5day_avg_max']):
-        logger.debug(f"[{name}({code})]: 成交量 ({latest_data['成交量']:.0f}) 不满足放量条件 ({volume_ratio:.2f}倍5日均量)，要求 {config['volume_ratio_to_5day_avg_min']} - {config['volume_ratio_to_5day_avg_max']} 倍。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-    
-    if config['boll_break_middle_band'] and not (
-        not pd.isna(prev_data['收盘']) and not pd.isna(prev_data['BOLL_MIDDLE']) and \
-        not pd.isna(latest_data['收盘']) and not pd.isna(latest_data['BOLL_MIDDLE']) and \
-        prev_data['收盘'] <= prev_data['BOLL_MIDDLE'] and latest_data['收盘'] > latest_data['BOLL_MIDDLE']
-    ):
-        logger.debug(f"[{name}({code})]: 未上穿布林带中轨或布林带数据异常。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-
-    if config['rsi_cross_30'] and (len(data) > 1) and not (
-        not pd.isna(data['RSI'].iloc[-2]) and not pd.isna(latest_data['RSI']) and \
-        data['RSI'].iloc[-2] <= config['rsi_lower_limit'] and latest_data['RSI'] > config['rsi_lower_limit']
-    ):
-        logger.debug(f"[{name}({code})]: RSI ({latest_data['RSI']:.2f}) 未上穿 {config['rsi_lower_limit']} 或RSI数据异常。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-    if not (not pd.isna(latest_data['RSI']) and \
-            config['rsi_lower_limit'] <= latest_data['RSI'] <= config['rsi_upper_limit']):
-        logger.debug(f"[{name}({code})]: RSI ({latest_data['RSI']:.2f}) 不在 {config['rsi_lower_limit']}-{config['rsi_upper_limit']} 区间或RSI数据异常。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-
-    if config['kdj_gold_cross'] and (len(data) > 1) and not (
-        not pd.isna(prev_data['KDJ_K']) and not pd.isna(prev_data['KDJ_D']) and \
-        not pd.isna(latest_data['KDJ_K']) and not pd.isna(latest_data['KDJ_D']) and \
-        prev_data['KDJ_K'] <= prev_data['KDJ_D'] and latest_data['KDJ_K'] > latest_data['KDJ_D']
-    ):
-        logger.debug(f"[{name}({code})]: KDJ未金叉或KDJ数据异常。", extra={'stock': code, 'strategy': STRATEGY_NAME})
-        return False
-    if not (not pd.isna(latest_data['KDJ_J']) and \
-            config['kdj_j_lower_limit'] <= latest_data['KDJ_J'] < config['kdj_j_upper_limit']):
-        logger.debug(f"[{name}({code})]: KDJ J值 ({latest_data['KDJ_J']:.2f}) 不在 {config['kdj_j_lower_limit']}-{config['kdj_j_upper_limit']} 区间或KDJ数据异常。", extra={'stock': code, 'strategy': STRATEGY_NAME})
+        funnel.reject(STRATEGY_NAME, '数据长度', code, len(data))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[{name}({code})]: 数据长度不足 {min_required_len} 天 ({len(data)}天)，无法计算所有指标，跳过。", extra={'stock': code, 'strategy': STRATEGY_NAME})
         return False
 
-    if not (not pd.isna(latest_data['换手率']) and \
-            config['min_daily_turnover_rate'] <= latest_data['换手率'] <= config['max_daily_turnover_rate']):
-        logger.debug(f"[{name}({code})]: 换手率 ({latest_data['换手率']:.2f}%) 不在 {config['min_daily_turnover_rate']}-{config['max_daily_turnover_rate']}% 区间或换手率数据异常。", extra={'stock': code, 'strategy': STRATEGY_NAME})
+    passed, failed_rule = ENGINE.evaluate(code=code, data=prepare(data), config=config)
+    if not passed:
+        funnel.reject(STRATEGY_NAME, failed_rule, code)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[{name}({code})]: 未通过「{failed_rule}」条件。", extra={'stock': code, 'strategy': STRATEGY_NAME})
         return False
 
+    funnel.accept(STRATEGY_NAME)
     logger.info(f"[{name}({code})]: ✨ 股票符合东方财富App短线策略所有入场条件！", extra={'stock': code, 'strategy': STRATEGY_NAME})
-    return True
\ No newline at end of file
+    return True
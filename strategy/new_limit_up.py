@@ -2,10 +2,12 @@
 import pandas as pd
 import logging
 import settings # Import settings to get global config
+import funnel
 
 logger = logging.getLogger(__name__)
 
 STRATEGY_NAME = "涨停板次日溢价" # Define unique display name for this strategy
+RESOURCE_CLASS = 'cpu' # check_enter only looks at the passed DataFrame
 
 # Default config for this strategy
 DEFAULT_STRATEGY_CONFIG = {
@@ -30,13 +32,16 @@ def check_enter(stock_code_tuple, stock_data, end_date=None):
     """
     Checks if a stock meets the entry conditions for the '涨停板次日溢价' strategy.
     This function should define what makes a stock a candidate for the limit-up next-day premium.
+    Rejections are counted in the run's funnel (see funnel.py); the messages are only built at DEBUG.
     """
     code, name = stock_code_tuple
     config = get_strategy_config()
-    logger.debug(f"[{name}({code})]: 检查涨停板次日溢价策略入场条件。", extra={'stock': code, 'strategy': STRATEGY_NAME})
+    debug = logger.isEnabledFor(logging.DEBUG)
 
     if stock_data.empty or len(stock_data) < 2:
-        logger.debug(f"[{name}({code})]: 数据不足两天，无法判断涨停板次日溢价。", extra={'stock': code, 'strategy': STRATEGY_NAME})
+        funnel.reject(STRATEGY_NAME, '数据不足', code, len(stock_data))
+        if debug:
+            logger.debug(f"[{name}({code})]: 数据不足两天，无法判断涨停板次日溢价。", extra={'stock': code, 'strategy': STRATEGY_NAME})
         return False
 
     # Ensure '日期' is datetime and data is sorted
@@ -50,7 +55,9 @@ def check_enter(stock_code_tuple, stock_data, end_date=None):
         data = stock_data.copy()
 
     if data.empty or len(data) < 2:
-        logger.debug(f"[{name}({code})]: 过滤日期后数据不足两天，无法判断涨停板次日溢价。", extra={'stock': code, 'strategy': STRATEGY_NAME})
+        funnel.reject(STRATEGY_NAME, '数据不足', code, len(data))
+        if debug:
+            logger.debug(f"[{name}({code})]: 过滤日期后数据不足两天，无法判断涨停板次日溢价。", extra={'stock': code, 'strategy': STRATEGY_NAME})
         return False
 
     latest_data = data.iloc[-1]
@@ -61,18 +68,23 @@ def check_enter(stock_code_tuple, stock_data, end_date=None):
     # To calculate daily change, you need '前收盘' (previous close) or use (close - open) / open
     # Assuming '涨跌幅' column is available and accurate
     if '涨跌幅' not in latest_data:
+        funnel.reject(STRATEGY_NAME, '缺少涨跌幅', code)
         logger.warning(f"[{name}({code})]: 缺少'涨跌幅'列，无法判断涨停。", extra={'stock': code, 'strategy': STRATEGY_NAME})
         return False
         
     is_limit_up_today = latest_data['涨跌幅'] >= config['price_limit_up_threshold']
 
     if not is_limit_up_today:
-        logger.debug(f"[{name}({code})]: 今日 ({latest_data['日期'].strftime('%Y-%m-%d')}) 涨幅 ({latest_data['涨跌幅']:.2f}%) 未达涨停标准 ({config['price_limit_up_threshold']:.1f}%)。", extra={'stock': code, 'strategy': STRATEGY_NAME})
+        funnel.reject(STRATEGY_NAME, '未涨停', code, latest_data['涨跌幅'])
+        if debug:
+            logger.debug(f"[{name}({code})]: 今日 ({latest_data['日期'].strftime('%Y-%m-%d')}) 涨幅 ({latest_data['涨跌幅']:.2f}%) 未达涨停标准 ({config['price_limit_up_threshold']:.1f}%)。", extra={'stock': code, 'strategy': STRATEGY_NAME})
         return False
 
     # 2. Turnover Rate within reasonable bounds
     if not (config['min_turnover_rate'] <= latest_data['换手率'] <= config['max_turnover_rate']):
-        logger.debug(f"[{name}({code})]: 换手率 ({latest_data['换手率']:.2f}%) 不在 {config['min_turnover_rate']}-{config['max_turnover_rate']}% 区间。", extra={'stock': code, 'strategy': STRATEGY_NAME})
+        funnel.reject(STRATEGY_NAME, '换手率', code, latest_data['换手率'])
+        if debug:
+            logger.debug(f"[{name}({code})]: 换手率 ({latest_data['换手率']:.2f}%) 不在 {config['min_turnover_rate']}-{config['max_turnover_rate']}% 区间。", extra={'stock': code, 'strategy': STRATEGY_NAME})
         return False
         
     # Additional checks could include:
@@ -81,6 +93,7 @@ def check_enter(stock_code_tuple, stock_data, end_date=None):
     # - Volume surge today (e.g., today's volume much higher than recent average)
     # - No obvious negative news (requires external data)
 
+    funnel.accept(STRATEGY_NAME)
     logger.info(f"[{name}({code})]: 符合涨停板次日溢价入场条件。", extra={'stock': code, 'strategy': STRATEGY_NAME})
     return True
 
@@ -1,63 +1,46 @@
 # -*- encoding: UTF-8 -*-
 
 import logging
+
+import numpy as np
+
+from strategy import kernels
 from strategy import turtle_trade
+from strategy.context import AsOfContext
 
 
 # “停机坪”策略
 def check(code_name, data, end_date=None, threshold=15):
     origin_data = data
-
-    if end_date is not None:
-        mask = (data['日期'] <= end_date)
-        data = data.loc[mask]
+    data = kernels.as_of(data, end_date)
 
     if len(data) < threshold:
         logging.debug("{0}:样本小于{1}天...\n".format(code_name, threshold))
         return
 
-    data = data.tail(n=threshold)
-
-    flag = False
-
-    # 找出涨停日
-    for index, row in data.iterrows():
-        try:
-            if float(row['p_change']) > 9.5:
-                if turtle_trade.check_enter(code_name, origin_data, row['日期'], threshold):
-                    if check_internal(code_name, data, row):
-                        flag = True
-        except KeyError as error:
-            logging.debug("{}处理异常：{}".format(code_name, error))
-
-    return flag
-
-
-def check_internal(code_name, data, limitup_row):
-    limitup_price = limitup_row['收盘']
-    limitup_end = data.loc[(data['日期'] > limitup_row['日期'])]
-    limitup_end = limitup_end.head(n=3)
-    if len(limitup_end.index) < 3:
+    try:
+        p_change = data['p_change'].values[-threshold:].astype(float)
+    except KeyError as error:
+        logging.debug("{}处理异常：{}".format(code_name, error))
         return False
-
-    consolidation_day1 = limitup_end.iloc[0]
-    consolidation_day23 = limitup_end = limitup_end.tail(n=2)
-
-    if not(consolidation_day1['收盘'] > limitup_price and consolidation_day1['开盘'] > limitup_price and
-        0.97 < consolidation_day1['收盘'] / consolidation_day1['开盘'] < 1.03):
-        return False
-
-    threshold_price = limitup_end.iloc[-1]['收盘']
-
-    for index, row in consolidation_day23.iterrows():
-        try:
-            if not (0.97 < (row['收盘'] / row['开盘']) < 1.03 and -5 < row['p_change'] < 5
-                    and row['收盘'] > limitup_price and row['开盘'] > limitup_price):
-                return False
-        except KeyError as error:
-            logging.debug("{}处理异常：{}".format(code_name, error))
-
-    logging.debug("股票{0} 涨停日期：{1}".format(code_name, limitup_row['日期']))
-
-    return True
-
+    close = data['收盘'].values[-threshold:].astype(float)
+    open_ = data['开盘'].values[-threshold:].astype(float)
+    dates = data['日期'].values[-threshold:]
+
+    # 找出涨停日（当天收盘为近期新高），其后还要有三天整理
+    new_high = AsOfContext(code_name, origin_data).signal(turtle_trade.check_enter, threshold=threshold)
+    limit_up = np.flatnonzero((p_change > 9.5) & new_high[len(data) - threshold:len(data)])
+    limit_up = limit_up[limit_up + 3 < threshold]
+    limitup_price = close[limit_up]
+
+    # 三天整理：开盘、收盘都在涨停价之上，实体不超过3%，后两天涨跌幅在5%以内
+    body = (0.97 < close / open_) & (close / open_ < 1.03)
+    calm = body & (-5 < p_change) & (p_change < 5)
+    above = np.ones(len(limit_up), dtype=bool)
+    for k in (1, 2, 3):
+        above &= (close[limit_up + k] > limitup_price) & (open_[limit_up + k] > limitup_price)
+    matched = limit_up[above & body[limit_up + 1] & kernels.segment_all(calm, limit_up + 2, limit_up + 4)]
+
+    for i in matched:
+        logging.debug("股票{0} 涨停日期：{1}".format(code_name, dates[i]))
+    return bool(len(matched))
@@ -1,4 +1,8 @@
 # -*- coding: UTF-8 -*-
+import numpy as np
+
+import universe
+from strategy import kernels
 
 # 总市值
 BALANCE = 200000
@@ -6,22 +10,25 @@ BALANCE = 200000
 
 # 最后一个交易日收市价为指定区间内最高价
 def check_enter(code_name, data, end_date=None, threshold=60):
-    max_price = 0
-    if end_date is not None:
-        mask = (data['日期'] <= end_date)
-        data = data.loc[mask]
+    data = kernels.as_of(data, end_date)
     if data is None:
         return False
-    data = data.tail(n=threshold)
-    if len(data) < threshold:
+    close = data['收盘'].values[-threshold:]
+    if len(close) < threshold:
         return False
-    for index, row in data.iterrows():
-        if row['收盘'] > max_price:
-            max_price = float(row['收盘'])
 
-    last_close = data.iloc[-1]['收盘']
+    max_price = max(0.0, float(close[kernels.first_argmax(close)]))
+    return bool(close[-1] >= max_price)
+
+
+def check_enter_each_day(code_name, data, threshold=60):
+    """check_enter with `end_date` at every bar of `data` (sorted by 日期, one bar per day)."""
+    close = data['收盘'].values.astype(np.float64)
+    enough = np.arange(len(close)) >= threshold - 1
+    return enough & (close >= np.fmax(kernels.rolling_max(close, threshold), 0.0))
 
-    if last_close >= max_price:
-        return True
 
-    return False
\ No newline at end of file
+def check_universe(panel, as_of=None, threshold=60):
+    """check_enter for every stock of a MarketPanel at once (see universe.py)."""
+    close = panel.last_bars('close', threshold, as_of)
+    return (panel.bar_counts(as_of) >= threshold) & (close[:, -1] >= close.max(axis=1))
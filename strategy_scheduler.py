@@ -0,0 +1,366 @@
+# strategy_scheduler.py
+# -*- encoding: UTF-8 -*-
+"""
+Resource-class-aware scheduler for strategy checks.
+
+A strategy module declares what its check needs next to STRATEGY_NAME:
+
+    STRATEGY_NAME = "东方财富短线策略"
+    RESOURCE_CLASS = 'cpu'      # 'cpu' | 'io' | 'network'
+
+Each class gets its own thread pool: `cpu` checks (pure pandas/TA-Lib) run
+unthrottled on a pool sized to the machine, `io` checks (local files) on a larger
+pool, and only `network` checks go through the shared 'strategy' rate-limit bucket.
+Per-class queue depth, latency and throughput are available from stats().
+
+With settings `strategy_backend: process` the `cpu` class runs in a process pool
+instead, so GIL-bound pandas code uses every core: stocks are written in batches to
+a shared memory block (shared_bars.py) that the workers attach to by name.
+"""
+import importlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
+
+import funnel
+import profiler
+import rate_limiter
+import settings
+from shared_bars import SharedBarBlock
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_CLASSES = ('cpu', 'io', 'network')
+# Strategies that declare nothing are plain DataFrame computations
+DEFAULT_RESOURCE_CLASS = 'cpu'
+NETWORK_BUCKET = 'strategy'
+DEFAULT_WORKERS = {'cpu': None, 'io': 16, 'network': 4}
+# Process backend: stocks per shared memory block, and how workers are started. 'fork'
+# (where available) is the default: entry scripts such as main.py run their job at
+# import time, which 'spawn' workers would repeat.
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_START_METHOD = None
+
+
+def resource_class_of(strategy_func):
+    """RESOURCE_CLASS declared by the module defining `strategy_func`."""
+    module = sys.modules.get(getattr(strategy_func, '__module__', None) or '')
+    resource_class = getattr(module, 'RESOURCE_CLASS', DEFAULT_RESOURCE_CLASS)
+    if resource_class not in RESOURCE_CLASSES:
+        logger.warning(f"{module.__name__} 声明了未知的 RESOURCE_CLASS '{resource_class}'，按 network 处理。", extra={'stock': 'NONE', 'strategy': '调度'})
+        return 'network'
+    return resource_class
+
+
+class _ClassMetrics:
+    def __init__(self):
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.busy = 0.0
+        self.first_submit = None
+        self.last_complete = None
+
+
+class StrategyScheduler:
+    """
+    Runs `check(stock_info, strategy_func, end_date) -> (code_name, result)` for every
+    strategy on one stock, routing each strategy to the pool of its resource class.
+    """
+
+    def __init__(self, strategies, check, workers=None):
+        self.check = check
+        workers = {**DEFAULT_WORKERS, **(workers or {})}
+        self.groups = {}
+        for strategy_name, strategy_func in strategies.items():
+            self.groups.setdefault(resource_class_of(strategy_func), {})[strategy_name] = strategy_func
+        self.pools = {resource_class: self._make_pool(resource_class, workers[resource_class] or os.cpu_count() or 1)
+                      for resource_class in self.groups}
+        self._metrics = {resource_class: _ClassMetrics() for resource_class in self.groups}
+        self._lock = threading.Lock()
+        for resource_class, group in self.groups.items():
+            logger.info(f"[{resource_class}] 类策略 {len(group)} 个: {', '.join(group)}", extra={'stock': 'NONE', 'strategy': '调度'})
+
+    @classmethod
+    def from_config(cls, strategies, check):
+        """Scheduler of the backend chosen by settings 'strategy_backend' ('thread' or 'process')."""
+        config = settings.get_config()
+        workers = config.get('strategy_workers')
+        if config.get('strategy_backend', 'thread') == 'process':
+            options = config.get('strategy_process', {}) or {}
+            try:
+                return ProcessStrategyScheduler(strategies, check, workers=workers,
+                                                processes=options.get('processes'),
+                                                batch_size=options.get('batch_size', DEFAULT_BATCH_SIZE),
+                                                start_method=options.get('start_method', DEFAULT_START_METHOD))
+            except (ValueError, BrokenProcessPool) as e:
+                logger.warning(f"无法使用多进程执行策略: {e}，改用线程。", extra={'stock': 'NONE', 'strategy': '调度'})
+        return StrategyScheduler(strategies, check, workers=workers)
+
+    def _make_pool(self, resource_class, size):
+        return ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"strategy-{resource_class}")
+
+    @property
+    def capacity(self):
+        return sum(pool._max_workers for pool in self.pools.values())
+
+    def _run_group(self, resource_class, code, name, data, group, end_date):
+        metrics = self._metrics[resource_class]
+        with self._lock:
+            metrics.started += 1
+        started = time.perf_counter()
+        results = []
+        for strategy_name, strategy_func in group.items():
+            if resource_class == 'network':
+                rate_limiter.get_bucket(NETWORK_BUCKET).acquire()
+            call_started = time.perf_counter()
+            _, result = self.check((code, name, data), strategy_func, end_date)
+            seconds = time.perf_counter() - call_started
+            if resource_class == 'network':
+                rate_limiter.get_bucket(NETWORK_BUCKET).record(seconds)
+            profiler.record_check(strategy_name, code, seconds)
+            results.append((strategy_name, result))
+        with self._lock:
+            metrics.completed += 1
+            metrics.busy += time.perf_counter() - started
+            metrics.last_complete = time.monotonic()
+        return results
+
+    def submit(self, code, name, data, end_date):
+        """
+        Schedules all strategies for one stock. Returns one future per resource class,
+        each resolving to [(strategy_name, result)]. Strategies of the same class run
+        one after another on the same DataFrame; other classes get their own copy.
+        """
+        futures = []
+        for i, (resource_class, group) in enumerate(self.groups.items()):
+            metrics = self._metrics[resource_class]
+            with self._lock:
+                metrics.submitted += 1
+                if metrics.first_submit is None:
+                    metrics.first_submit = time.monotonic()
+            frame = data if i == 0 else data.copy()
+            futures.append(self._submit_group(resource_class, group, code, name, frame, end_date))
+        return futures
+
+    def _submit_group(self, resource_class, group, code, name, data, end_date):
+        return self.pools[resource_class].submit(self._run_group, resource_class, code, name, data, group, end_date)
+
+    def flush(self):
+        """Hands buffered work to the workers; call before waiting for the last futures."""
+
+    def stats(self):
+        """Per-class counters: queued (waiting for a worker), running, completed, avg seconds, stocks/s."""
+        with self._lock:
+            stats = {}
+            for resource_class, m in self._metrics.items():
+                elapsed = (m.last_complete - m.first_submit) if m.last_complete and m.first_submit else 0.0
+                stats[resource_class] = {
+                    'workers': self.pools[resource_class]._max_workers,
+                    'queued': m.submitted - m.started,
+                    'running': m.started - m.completed,
+                    'completed': m.completed,
+                    'avg_seconds': round(m.busy / m.completed, 4) if m.completed else 0.0,
+                    'throughput_per_s': round(m.completed / elapsed, 2) if elapsed > 0 else 0.0,
+                }
+            return stats
+
+    def log_stats(self):
+        for resource_class, s in self.stats().items():
+            logger.info(f"调度 [{resource_class}]: {s['workers']} 并发, 完成 {s['completed']} 只股票, 排队 {s['queued']}, "
+                        f"平均 {s['avg_seconds']}s, 吞吐 {s['throughput_per_s']} 只/秒", extra={'stock': 'NONE', 'strategy': '调度'})
+
+    def shutdown(self, wait=True):
+        for pool in self.pools.values():
+            pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def _function_ref(func):
+    """(module name, module file, qualified name) by which a worker process re-imports `func`."""
+    qualname = getattr(func, '__qualname__', '')
+    if '<' in qualname:
+        raise ValueError(f"{qualname} 不是模块级函数")
+    module = sys.modules.get(func.__module__)
+    return func.__module__, getattr(module, '__file__', None), qualname
+
+
+def _resolve_function(ref):
+    module_name, module_file, qualname = ref
+    module = sys.modules.get(module_name)
+    if module is None and module_file:
+        # Strategy modules are imported from their directory, which is not on sys.path any more
+        spec = importlib.util.spec_from_file_location(module_name, module_file)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    elif module is None:
+        module = importlib.import_module(module_name)
+    func = module
+    for part in qualname.split('.'):
+        func = getattr(func, part)
+    return func
+
+
+# Worker process state, set up once by _init_worker
+_worker_strategies = {}
+_worker_check = None
+_worker_block = None
+
+
+def _init_worker(strategy_refs, check_ref, config):
+    global _worker_check
+    settings.get_config().update(config)
+    # A forked worker starts with a copy of the parent's counts, which the parent already has
+    funnel.drain()
+    profiler.drain()
+    _worker_check = _resolve_function(check_ref)
+    for strategy_name, ref in strategy_refs.items():
+        _worker_strategies[strategy_name] = _resolve_function(ref)
+
+
+def _run_chunk(block_name, offsets, items):
+    """
+    Runs all strategies on stocks `items` [(i, code, name, end_date)] of a block; returns
+    [(i, results, seconds)] and the funnel counts and profile recorded meanwhile.
+    """
+    global _worker_block
+    if _worker_block is None or _worker_block.name != block_name:
+        if _worker_block is not None:
+            _worker_block.close()
+        _worker_block = SharedBarBlock.attach(block_name, offsets)
+    out = []
+    for i, code, name, end_date in items:
+        started = time.perf_counter()
+        data = _worker_block.frame(i)
+        results = []
+        for strategy_name, func in _worker_strategies.items():
+            call_started = time.perf_counter()
+            results.append((strategy_name, _worker_check((code, name, data), func, end_date)[1]))
+            profiler.record_check(strategy_name, code, time.perf_counter() - call_started)
+        out.append((i, results, time.perf_counter() - started))
+    return out, (funnel.drain(), profiler.drain())
+
+
+class ProcessStrategyScheduler(StrategyScheduler):
+    """
+    StrategyScheduler whose 'cpu' class runs in worker processes. Submitted stocks are
+    buffered and written `batch_size` at a time into one SharedBarBlock; each worker
+    gets a slice of the batch and attaches to the block instead of unpickling frames.
+    `io`/`network` strategies stay on their thread pools. Strategies and `check` must
+    be module-level functions (workers may import them again); ValueError otherwise,
+    BrokenProcessPool if the workers cannot start.
+    """
+
+    def __init__(self, strategies, check, workers=None, processes=None, batch_size=DEFAULT_BATCH_SIZE,
+                 start_method=DEFAULT_START_METHOD):
+        self.processes = processes or os.cpu_count() or 1
+        self.batch_size = max(1, batch_size)
+        self.start_method = start_method
+        self._check_ref = _function_ref(check)
+        self._strategy_refs = {strategy_name: _function_ref(func) for strategy_name, func in strategies.items()
+                               if resource_class_of(func) == 'cpu'}
+        self._buffer = []  # (code, name, data, end_date, future)
+        self._blocks = {}  # block name -> [block, chunks not finished yet]
+        super().__init__(strategies, check, workers)
+        if 'cpu' in self.pools:
+            # Start every worker now, before the fetch threads exist, so no lock is forked while held
+            try:
+                for future in [self.pools['cpu'].submit(os.getpid) for _ in range(self.processes)]:
+                    future.result()
+            except BrokenProcessPool:
+                self.shutdown(wait=False)
+                raise
+
+    def _make_pool(self, resource_class, size):
+        if resource_class != 'cpu':
+            return super()._make_pool(resource_class, size)
+        # Workers share the parent's resource tracker, so segments they attach to are not
+        # reported (and unlinked again) as leaks when a worker exits
+        resource_tracker.ensure_running()
+        start_method = self.start_method
+        if start_method is None:
+            start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context(start_method),
+                                   initializer=_init_worker,
+                                   initargs=(self._strategy_refs, self._check_ref, dict(settings.get_config())))
+
+    @property
+    def capacity(self):
+        # A batch has to fill up before any of its stocks runs
+        return sum(pool._max_workers for resource_class, pool in self.pools.items() if resource_class != 'cpu') + \
+            (self.batch_size if 'cpu' in self.pools else 0)
+
+    def _submit_group(self, resource_class, group, code, name, data, end_date):
+        if resource_class != 'cpu':
+            return super()._submit_group(resource_class, group, code, name, data, end_date)
+        future = Future()
+        with self._lock:
+            self._buffer.append((code, name, data, end_date, future))
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+        return future
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            if batch:
+                self._metrics['cpu'].started += len(batch)
+        if not batch:
+            return
+        block = SharedBarBlock.create([data for _, _, data, _, _ in batch])
+        futures = [future for *_, future in batch]
+        for future in futures:
+            future.set_running_or_notify_cancel()
+        items = [(i, code, name, end_date) for i, (code, name, _, end_date, _) in enumerate(batch)]
+        chunk_size = -(-len(items) // self.processes)
+        chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+        with self._lock:
+            self._blocks[block.name] = [block, len(chunks)]
+        for chunk in chunks:
+            chunk_future = self.pools['cpu'].submit(_run_chunk, block.name, block.offsets, chunk)
+            chunk_future.add_done_callback(lambda f, chunk=chunk, name=block.name: self._chunk_done(f, chunk, futures, name))
+
+    def _chunk_done(self, chunk_future, chunk, futures, block_name):
+        metrics = self._metrics['cpu']
+        error = chunk_future.exception()
+        done = []
+        if not error:
+            done, (funnel_counts, profile) = chunk_future.result()
+            funnel.merge(funnel_counts)
+            profiler.merge(profile)
+        with self._lock:
+            metrics.completed += len(chunk)
+            metrics.busy += sum(seconds for _, _, seconds in done)
+            metrics.last_complete = time.monotonic()
+            entry = self._blocks[block_name]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._blocks[block_name]
+                entry[0].close()
+        if error:
+            for i, *_ in chunk:
+                futures[i].set_exception(error)
+        for i, results, _ in done:
+            futures[i].set_result(results)
+
+    def shutdown(self, wait=True):
+        self.flush()
+        super().shutdown(wait=wait)
+        with self._lock:
+            blocks, self._blocks = self._blocks, {}
+        for block, _ in blocks.values():
+            block.close()
@@ -0,0 +1,51 @@
+# -*- encoding: UTF-8 -*-
+import numpy as np
+import pandas as pd
+
+import benchmark
+import settings
+from history_store import CODE_COLUMN, HISTORY_COLUMNS, HistoryStore
+
+
+def test_synthetic_market_is_deterministic_with_limit_ups_and_suspensions():
+    bars = benchmark.synthetic_market(20, 250, limit_up_rate=0.05, suspension_rate=0.01, seed=3, end='2025-06-30')
+    pd.testing.assert_frame_equal(bars, benchmark.synthetic_market(20, 250, 0.05, 0.01, seed=3, end='2025-06-30'))
+    assert list(bars.columns) == HISTORY_COLUMNS
+
+    per_stock = bars.groupby(CODE_COLUMN)
+    assert per_stock.ngroups == 20
+    assert (per_stock['日期'].max() == pd.Timestamp('2025-06-30')).all()
+    # Suspended sessions are missing rows
+    assert per_stock.size().min() < 250 and len(bars) > 20 * 200
+    change = per_stock['收盘'].pct_change()
+    assert 0.02 < (change > 0.099).mean() < 0.08
+
+
+def test_cache_serves_every_stock_and_comparison_flags_regressions(tmp_path):
+    bars = benchmark.synthetic_market(6, 120, seed=1)
+    benchmark.write_cache(str(tmp_path), bars)
+    assert len(HistoryStore(str(tmp_path)).load(adjust='none')) == len(bars)
+
+    result = benchmark.bench_cache_load(str(tmp_path), bars)
+    assert result['loaded'] == result['items'] == 6
+
+    previous = {'results': {'cache_load': {'seconds': 1.0}, 'process': {'seconds': 2.0}}}
+    current = {'results': {'cache_load': {'seconds': 1.1}, 'process': {'seconds': 3.0}, 'new': {'seconds': 1.0}}}
+    rows = benchmark.compare(previous, current, threshold=1.2)
+    assert [(name, slower) for name, *_, slower in rows] == [('cache_load', False), ('process', True)]
+    assert np.isclose(rows[1][3], 1.5)
+
+
+def test_strategies_run_with_their_default_config_and_errors_are_counted():
+    # The default settings hold partial sections for some strategies
+    settings.init()
+    frames = benchmark.strategy_frames(benchmark.synthetic_market(4, 120, limit_up_rate=0.1, seed=2))
+    with benchmark.overridden_settings(strategies=benchmark.strategy_defaults()):
+        results = benchmark.bench_strategies(frames, benchmark.strategy_checks())
+    assert results and all(result['errors'] == 0 for result in results.values())
+
+    def broken(code_name, data):
+        raise KeyError('missing')
+
+    result = benchmark.bench_strategies(frames, {'broken.check': broken})['strategy.broken.check']
+    assert result['errors'] == result['items'] == 4 and result['hits'] == 0
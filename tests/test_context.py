@@ -0,0 +1,44 @@
+# -*- encoding: UTF-8 -*-
+import numpy as np
+import pandas as pd
+import talib as tl
+
+import feature_store
+from strategy import enter, turtle_trade
+from strategy.context import AsOfContext, each_day_form
+
+
+def make_bars(n=120, seed=0):
+    rng = np.random.default_rng(seed)
+    close = np.round(10 * np.cumprod(1 + rng.choice([0.03, -0.02, 0.06, 0.0], size=n)), 2)
+    volume = rng.choice([1e6, 2e7], size=n, p=[.8, .2])
+    data = pd.DataFrame({'日期': pd.bdate_range('2025-01-01', periods=n).strftime('%Y-%m-%d'),
+                         '开盘': close / 1.01, '收盘': close, '成交量': volume})
+    data['p_change'] = tl.ROC(data['收盘'], 1)
+    return data
+
+
+def test_signals_match_the_check_on_every_day():
+    feature_store.reset()
+    data = make_bars()
+    context = AsOfContext(('000001', '平安银行'), data)
+    for check in (enter.check_volume, turtle_trade.check_enter):
+        expected = [bool(check(('000001', '平安银行'), data.copy(), date, threshold=20)) for date in data['日期']]
+        assert context.signal(check, threshold=20).tolist() == expected
+        assert any(expected)
+        date = data['日期'].iloc[expected.index(True)]
+        assert context.was(check, date, threshold=20)
+    assert not context.was(turtle_trade.check_enter, '2024-12-31', threshold=20)
+
+    # was() and a second context on the same bars reuse the memoized signal
+    AsOfContext(('000001', '平安银行'), data.copy()).signal(enter.check_volume, threshold=20)
+    stats = feature_store.get_store().stats()
+    assert stats['strategy.enter.check_volume'] == {'hit': 2, 'miss': 1}
+
+
+def test_unsorted_frames_ask_the_check_itself():
+    data = make_bars().sample(frac=1, random_state=0)
+    context = AsOfContext(('000001', '平安银行'), data)
+    expected = [bool(turtle_trade.check_enter(('000001', '平安银行'), data, date, threshold=20)) for date in data['日期']]
+    assert context.signal(turtle_trade.check_enter, threshold=20).tolist() == expected
+    assert each_day_form(enter.check_ma) is None
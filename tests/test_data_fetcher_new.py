@@ -0,0 +1,58 @@
+# -*- encoding: UTF-8 -*-
+import pandas as pd
+
+import data_fetcher_new
+import trading_calendar
+from history_store import HistoryStore
+
+
+def write_calendar(cache_dir, start, end):
+    sessions = pd.bdate_range(start, end)
+    pd.DataFrame({'trade_date': sessions}).to_parquet(cache_dir / trading_calendar.CALENDAR_FILE, index=False)
+
+
+def test_ingest_spot_snapshot_appends_raw_bars_and_flags_ex_rights(tmp_path):
+    write_calendar(tmp_path, '2025-01-01', f'{pd.Timestamp.today().year}-12-31')
+    store = HistoryStore(str(tmp_path))
+    dates = pd.bdate_range('2025-01-01', '2025-03-03')
+    bars = pd.DataFrame({'日期': dates, '开盘': 11.0, '收盘': 12.0, '最高': 13.0, '最低': 10.0,
+                         '成交量': 1e4, '成交额': 1e8, '换手率': 1.0})
+    store.append(bars, code='000001')
+    store.append(bars, code='600000')
+    store.append(bars, code='600036')
+    store.append(bars.iloc[:-3], code='000002')  # cache has a gap before the trade date
+    for code in ('000001', '600036'):
+        store.factors.replace(code, pd.DataFrame({'日期': [pd.Timestamp('2020-01-01')], 'hfq_factor': [2.0]}))
+
+    spot = pd.DataFrame({
+        '代码': ['000001', '600000', '000002', '600036'],
+        '开盘': [12.1, 11.0, 5.0, 11.5], '最高': [12.5, 12.0, 5.0, 11.9], '最低': [11.9, 11.0, 5.0, 11.4],
+        '最新价': [12.2, 11.5, 5.0, 11.8], '昨收': [12.0, 12.0, 5.0, 11.6],
+        '成交量': [5e3, 0, 1e3, 2e3], '成交额': [6e7, 0, 5e6, 2e7], '换手率': [0.8, 0, 0.1, 0.2],
+    })
+
+    updated = data_fetcher_new.ingest_spot_snapshot(spot, str(tmp_path), trade_date='2025-03-04')
+
+    assert updated == {'000001', '600036'}  # 600000 is suspended, 000002 needs a backfill
+    last = store.load(codes=['000001'], adjust='none').iloc[-1]
+    assert last['日期'] == pd.Timestamp('2025-03-04')
+    assert last['收盘'] == 12.2
+    assert last['成交量'] == 5e3
+    # 昨收 11.6 != cached close 12.0: ex-dividend day, factors must be refetched
+    assert store.factors.codes_to_refresh(['000001', '600036']) == {'600036'}
+
+    # Only a snapshot taken after the close of the session it shows is a daily bar
+    for fetched_at in (pd.Timestamp('2025-03-05 14:58'), pd.Timestamp('2025-03-04 16:00')):
+        assert data_fetcher_new.ingest_spot_snapshot(spot, str(tmp_path), trade_date='2025-03-05',
+                                                     fetched_at=fetched_at.to_pydatetime()) == set()
+    assert store.load(codes=['000001'], adjust='none').iloc[-1]['日期'] == pd.Timestamp('2025-03-04')
+    assert data_fetcher_new.ingest_spot_snapshot(spot, str(tmp_path), fetched_at=pd.Timestamp('2025-03-05 15:01').to_pydatetime()) == {'000001', '600036'}
+
+
+def test_has_corporate_action():
+    cached = pd.DataFrame({'收盘': [10.0, 10.5]})
+    plain = pd.DataFrame({'收盘': [10.8, 11.0], '昨收': [10.5, 10.8]})
+    ex_dividend = pd.DataFrame({'收盘': [10.8, 10.2], '昨收': [10.5, 10.3]})
+
+    assert not data_fetcher_new.has_corporate_action(cached, plain)
+    assert data_fetcher_new.has_corporate_action(cached, ex_dividend)
@@ -0,0 +1,51 @@
+# -*- encoding: UTF-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+import talib as tl
+
+from feature_store import FeatureStore
+
+
+def make_bars(n=60, start=10.0):
+    close = start + np.arange(n, dtype=float)
+    return pd.DataFrame({'日期': pd.bdate_range('2025-01-01', periods=n), '收盘': close,
+                         '最高': close + 1, '最低': close - 1, '成交量': np.full(n, 100.0)})
+
+
+def test_indicators_are_shared_per_stock_bars_and_params():
+    store = FeatureStore()
+    data = make_bars()
+
+    ma = store.get(('000001', '平安银行'), data, 'MA', timeperiod=5)
+    np.testing.assert_allclose(ma, tl.MA(data['收盘'].values, 5), equal_nan=True)
+    assert store.get('000001', data.copy(), 'MA', timeperiod=5) is ma
+    with pytest.raises(ValueError):
+        ma[-1] = 0.0  # shared results are read-only
+
+    store.get('000001', data, 'MA', timeperiod=10)             # other params
+    store.get('600000', data, 'MA', timeperiod=5)              # other stock
+    store.get('000001', make_bars(61), 'MA', timeperiod=5)     # a new bar
+    store.get('000001', make_bars(start=20.0), 'MA', timeperiod=5)  # same days, other prices
+    dif, dea, hist = store.get('000001', data, 'MACD', fastperiod=12, slowperiod=26, signalperiod=9)
+    assert len(dif) == len(data)
+
+    stats = store.stats()
+    assert stats['MA'] == {'hit': 1, 'miss': 5}
+    assert stats['total']['entries'] == 6
+
+
+def test_least_recently_used_entries_are_evicted_over_budget(tmp_path):
+    data = make_bars()
+    store = FeatureStore(max_bytes=2 * len(data) * 8, path=str(tmp_path / 'features.pkl'))
+    for code in ('000001', '000002', '000001', '000003'):
+        store.get(code, data, 'MA', timeperiod=5)
+
+    assert store.stats()['total']['evictions'] == 1
+    assert store.nbytes <= store.max_bytes
+    store.save()
+
+    reloaded = FeatureStore(path=str(tmp_path / 'features.pkl'))
+    reloaded.get('000001', data, 'MA', timeperiod=5)
+    reloaded.get('000002', data, 'MA', timeperiod=5)
+    assert reloaded.stats()['MA'] == {'hit': 1, 'miss': 1}
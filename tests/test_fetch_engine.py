@@ -0,0 +1,96 @@
+# -*- encoding: UTF-8 -*-
+import time
+
+import pandas as pd
+
+import fetch_engine
+import rate_limiter
+from fetch_engine import DataSource, LocalFileSource
+
+
+def make_bars(periods=5):
+    return pd.DataFrame({'日期': pd.bdate_range('2025-01-01', periods=periods), '收盘': 10.0, '成交量': 100.0})
+
+
+def test_local_file_source_returns_code_name_contract(tmp_path):
+    make_bars().to_parquet(tmp_path / '000001.parquet', index=False)
+    make_bars(3).to_csv(tmp_path / '600000.csv', index=False)
+    seen = []
+
+    data = fetch_engine.run([('000001', '平安银行'), ('600000', '浦发银行'), ('000002', '万科A')],
+                            LocalFileSource(str(tmp_path), latency=0.01),
+                            on_result=lambda code_name, df: seen.append(code_name), progress=False)
+
+    assert set(data) == {('000001', '平安银行'), ('600000', '浦发银行')}
+    assert len(data[('600000', '浦发银行')]) == 3
+    assert sorted(seen) == sorted(data)
+
+
+def test_concurrency_is_bounded_and_slow_requests_time_out():
+    class SlowSource(DataSource):
+        in_flight = 0
+        peak = 0
+
+        def fetch(self, code, name):
+            SlowSource.in_flight += 1
+            SlowSource.peak = max(SlowSource.peak, SlowSource.in_flight)
+            time.sleep(0.5 if code == 'slow' else 0.05)
+            SlowSource.in_flight -= 1
+            return make_bars()
+
+    stocks = [(str(i), str(i)) for i in range(6)] + [('slow', 'slow')]
+    data = fetch_engine.run(stocks, SlowSource(), concurrency=2, timeout=0.3, progress=False)
+
+    assert ('slow', 'slow') not in data
+    assert len(data) == 6
+    assert SlowSource.peak <= 2
+
+
+def test_timed_out_call_keeps_its_slot_so_later_requests_do_not_time_out():
+    in_flight, peak = [0], [0]
+
+    def fetch(code, name):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.4 if code == 'slow' else 0.02)
+        in_flight[0] -= 1
+        return make_bars()
+
+    stocks = [('slow', 'slow')] + [(str(i), str(i)) for i in range(3)]
+    data = fetch_engine.run(stocks, fetch_engine.FunctionSource(fetch), concurrency=1, timeout=0.2, progress=False)
+
+    assert sorted(data) == [(str(i), str(i)) for i in range(3)]
+    assert peak[0] == 1
+
+
+def test_rate_limiter_wait_does_not_count_against_the_timeout(monkeypatch):
+    # One token every 100ms: the last of 5 requests waits ~0.4s for the limiter
+    bucket = rate_limiter.AdaptiveTokenBucket('fetch-test', rate=600, min_rate=600, max_rate=600, burst=1)
+    monkeypatch.setitem(rate_limiter._buckets, 'fetch-test', bucket)
+    source = fetch_engine.FunctionSource(lambda code, name: rate_limiter.call('fetch-test', make_bars))
+    stocks = [(str(i), str(i)) for i in range(5)]
+
+    data = fetch_engine.run(stocks, source, concurrency=5, timeout=0.15, progress=False)
+
+    assert len(data) == 5
+    assert bucket.stats()['total_wait_s'] > 0.3
+
+
+def test_stream_yields_before_fetch_finishes_and_can_stop_early(tmp_path):
+    for i in range(8):
+        make_bars().to_parquet(tmp_path / f'{i:06d}.parquet', index=False)
+    stocks = [(f'{i:06d}', str(i)) for i in range(8)]
+    source = LocalFileSource(str(tmp_path), latency=0.05)
+
+    started = time.perf_counter()
+    stream = fetch_engine.stream(stocks, source, concurrency=1, maxsize=2, progress=False)
+    first_code_name, first_df = next(stream)
+    first_after = time.perf_counter() - started
+    rest = list(stream)
+
+    assert first_after < 0.3  # 8 sequential requests take >= 0.4s
+    assert len(rest) == 7 and not first_df.empty
+
+    partial = fetch_engine.stream(stocks, source, concurrency=1, maxsize=1, progress=False)
+    next(partial)
+    partial.close()
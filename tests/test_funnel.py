@@ -0,0 +1,43 @@
+# -*- encoding: UTF-8 -*-
+import logging
+
+import pandas as pd
+
+import funnel
+from funnel import Funnel
+from strategy import new_limit_up
+
+
+def test_counts_samples_and_worker_merge():
+    parent, worker = Funnel(samples=2), Funnel(samples=2)
+    for code, turnover in (('000001', 1.5), ('000002', 40.0), ('000003', 2.0)):
+        parent.reject('涨停', '换手率', code, turnover)
+    parent.accept('涨停')
+    worker.reject('涨停', '未涨停', '000004', 3.2)
+    worker.accept('涨停')
+
+    parent.merge(worker.drain())
+    assert worker.table() == {}
+    checked, passed, rows = parent.table()['涨停']
+    assert (checked, passed) == (6, 2)
+    assert rows == [('换手率', 3, [('000001', (1.5,)), ('000002', (40.0,))]), ('未涨停', 1, [('000004', (3.2,))])]
+
+
+def test_rejections_are_counted_without_debug_messages(monkeypatch, caplog):
+    funnel.reset()
+    monkeypatch.setattr(new_limit_up, 'get_strategy_config', lambda: new_limit_up.DEFAULT_STRATEGY_CONFIG)
+    data = pd.DataFrame({'日期': ['2025-01-02', '2025-01-03'], '涨跌幅': [0.5, 10.0], '换手率': [3.0, 40.0]})
+    with caplog.at_level(logging.INFO):
+        assert not new_limit_up.check_enter(('000001', '平安银行'), data.copy())
+        assert not new_limit_up.check_enter(('000002', '万科A'), data.iloc[:1].copy())
+    assert not [record for record in caplog.records if record.levelno < logging.INFO]
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger='funnel'):
+        funnel.log_stats()
+    assert [record.getMessage() for record in caplog.records] == [
+        "筛选漏斗 [涨停板次日溢价]: 检查 2 只, 通过 0 只",
+        "  换手率: 淘汰 1 只 (50.0%), 例: 000001(40)",
+        "  数据不足: 淘汰 1 只 (50.0%), 例: 000002(1)",
+    ]
+    funnel.reset()
@@ -0,0 +1,151 @@
+# -*- encoding: UTF-8 -*-
+import threading
+
+import pandas as pd
+
+from history_store import HistoryStore, migrate_per_stock_files
+
+
+def make_bars(code, start, periods):
+    dates = pd.bdate_range(start, periods=periods)
+    close = pd.Series(range(periods), dtype='float64') + 10
+    return pd.DataFrame({
+        '股票代码': code, '日期': dates, '开盘': close, '收盘': close + 0.5,
+        '最高': close + 1, '最低': close - 1, '成交量': 1000.0, '成交额': 1e7, '换手率': 1.5,
+    })
+
+
+def test_append_and_load_across_years(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(pd.concat([make_bars('000001', '2024-12-20', 20), make_bars('600000', '2024-12-20', 20)]))
+
+    assert store.years() == [2024, 2025]
+    loaded = store.load_stocks()
+    assert set(loaded) == {'000001', '600000'}
+    assert len(loaded['000001']) == 20
+    assert loaded['000001']['日期'].is_monotonic_increasing
+
+
+def test_load_last_n_and_last_dates(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(make_bars('000001', '2025-01-01', 30))
+    store.append(make_bars('000001', '2025-02-12', 1))
+
+    last = store.load_last_n(5)
+    assert len(last) == 5
+    assert last['日期'].iloc[-1] == pd.Timestamp('2025-02-12')
+    assert store.last_dates()['000001'] == pd.Timestamp('2025-02-12')
+
+
+def test_duplicate_bars_prefer_latest_write(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    bars = make_bars('000001', '2025-01-01', 3)
+    store.append(bars)
+    rewritten = bars.tail(1).copy()
+    rewritten['收盘'] = 99.0
+    store.append(rewritten)
+
+    loaded = store.load(codes=['000001'])
+    assert len(loaded) == 3
+    assert loaded['收盘'].iloc[-1] == 99.0
+
+
+def test_migrate_per_stock_files(tmp_path):
+    make_bars('000002', '2025-01-01', 10).drop(columns=['股票代码']).to_parquet(tmp_path / '000002.parquet', index=False)
+    store = HistoryStore(str(tmp_path))
+    store.factors.replace('000002', pd.DataFrame({'日期': [pd.Timestamp('2020-01-01')], 'hfq_factor': [2.0]}))
+
+    assert migrate_per_stock_files(str(tmp_path), remove=True) == 1
+    assert not (tmp_path / '000002.parquet').exists()
+    migrated = store.load(codes=['000002'], adjust='none')
+    assert len(migrated) == 10
+    assert migrated['收盘'].iloc[0] == 5.25  # legacy hfq 10.5 converted back to raw
+
+
+def test_manifest_tracks_appends_and_answers_staleness(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(make_bars('000001', '2025-01-01', 10))
+    store.append(make_bars('600000', '2025-01-01', 5))
+    store.append(make_bars('000001', '2025-01-15', 1))
+
+    entries = store.manifest.entries()
+    assert entries.at['000001', 'row_count'] == 11
+    assert entries.at['000001', 'last_date'] == pd.Timestamp('2025-01-15')
+    assert store.manifest.stale_codes(['000001', '600000', '000002'], '2025-01-15') == {'600000', '000002'}
+    assert store.manifest.stale_codes(['000001'], '2025-01-15', adjust='qfq') == {'000001'}
+    assert store.manifest.verify(store.load()) == []
+
+
+def test_manifest_counts_rewritten_bars_once(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    bars = make_bars('600000', '2025-01-01', 2)
+    store.append(bars)
+    store.append(bars.tail(1))
+    revised = bars.tail(1).assign(收盘=99.0)
+    store.append(pd.concat([revised, make_bars('600000', '2025-01-03', 1)]))
+
+    entry = store.manifest.entries().loc['600000']
+    assert entry['row_count'] == 3 and entry['last_date'] == pd.Timestamp('2025-01-03')
+    assert store.manifest.verify(store.load()) == []
+
+
+def test_manifest_is_rebuilt_for_existing_store(tmp_path):
+    HistoryStore(str(tmp_path)).append(make_bars('000001', '2025-01-01', 10))
+    (tmp_path / 'manifest.sqlite').unlink()
+    for suffix in ('-wal', '-shm'):
+        (tmp_path / f'manifest.sqlite{suffix}').unlink(missing_ok=True)
+
+    store = HistoryStore(str(tmp_path))
+    assert store.last_dates()['000001'] == pd.Timestamp('2025-01-14')
+
+
+def test_raw_bars_are_adjusted_at_load_time(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(make_bars('000001', '2025-01-01', 4))  # raw closes 10.5, 11.5, 12.5, 13.5
+    store.factors.replace('000001', pd.DataFrame({'日期': pd.to_datetime(['2024-06-03', '2025-01-03']),
+                                                  'hfq_factor': [2.0, 4.0]}))
+
+    raw = store.load(adjust='none')['收盘'].tolist()
+    hfq = store.load(adjust='hfq')['收盘'].tolist()
+    qfq = store.load(adjust='qfq')['收盘'].tolist()
+
+    assert raw == [10.5, 11.5, 12.5, 13.5]
+    assert hfq == [21.0, 23.0, 50.0, 54.0]
+    assert qfq == [5.25, 5.75, 12.5, 13.5]
+    assert store.load(adjust='hfq')['成交量'].tolist() == [1000.0] * 4
+
+
+def test_compaction_folds_deltas_into_base(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(make_bars('000001', '2025-01-01', 10))
+    store.append(make_bars('600000', '2025-01-01', 10))
+    rewritten = make_bars('000001', '2025-01-14', 1)
+    rewritten['收盘'] = 99.0
+    store.append(rewritten)
+    (tmp_path / 'bars' / 'year=2025' / 'part-interrupted.parquet.tmp').write_bytes(b'partial')
+    before = store.load()
+
+    assert store.compact(force=True) == {2025: 3}
+    bases, deltas = store.segments(2025)
+    assert len(bases) == 1 and deltas == []
+    assert not list((tmp_path / 'bars' / 'year=2025').glob('*.tmp'))
+    pd.testing.assert_frame_equal(store.load(), before)
+
+    store.append(make_bars('000001', '2025-01-15', 1))
+    assert len(store.segments(2025)[1]) == 1
+    assert not store.needs_compaction(2025)
+    assert store.load(codes=['000001'])['日期'].iloc[-1] == pd.Timestamp('2025-01-15')
+
+
+def test_load_while_another_store_compacts(tmp_path):
+    writer, reader = HistoryStore(str(tmp_path)), HistoryStore(str(tmp_path))
+    for round_ in range(8):
+        for i in range(20):
+            writer.append(make_bars(f"{i:06d}", '2025-01-01', 5 + round_))
+        expected = len(reader.load(adjust='none'))
+        compaction = threading.Thread(target=writer.compact, kwargs={'force': True})
+        compaction.start()
+        while compaction.is_alive():
+            assert len(reader.load(adjust='none')) == expected
+        compaction.join()
+        assert writer.segments(2025)[1] == []
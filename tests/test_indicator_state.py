@@ -0,0 +1,61 @@
+# -*- encoding: UTF-8 -*-
+import numpy as np
+import pandas as pd
+
+from feature_store import INDICATORS
+from indicator_state import IndicatorStateStore
+
+SPECS = [
+    ('MA', {'timeperiod': 30}),
+    ('SMA', {'column': '成交量', 'timeperiod': 5}),
+    ('MACD', {'fastperiod': 12, 'slowperiod': 26, 'signalperiod': 9}),
+    ('STOCH', {'fastk_period': 9, 'slowk_period': 3, 'slowd_period': 3}),
+    ('RSI', {'timeperiod': 6}),
+    ('BBANDS', {'timeperiod': 20, 'nbdevup': 2, 'nbdevdn': 2}),
+]
+
+
+def make_bars(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    close = np.abs(10 + np.cumsum(rng.normal(0, 0.3, n))) + 1
+    return pd.DataFrame({'日期': pd.bdate_range('2024-01-01', periods=n), '收盘': close,
+                         '最高': close * 1.02, '最低': close * 0.98, '成交量': rng.integers(1e5, 1e7, n).astype(float)})
+
+
+def assert_matches_talib(results, data):
+    for (name, params), result in zip(SPECS, results):
+        expected = INDICATORS[name](data, **params)
+        for got, want in zip(*((r,) if not isinstance(r, tuple) else r for r in (result, expected))):
+            np.testing.assert_allclose(got, np.asarray(want)[-len(got):], rtol=1e-10, atol=1e-10, err_msg=name)
+
+
+def test_daily_bars_step_the_state_and_match_talib():
+    data = make_bars()
+    store = IndicatorStateStore(keep=10)
+    for n in range(3, len(data) + 1):
+        part = data.iloc[:n]
+        results = store.tails('000001', part, SPECS)
+        assert all(len(r[0] if isinstance(r, tuple) else r) == min(10, n) for r in results)
+        assert_matches_talib(results, part)
+    stats = store.stats()
+    # Only the bars before each indicator's warm-up is complete are recomputed
+    assert stats['recompute'] < 40 * len(SPECS) and stats['step'] > 150 * len(SPECS)
+
+
+def test_rewritten_history_is_recomputed(tmp_path):
+    data = make_bars()
+    store = IndicatorStateStore(keep=5, path=str(tmp_path / "state.pkl"))
+    store.tails('000001', data.iloc[:150], SPECS)
+    store.save()
+
+    store = IndicatorStateStore(keep=5, path=str(tmp_path / "state.pkl"))
+    store.tails('000001', data.iloc[:151], SPECS)
+    assert store.stats() == {'step': len(SPECS), 'recompute': 0, 'entries': len(SPECS)}
+
+    # A new adjustment factor rescales the past closes; a missing bar shifts the rows
+    adjusted = data.iloc[:152].copy()
+    adjusted[['收盘', '最高', '最低']] *= 0.9
+    assert_matches_talib(store.tails('000001', adjusted, SPECS), adjusted)
+    gapped = data.drop(index=100).iloc[:152].reset_index(drop=True)
+    assert_matches_talib(store.tails('000001', gapped, SPECS), gapped)
+    assert store.stats()['recompute'] == 2 * len(SPECS)
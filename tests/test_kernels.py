@@ -0,0 +1,67 @@
+# -*- encoding: UTF-8 -*-
+import numpy as np
+import pandas as pd
+import talib as tl
+
+from strategy import kernels, parking_apron, turtle_trade
+
+
+def random_values(rng, n):
+    values = np.round(rng.normal(10, 1, n), 1)  # ties are common
+    values[rng.random(n) < 0.1] = np.nan
+    return values
+
+
+def test_scans_match_row_loops():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        values = random_values(rng, int(rng.integers(1, 30)))
+        highest = lowest = len(values) - 1
+        for i, v in enumerate(values):
+            if v > values[highest]:
+                highest = i
+            if v < values[lowest]:
+                lowest = i
+        assert kernels.scan_argmax(values) == highest
+        assert kernels.scan_argmin(values) == lowest
+
+        window = int(rng.integers(1, 6))
+        expected = [np.nan if i < window - 1 or np.isnan(values[i - window + 1:i + 1]).all()
+                    else np.nanmax(values[i - window + 1:i + 1]) for i in range(len(values))]
+        np.testing.assert_array_equal(kernels.rolling_max(values, window), expected)
+
+
+def test_cross_up_and_runs():
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        n, k = int(rng.integers(1, 20)), int(rng.integers(0, 8))
+        fast, slow = random_values(rng, n), random_values(rng, n)
+        expected = any(fast[i] <= slow[i] and fast[i + 1] > slow[i + 1] for i in range(max(0, n - k - 1), n - 1))
+        assert kernels.crossed_up_within(fast, slow, k) == expected
+
+    condition = np.array([True, True, False, True, True, True, False])
+    np.testing.assert_array_equal(kernels.run_length(condition), [1, 2, 0, 1, 2, 3, 0])
+    np.testing.assert_array_equal(kernels.segment_all(condition, [0, 3, 1, 6], [2, 6, 4, 6]), [True, True, False, True])
+    np.testing.assert_array_equal(kernels.segment_any(condition, [2, 6], [3, 7]), [False, False])
+
+
+def test_as_of_matches_date_mask():
+    data = pd.DataFrame({'日期': pd.bdate_range('2025-01-01', periods=10).strftime('%Y-%m-%d'), '收盘': np.arange(10.0)})
+    for end_date in ('2024-12-31', '2025-01-03', '2025-01-04', '2025-02-01'):
+        pd.testing.assert_frame_equal(kernels.as_of(data, end_date), data.loc[data['日期'] <= end_date])
+    shuffled = data.sample(frac=1, random_state=0)
+    pd.testing.assert_frame_equal(kernels.as_of(shuffled, '2025-01-06'), shuffled.loc[shuffled['日期'] <= '2025-01-06'])
+    assert kernels.as_of(data, None) is data
+
+
+def test_parking_apron_finds_consolidation_after_limit_up():
+    close = np.concatenate((np.linspace(8.0, 9.0, 16), [9.9, 10.2, 10.3, 10.25], np.full(6, 10.3)))
+    open_ = close / 1.01
+    open_[16] = 9.0
+    data = pd.DataFrame({'日期': pd.bdate_range('2025-01-01', periods=len(close)), '开盘': open_, '收盘': close})
+    data['p_change'] = tl.ROC(data['收盘'], 1)
+
+    assert turtle_trade.check_enter_each_day(('000001', '平安银行'), data, 15)[16]
+    assert parking_apron.check(('000001', '平安银行'), data, end_date=data['日期'].iloc[19])
+    # The three days after the limit up are not all in the window yet
+    assert not parking_apron.check(('000001', '平安银行'), data, end_date=data['日期'].iloc[18])
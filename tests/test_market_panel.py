@@ -0,0 +1,63 @@
+# -*- encoding: UTF-8 -*-
+import numpy as np
+import pandas as pd
+
+from history_store import HistoryStore
+from market_panel import MarketPanel
+from test_history_store import make_bars
+
+
+def make_panel(tmp_path):
+    late_listing = make_bars('600000', '2025-01-08', 10)
+    suspended = make_bars('000001', '2025-01-01', 20)
+    suspended = suspended[suspended['日期'] != pd.Timestamp('2025-01-10')]
+    store = HistoryStore(str(tmp_path))
+    store.append(pd.concat([suspended, late_listing]))
+    return MarketPanel.from_store(str(tmp_path))
+
+
+def test_panel_aligns_stocks_and_dates(tmp_path):
+    panel = make_panel(tmp_path)
+
+    assert panel.shape == (2, 20)
+    close = panel.field('close')
+    assert close.dtype == np.float64
+    assert np.isnan(close[panel.row('000001'), panel.column('2025-01-10')])
+    assert np.isnan(close[panel.row('600000'), panel.column('2025-01-07')])
+    assert panel.cross_section('close', '2025-01-08').notna().all()
+
+
+def test_as_of_and_stock_view_are_views(tmp_path):
+    panel = make_panel(tmp_path)
+
+    past = panel.as_of('2025-01-09')
+    assert past.shape == (2, 7)
+    assert np.shares_memory(past.field('close'), panel.field('close'))
+
+    view = panel.stock_view('600000')
+    assert len(view) == 10
+    assert np.shares_memory(view.close, panel.field('close'))
+
+
+def test_stock_frame_matches_legacy_layout(tmp_path):
+    panel = make_panel(tmp_path)
+
+    df = panel.stock_frame('000001', end_date='2025-01-15')
+    assert df['日期'].iloc[-1] == pd.Timestamp('2025-01-15')
+    assert pd.Timestamp('2025-01-10') not in set(df['日期'])
+    assert {'股票代码', '日期', '收盘', '成交量'}.issubset(df.columns)
+    assert df['收盘'].dtype == np.float64
+
+
+def test_last_bars_skip_days_without_a_bar(tmp_path):
+    panel = make_panel(tmp_path)
+    suspended = panel.stock_frame('000001')
+
+    bars = panel.last_bars('close', 8, '2025-01-15')
+    expected = suspended[suspended['日期'] <= '2025-01-15']['收盘'].tail(8).to_numpy()
+    np.testing.assert_allclose(bars[panel.row('000001')], expected)
+    # 600000 only has 6 bars by then
+    assert np.isnan(bars[panel.row('600000'), :2]).all()
+    assert not np.isnan(bars[panel.row('600000'), 2:]).any()
+    counts = panel.bar_counts('2025-01-15')
+    assert (counts[panel.row('000001')], counts[panel.row('600000')]) == (10, 6)
@@ -0,0 +1,48 @@
+# -*- encoding: UTF-8 -*-
+import numpy as np
+import pandas as pd
+
+from history_store import HistoryStore
+from ohlcv import OHLCVFrame, memory_report, split_long_frame
+from test_history_store import make_bars
+
+
+def test_round_trip_keeps_legacy_columns():
+    bars = make_bars('000001', '2025-01-01', 50)
+    frame = OHLCVFrame.from_frame(bars)
+
+    assert frame.code == '000001'
+    assert frame.dates.dtype == np.int32
+    assert frame.close.dtype == np.float32
+    assert frame.volume.dtype == np.int32
+
+    back = frame.to_frame(with_code=True)
+    assert list(back.columns) == list(bars.columns)
+    assert (back['日期'] == bars['日期']).all()
+    assert np.allclose(back['收盘'], bars['收盘'])
+
+
+def test_as_of_and_tail_are_views():
+    frame = OHLCVFrame.from_frame(make_bars('000001', '2025-01-01', 50))
+
+    view = frame.as_of('2025-01-10')
+    assert len(view) == 8
+    assert np.shares_memory(view.close, frame.close)
+    assert len(frame.tail(5)) == 5
+    assert frame.tail(5).dates[-1] == frame.dates[-1]
+
+
+def test_split_long_frame_and_store(tmp_path):
+    bars = pd.concat([make_bars('000001', '2025-01-01', 20), make_bars('600000', '2025-01-01', 30)])
+    frames = split_long_frame(bars.reset_index(drop=True))
+    assert {code: len(f) for code, f in frames.items()} == {'000001': 20, '600000': 30}
+
+    store = HistoryStore(str(tmp_path))
+    store.append(bars)
+    compact = store.load_compact()
+    assert len(compact['600000']) == 30
+
+
+def test_memory_report_shrinks():
+    report = memory_report(make_bars('000001', '2025-01-01', 250))
+    assert report['compact_bytes'] < report['dataframe_bytes']
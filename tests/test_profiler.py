@@ -0,0 +1,48 @@
+# -*- encoding: UTF-8 -*-
+import json
+import time
+
+import profiler
+import settings
+
+
+def test_latency_percentiles_and_worker_merge():
+    parent, worker = profiler.Profiler('test'), profiler.Profiler('worker')
+    for i in range(100):
+        parent.record_check('涨停板次日溢价', f"{i:06d}", (i + 1) / 1000)
+    worker.record_check('涨停板次日溢价', '000100', 0.5)
+    worker.record('download', 0.2, code='000100')
+
+    parent.merge(worker.drain())
+    latencies = parent.latencies()['涨停板次日溢价']
+    assert latencies['count'] == 101 and latencies['max_ms'] == 500.0
+    assert 50 <= latencies['p50_ms'] <= 52 and 95 <= latencies['p95_ms'] <= 97
+    assert parent.spans('span') == {'download': {'count': 1, 'seconds': 0.2, 'max_seconds': 0.2}}
+    assert worker.latencies() == {}
+
+
+def test_run_writes_report_and_chrome_trace(tmp_path, monkeypatch):
+    monkeypatch.setitem(settings.get_config(), 'profile', {'dir': str(tmp_path), 'keep': 5, 'cprofile': 'evaluate'})
+    profiler.start('test')
+    with profiler.stage('spot'):
+        with profiler.span('cache_read', stocks=2):
+            time.sleep(0.01)
+    with profiler.stage('evaluate'):
+        sum(i * i for i in range(10000))
+        profiler.record_check('东方财富短线策略', '000001', 0.002)
+    profiler.attach('funnel', {'东方财富短线策略': [1, 0, []]})
+    path = profiler.finish()
+
+    report = json.loads(open(path, encoding='utf-8').read())
+    assert set(report['stages']) == {'spot', 'evaluate'} and report['stages']['spot']['seconds'] >= 0.01
+    assert report['spans']['cache_read']['count'] == 1
+    assert report['strategies']['东方财富短线策略']['count'] == 1
+    assert report['profiled']['evaluate']['cprofile'] and report['funnel']
+    assert (tmp_path / (path.split('/')[-1][:-len('.json')] + '.prof')).exists()
+
+    trace = json.loads(open(path[:-len('.json')] + '.trace.json', encoding='utf-8').read())
+    events = {event['name']: event for event in trace['traceEvents']}
+    assert set(events) == {'spot', 'cache_read', 'evaluate', '东方财富短线策略'}
+    # The span lies within its stage
+    assert events['spot']['ts'] <= events['cache_read']['ts']
+    assert events['cache_read']['ts'] + events['cache_read']['dur'] <= events['spot']['ts'] + events['spot']['dur']
@@ -0,0 +1,57 @@
+# -*- encoding: UTF-8 -*-
+import threading
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import AdaptiveTokenBucket
+
+
+def test_threads_are_served_in_arrival_order():
+    bucket = AdaptiveTokenBucket('test', rate=1200, burst=1)  # one token every 50ms
+    bucket.acquire()  # drain the initial token
+    order = []
+
+    def worker(i):
+        bucket.acquire()
+        order.append(i)
+
+    threads = []
+    for i in range(4):
+        t = threading.Thread(target=worker, args=(i,))
+        t.start()
+        threads.append(t)
+        time.sleep(0.01)  # make the arrival order deterministic
+    for t in threads:
+        t.join()
+
+    assert order == [0, 1, 2, 3]
+    assert bucket.stats()['total_wait_s'] > 0
+
+
+def test_aimd_stays_within_bounds():
+    bucket = AdaptiveTokenBucket('test', rate=10, min_rate=4, max_rate=12, target_latency=1.0)
+    for _ in range(5):
+        bucket.record(0.1)
+    assert bucket.rate == 12
+
+    bucket.record(0.1, error=True)
+    assert bucket.rate == 6
+    bucket.record(5.0)  # too slow counts as congestion
+    assert bucket.rate == 4
+    bucket.record(0.1, error=True)
+    assert bucket.rate == 4
+    assert bucket.stats()['errors'] == 2
+
+
+def test_call_records_errors_and_reraises():
+    rate_limiter.reset()
+
+    def boom():
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError):
+        rate_limiter.call('unit-test', boom)
+    assert rate_limiter.stats()['unit-test']['errors'] == 1
+    rate_limiter.reset()
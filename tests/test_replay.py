@@ -0,0 +1,72 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+import json
+import os
+
+import pandas as pd
+
+import benchmark
+import data_fetcher_new
+import fetch_engine
+import replay
+import settings
+import snapshot_cache
+import trading_calendar
+import work_flow_new
+from history_store import CODE_COLUMN
+
+
+def _offline():
+    raise AssertionError("network access during a replay")
+
+
+def _market(cache_dir, n_stocks=16):
+    """Synthetic frames of a market with a limit-up hit, the spot and LHB tables of its last session and a cached calendar."""
+    end = trading_calendar.TradingCalendar(benchmark.weekday_sessions().values).last_completed_session()
+    bars = benchmark.synthetic_market(n_stocks, 300, limit_up_rate=0.2, seed=1, end=end)
+    benchmark.write_cache(cache_dir, bars)
+    frames = benchmark.strategy_frames(bars)
+    last = pd.DataFrame([frame.iloc[-1] for frame in frames.values()])
+    spot = pd.DataFrame({'代码': [code for code, _ in frames], '名称': [name for _, name in frames], '总市值': 2e10,
+                         '涨跌幅': last['涨跌幅'].values, '成交额': 3e8, '换手率': 5.0, '最新价': last['收盘'].values})
+    lhb = pd.DataFrame({'代码': spot['代码'], '买方机构次数': 2})
+    return frames, spot, lhb
+
+
+def test_recorded_run_replays_offline_with_the_same_result(tmp_path, monkeypatch):
+    cache_dir, snapshot_dir = str(tmp_path / 'cache'), str(tmp_path / 'snapshot')
+    frames, spot, lhb = _market(cache_dir)
+    source = fetch_engine.FunctionSource(lambda code, name: frames[(code, name)].copy())
+    config = settings.get_config()
+    monkeypatch.setitem(config, 'data_dir', cache_dir)
+    monkeypatch.setitem(config, 'daily_bar_source', 'hist')
+    monkeypatch.setitem(config, 'enabled_strategies', list(benchmark.named_strategies()))
+    monkeypatch.setitem(config, 'strategies', {})
+    monkeypatch.setitem(config, 'profile', {'enabled': True})
+    monkeypatch.setattr(snapshot_cache, 'spot_entry', lambda fetched_after=None: (datetime.datetime.now(), spot.copy()))
+    monkeypatch.setattr(snapshot_cache, 'lhb_statistic', lambda symbol: lhb.copy())
+    monkeypatch.setattr(data_fetcher_new, 'stream', lambda stocks, max_workers, timeout, maxsize, **kwargs:
+                        fetch_engine.stream(stocks, source, max_workers, timeout, maxsize, progress=False))
+
+    with replay.recording(snapshot_dir) as recorded:
+        title, selected = work_flow_new.prepare()
+    meta = json.load(open(os.path.join(snapshot_dir, replay.META_FILE), encoding='utf-8'))
+    assert '涨停板次日溢价' in title and len(selected) >= 1
+    assert len(meta['stocks']) == len(frames) and meta['tables'] == ['spot', 'lhb:近三月']
+    assert meta['time'] == recorded.started_at.isoformat()
+
+    monkeypatch.setattr(snapshot_cache, 'spot_entry', _offline)
+    monkeypatch.setattr(snapshot_cache, 'lhb_statistic', _offline)
+    monkeypatch.setattr(data_fetcher_new, 'stream', _offline)
+    monkeypatch.setattr(trading_calendar, '_download_sessions', _offline)
+    monkeypatch.setitem(config, 'data_dir', str(tmp_path / 'elsewhere'))
+    for latency in (0.0, 0.01):
+        with replay.playback(snapshot_dir, latency=latency, table_latency=latency):
+            assert replay.now() == recorded.started_at
+            replayed_title, replayed_selected = work_flow_new.prepare()
+        assert replayed_title == title
+        assert [(code, name) for code, name, _ in replayed_selected] == [(code, name) for code, name, _ in selected]
+        pd.testing.assert_frame_equal(replayed_selected[0][2], selected[0][2])
+    # Settings are restored and the replay's report went to the snapshot
+    assert config['data_dir'] == str(tmp_path / 'elsewhere') and replay.session() is None
+    assert [name for name in os.listdir(os.path.join(snapshot_dir, replay.RUNS_DIR)) if name.endswith('.trace.json')]
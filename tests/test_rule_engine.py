@@ -0,0 +1,68 @@
+# -*- encoding: UTF-8 -*-
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import rule_engine
+from rule_engine import Rule, RuleEngine
+from strategy import my_short_term_strategy
+
+
+def test_rejected_inputs_never_compute_later_values(tmp_path, monkeypatch):
+    monkeypatch.setattr(rule_engine, '_stats_path', lambda: str(tmp_path / "rule_stats.json"))
+    computed = []
+    engine = RuleEngine('test_lazy', [
+        Rule('positive', lambda ctx: ctx['x'] > 0),
+        Rule('square', lambda ctx: ctx['square'] < 100, needs=('square',)),
+    ], providers={'square': lambda ctx: computed.append(ctx['x']) or ctx['x'] ** 2})
+
+    assert engine.evaluate(x=-1) == (False, 'positive')
+    assert engine.evaluate(x=20) == (False, 'square')
+    assert engine.evaluate(x=3) == (True, None)
+    assert computed == [20, 3]
+    assert [row[:3] for row in engine.funnel()] == [('positive', 3, 2), ('square', 2, 1)]
+
+
+def test_slow_unselective_rules_move_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(rule_engine, '_stats_path', lambda: str(tmp_path / "rule_stats.json"))
+    engine = RuleEngine('test_order', [
+        Rule('slow', lambda ctx: time.sleep(0.001) or True),
+        Rule('rarely', lambda ctx: ctx['x'] % 10 != 0),
+        Rule('often', lambda ctx: ctx['x'] % 2 == 0),
+    ], reorder_every=20)
+    for x in range(40):
+        engine.evaluate(x=x)
+    assert engine.order == ['often', 'rarely', 'slow']
+
+    # A new run starts from the order the saved counters settled on
+    rule_engine.save()
+    saved = json.loads((tmp_path / "rule_stats.json").read_text(encoding='utf-8'))
+    assert saved['test_order'] == engine.history()
+    restarted = RuleEngine('test_order', engine.rules)
+    restarted.evaluate(x=1)
+    assert restarted.order[0] == 'often'
+
+
+def test_short_term_strategy_rules_match_indicator_frame(monkeypatch):
+    config = dict(my_short_term_strategy.DEFAULT_STRATEGY_CONFIG, close_above_ma20=False, macd_dif_above_dea_and_zero=False,
+                  boll_break_middle_band=False, rsi_cross_30=False, kdj_gold_cross=False, ma5_cross_ma10_period=60,
+                  macd_gold_cross_within_days=60, rsi_lower_limit=0, rsi_upper_limit=100, kdj_j_lower_limit=-1000,
+                  kdj_j_upper_limit=1000, volume_ratio_to_5day_avg_min=0, volume_ratio_to_5day_avg_max=100,
+                  min_daily_turnover_rate=0, min_avg_daily_turnover_amount=0)
+    monkeypatch.setattr(my_short_term_strategy, 'get_strategy_config', lambda: config)
+    rng = np.random.default_rng(0)
+    n = 120
+    close = 10 * np.cumprod(1 + rng.normal(0, 0.02, n))
+    data = pd.DataFrame({'日期': pd.bdate_range('2024-01-01', periods=n), '收盘': close, '开盘': close, '最高': close * 1.01,
+                         '最低': close * 0.99, '成交量': rng.uniform(1e5, 1e6, n), '换手率': rng.uniform(1, 10, n),
+                         '成交额': rng.uniform(1e8, 2e8, n), '涨跌幅': rng.normal(0, 2, n)})
+    frame = my_short_term_strategy.calculate_indicators(data.copy())
+    # The only remaining conditions are the two crossovers over the last 60 days
+    crossed = all(((frame[fast].shift() <= frame[slow].shift()) & (frame[fast] > frame[slow])).iloc[-60:].any()
+                  for fast, slow in (('MA5', 'MA10'), ('MACD_DIF', 'MACD_DEA')))
+    assert my_short_term_strategy.check_enter(('000001', '平安银行'), data.copy()) == crossed
+
+    data.loc[n - 1, '换手率'] = 50
+    assert not my_short_term_strategy.check_enter(('000001', '平安银行'), data.copy())
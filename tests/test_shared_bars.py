@@ -0,0 +1,27 @@
+# -*- encoding: UTF-8 -*-
+import pandas as pd
+
+from history_store import BAR_COLUMNS
+from shared_bars import SharedBarBlock
+
+
+def test_frames_round_trip_through_shared_memory():
+    first = pd.DataFrame({'日期': pd.bdate_range('2025-01-01', periods=3), '开盘': [1.0, 2.0, 3.0], '收盘': [1.5, 2.5, 3.5],
+                          '最高': 4.0, '最低': 0.5, '成交量': [100.0, 200.0, 300.0], '成交额': 1e6, '换手率': 1.2})
+    second = first.iloc[:1].drop(columns=['换手率'])
+    block = SharedBarBlock.create([first, pd.DataFrame(columns=BAR_COLUMNS), second])
+    try:
+        attached = SharedBarBlock.attach(block.name, block.offsets)
+        assert len(attached) == 3
+        pd.testing.assert_frame_equal(attached.frame(0), first[BAR_COLUMNS].astype({'日期': 'datetime64[ns]'}))
+        assert attached.frame(1).empty
+        assert attached.frame(2)['换手率'].isna().all()
+
+        # Frames are private copies; the shared block itself is read-only
+        frame = attached.frame(0)
+        frame['收盘'] = 0.0
+        assert attached.frame(0)['收盘'].tolist() == [1.5, 2.5, 3.5]
+        assert not attached.values.flags.writeable
+        attached.close()
+    finally:
+        block.close()
@@ -0,0 +1,86 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+
+import pandas as pd
+import pytest
+
+from snapshot_cache import SnapshotCache
+from test_data_fetcher_new import write_calendar
+
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return pd.DataFrame({'代码': ['000001'], '最新价': [float(self.calls)]})
+
+
+def failing_loader():
+    raise ConnectionError("upstream down")
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    write_calendar(tmp_path, '2025-01-01', f'{pd.Timestamp.today().year + 1}-12-31')
+    return str(tmp_path)
+
+
+def test_hits_memory_and_disk_within_ttl(cache_dir):
+    loader = Loader()
+    cache = SnapshotCache(cache_dir, datasets={'spot': {'ttl': 600, 'final_after_close': False}})
+
+    assert cache.get('spot', loader)['最新价'].iloc[0] == 1.0
+    first = cache.get('spot', loader)
+    first.loc[0, '最新价'] = -1.0  # callers get copies
+    assert cache.get('spot', loader)['最新价'].iloc[0] == 1.0
+    assert loader.calls == 1
+    assert cache.stats()['spot'] == {'hit': 2, 'stale': 0, 'miss': 1, 'refresh': 0, 'error': 0}
+
+    # Another process (fresh instance) is served from disk
+    other = SnapshotCache(cache_dir, datasets={'spot': {'ttl': 600, 'final_after_close': False}})
+    assert other.get('spot', loader)['最新价'].iloc[0] == 1.0
+    assert loader.calls == 1
+
+    later = datetime.datetime.now() + datetime.timedelta(seconds=601)
+    assert other.get('spot', loader, now=later)['最新价'].iloc[0] == 2.0
+
+
+def test_after_close_snapshot_is_valid_until_next_open(cache_dir):
+    cache = SnapshotCache(cache_dir, datasets={'spot': {'ttl': 300, 'final_after_close': True}})
+
+    # Friday 2025-03-07 15:30 -> valid until Monday 09:15
+    assert cache.expires_at('spot', datetime.datetime(2025, 3, 7, 15, 30)) == datetime.datetime(2025, 3, 10, 9, 15)
+    assert cache.expires_at('spot', datetime.datetime(2025, 3, 7, 10, 0)) == datetime.datetime(2025, 3, 7, 10, 5)
+
+
+def test_stale_entries_and_failures(cache_dir):
+    loader = Loader()
+    cache = SnapshotCache(cache_dir, datasets={'lhb': {'ttl': 0, 'final_after_close': False}})
+    cache.get('lhb:近三月', loader)
+
+    assert cache.get('lhb:近三月', failing_loader)['最新价'].iloc[0] == 1.0
+    assert cache.stats()['lhb:近三月']['error'] == 1
+
+    cache.stale_while_revalidate = True
+    assert cache.get('lhb:近三月', loader)['最新价'].iloc[0] == 1.0
+    assert cache.stats()['lhb:近三月']['stale'] == 1
+
+    with pytest.raises(ConnectionError):
+        SnapshotCache(cache_dir).get('spot', failing_loader)
+
+
+def test_fetched_after_never_serves_an_older_snapshot(cache_dir):
+    loader = Loader()
+    cache = SnapshotCache(cache_dir, datasets={'spot': {'ttl': 600, 'final_after_close': False}},
+                          stale_while_revalidate=True)
+    fetched_at, _ = cache.get_entry('spot', loader)
+    assert cache.get_entry('spot', loader, fetched_after=fetched_at)[0] == fetched_at
+
+    # Neither served stale while revalidating nor as a fallback when the fetch fails
+    later = datetime.timedelta(microseconds=1)
+    refetched_at, df = cache.get_entry('spot', loader, fetched_after=fetched_at + later)
+    assert refetched_at > fetched_at and df['最新价'].iloc[0] == 2.0
+    with pytest.raises(ConnectionError):
+        cache.get_entry('spot', failing_loader, fetched_after=refetched_at + later)
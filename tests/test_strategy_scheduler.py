@@ -0,0 +1,79 @@
+# -*- encoding: UTF-8 -*-
+import sys
+import threading
+import types
+
+import pandas as pd
+
+import rate_limiter
+import settings
+from strategy_scheduler import ProcessStrategyScheduler, StrategyScheduler, resource_class_of
+
+
+def make_strategy(module_name, resource_class, result):
+    module = types.ModuleType(module_name)
+    if resource_class is not None:
+        module.RESOURCE_CLASS = resource_class
+
+    def check_enter(code_name, data, end_date=None):
+        module.threads.add(threading.current_thread().name)
+        return result(code_name, data)
+
+    check_enter.__module__ = module_name
+    module.check_enter = check_enter
+    module.threads = set()
+    sys.modules[module_name] = module
+    return check_enter
+
+
+def check(stock_info, strategy_func, end_date):
+    code, name, data = stock_info
+    return (code, name), strategy_func((code, name), data, end_date=end_date)
+
+
+def test_strategies_are_routed_by_resource_class(monkeypatch):
+    monkeypatch.setattr(settings, 'get_config', lambda: {'rate_limits': {'strategy': {'rate': 600, 'burst': 2}}})
+    rate_limiter.reset()
+    cpu = make_strategy('fake_cpu_strategy', 'cpu', lambda cn, df: cn[0] == '000001')
+    undeclared = make_strategy('fake_plain_strategy', None, lambda cn, df: len(df) > 1)
+    network = make_strategy('fake_network_strategy', 'network', lambda cn, df: True)
+    strategies = {'cpu': cpu, 'plain': undeclared, 'net': network}
+
+    assert resource_class_of(undeclared) == 'cpu'
+    data = pd.DataFrame({'收盘': [1.0, 2.0]})
+    with StrategyScheduler(strategies, check, workers={'cpu': 2}) as scheduler:
+        assert set(scheduler.groups) == {'cpu', 'network'}
+        futures = [f for code in ('000001', '600000') for f in scheduler.submit(code, code, data, None)]
+        results = sorted(r for f in futures for r in f.result())
+
+    assert results == [('cpu', False), ('cpu', True), ('net', True), ('net', True), ('plain', True), ('plain', True)]
+    assert all(t.startswith('strategy-cpu') for t in sys.modules['fake_cpu_strategy'].threads)
+    assert all(t.startswith('strategy-network') for t in sys.modules['fake_network_strategy'].threads)
+    assert rate_limiter.stats()['strategy']['calls'] == 2
+    stats = scheduler.stats()
+    assert stats['cpu']['completed'] == 2 and stats['cpu']['queued'] == 0
+    assert stats['cpu']['workers'] == 2
+    rate_limiter.reset()
+
+
+def rising_close(code_name, data, end_date=None):
+    return bool(data['收盘'].iloc[-1] > data['收盘'].iloc[0])
+
+
+def test_process_backend_reads_bars_from_shared_memory():
+    frames = {
+        '000001': pd.DataFrame({'日期': pd.bdate_range('2025-01-01', periods=3), '开盘': 1.0, '收盘': [1.0, 2.0, 3.0],
+                                '最高': 3.0, '最低': 0.5, '成交量': 100.0, '成交额': 1e6, '换手率': 1.0}),
+        '600000': pd.DataFrame({'日期': pd.bdate_range('2025-01-01', periods=2), '开盘': 1.0, '收盘': [2.0, 1.0],
+                                '最高': 3.0, '最低': 0.5, '成交量': 100.0, '成交额': 1e6, '换手率': 1.0}),
+    }
+    with ProcessStrategyScheduler({'rising': rising_close}, check, processes=2, batch_size=4) as scheduler:
+        assert scheduler.pools['cpu']._max_workers == 2
+        futures = {code: scheduler.submit(code, code, df, None)[0] for code, df in frames.items()}
+        assert not any(f.done() for f in futures.values())  # batch not full yet
+        scheduler.flush()
+        results = {code: f.result(timeout=30) for code, f in futures.items()}
+        assert scheduler.stats()['cpu']['completed'] == 2
+
+    assert results == {'000001': [('rising', True)], '600000': [('rising', False)]}
+    assert not scheduler._blocks
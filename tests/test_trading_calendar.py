@@ -0,0 +1,29 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+
+import pandas as pd
+
+from trading_calendar import TradingCalendar
+
+# 2025-10-01 ~ 2025-10-08 is the National Day holiday
+SESSIONS = [d for d in pd.bdate_range('2025-09-22', '2025-10-17') if not (pd.Timestamp('2025-10-01') <= d <= pd.Timestamp('2025-10-08'))]
+
+
+def test_last_completed_session_respects_close_time_and_holidays():
+    calendar = TradingCalendar(SESSIONS)
+
+    assert calendar.last_completed_session(datetime.datetime(2025, 10, 9, 14, 59)) == pd.Timestamp('2025-09-30')
+    assert calendar.last_completed_session(datetime.datetime(2025, 10, 9, 15, 5)) == pd.Timestamp('2025-10-09')
+    assert calendar.last_completed_session(datetime.datetime(2025, 10, 4, 10, 0)) == pd.Timestamp('2025-09-30')
+    # Monday before the close: Friday's bar is the latest one
+    assert calendar.last_completed_session(datetime.datetime(2025, 10, 13, 9, 30)) == pd.Timestamp('2025-10-10')
+
+
+def test_session_lookups():
+    calendar = TradingCalendar(SESSIONS)
+
+    assert not calendar.is_session('2025-10-06')
+    assert calendar.next_session('2025-09-30') == pd.Timestamp('2025-10-09')
+    assert calendar.previous_session('2025-10-09') == pd.Timestamp('2025-09-30')
+    assert list(calendar.sessions_between('2025-09-29', '2025-10-10')) == [
+        pd.Timestamp(d) for d in ('2025-09-29', '2025-09-30', '2025-10-09', '2025-10-10')]
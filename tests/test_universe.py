@@ -0,0 +1,91 @@
+# -*- encoding: UTF-8 -*-
+import numpy as np
+import pandas as pd
+import talib as tl
+
+import universe
+from market_panel import MarketPanel
+from strategy import climax_limitdown, enter, high_tight_flag, keep_increasing, turtle_trade
+
+PORTS = {
+    'turtle_trade': turtle_trade.check_enter,
+    'high_tight_flag': high_tight_flag.check,
+    'keep_increasing': keep_increasing.check,
+    'climax_limitdown': climax_limitdown.check,
+    'check_volume': enter.check_volume,
+}
+
+
+def make_market(n_stocks=200, seed=2):
+    """Stocks with frequent limit moves and volume spikes, some with gaps, of varying age."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2024-01-01', periods=160)
+    frames = {}
+    for i in range(n_stocks):
+        n = int(rng.integers(10, len(dates)))
+        steps = rng.choice([0.0, 0.1, -0.1, 0.02, -0.02, 0.05, -0.05], size=n, p=[.2, .15, .1, .2, .15, .1, .1])
+        close = np.round(10 * np.cumprod(1 + steps + rng.choice([0, 0.01, 0.03])), 2)
+        open_ = np.round(close * (1 + rng.normal(0, 0.02, n)), 2)
+        volume = rng.choice([1e5, 5e5, 3e6], size=n, p=[.6, .3, .1])
+        days = np.sort(rng.choice(len(dates), size=n, replace=False)) if i % 3 == 0 else np.arange(len(dates) - n, len(dates))
+        frames[f"{i:06d}"] = pd.DataFrame({'日期': dates[days], '开盘': open_, '收盘': close,
+                                           '最高': np.maximum(close, open_) * 1.01, '最低': np.minimum(close, open_) * 0.99,
+                                           '成交量': volume, '成交额': close * volume * 100, '换手率': 1.0})
+    return frames, dates
+
+
+def expected_results(frames, as_of):
+    """{port: {code: result of the per-stock check on the original float64 frame}}."""
+    expected = {name: {} for name in PORTS}
+    for code, frame in frames.items():
+        data = frame.copy()
+        data['p_change'] = tl.ROC(data['收盘'], 1)
+        for name, check in PORTS.items():
+            if as_of is not None and data['日期'].iloc[0] > as_of:
+                expected[name][code] = False
+                continue
+            try:
+                expected[name][code] = bool(check((code, code), data.copy(), end_date=as_of))
+            except IndexError:  # the runner counts a failing check as no match
+                expected[name][code] = False
+    return expected
+
+
+def test_vectorized_ports_match_per_stock_checks():
+    frames, dates = make_market()
+    panel = MarketPanel.from_frames(frames)
+    hits = dict.fromkeys(PORTS, 0)
+    for as_of in (None, dates[120]):
+        results = universe.evaluate({name: universe.vectorized_form(func) for name, func in PORTS.items()}, panel, as_of)
+        for name, expected in expected_results(frames, as_of).items():
+            hits[name] += sum(expected.values())
+            for code, value in expected.items():
+                assert results[name][code] == value, (name, code, as_of)
+    # Every port is exercised on matching stocks too
+    assert all(hits.values()), hits
+
+
+def test_ports_agree_exactly_at_thresholds():
+    # 3.00 -> 3.06 is a 2% rise and 4.00 -> 3.62 a 9.5% fall in float64, but not in float32
+    dates = pd.bdate_range('2024-01-01', periods=70)
+    frames = {}
+    for code, last_close in (('000001', 3.06), ('000002', 3.62)):
+        close = np.full(len(dates), 3.0 if code == '000001' else 4.0)
+        close[-1] = last_close
+        volume = np.full(len(dates), 1e6)
+        volume[-1] = 1e8
+        frames[code] = pd.DataFrame({'日期': dates, '开盘': close, '收盘': close, '最高': close, '最低': close,
+                                     '成交量': volume, '成交额': close * volume * 100, '换手率': 1.0})
+    results = universe.evaluate({name: universe.vectorized_form(PORTS[name]) for name in ('check_volume', 'climax_limitdown')},
+                                MarketPanel.from_frames(frames))
+    expected = expected_results(frames, None)
+    assert expected['check_volume']['000001'] and not expected['climax_limitdown']['000002']
+    for name in ('check_volume', 'climax_limitdown'):
+        assert results[name] == expected[name], name
+
+
+def test_vectorized_form_lookup():
+    per_stock, vectorized = universe.split_strategies({'海龟': turtle_trade.check_enter, '放量': enter.check_volume,
+                                                       '均线': enter.check_ma})
+    assert vectorized == {'海龟': turtle_trade.check_universe, '放量': enter.check_volume_universe}
+    assert per_stock == {'均线': enter.check_ma}
@@ -0,0 +1,22 @@
+# -*- encoding: UTF-8 -*-
+import pandas as pd
+
+import work_flow_new
+
+
+def test_result_matrix_has_one_row_per_stock_and_one_column_per_strategy():
+    results = {('000001', '平安银行'): {'A': True, 'B': 0}, ('600000', '浦发银行'): {}}
+    matrix = work_flow_new.result_matrix(results, ['A', 'B'])
+
+    assert list(matrix.index) == ['000001 平安银行', '600000 浦发银行']
+    assert list(matrix.columns) == ['A', 'B']
+    assert matrix.dtypes.eq(bool).all()
+    assert matrix.loc['000001 平安银行'].tolist() == [True, False]
+    assert not matrix.loc['600000 浦发银行'].any()
+
+
+def test_validate_stock_data_rejects_incomplete_frames():
+    complete = pd.DataFrame({column: [1.0] for column in work_flow_new.REQUIRED_COLUMNS})
+    assert work_flow_new.validate_stock_data('000001', 'a', complete)
+    assert not work_flow_new.validate_stock_data('000001', 'a', complete.drop(columns=['换手率']))
+    assert not work_flow_new.validate_stock_data('000001', 'a', complete.iloc[:0])
@@ -0,0 +1,136 @@
+# trading_calendar.py
+# -*- encoding: UTF-8 -*-
+"""
+SSE/SZSE trading calendar used for cache freshness and scheduling decisions.
+
+The session list comes from `ak.tool_trade_date_hist_sina()` (it covers the whole
+current year) and is persisted to `{data_dir}/trade_calendar.parquet`, so it is
+downloaded at most once a year. When neither the cache nor the upstream is available
+a Monday-Friday calendar is used instead.
+"""
+import datetime
+import logging
+import os
+import threading
+
+import akshare as ak
+import numpy as np
+import pandas as pd
+
+import rate_limiter
+import settings
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_FILE = "trade_calendar.parquet"
+# Daily bars of a session are considered complete from this hour on
+SESSION_CLOSE_HOUR = 15
+
+_calendars = {}
+_lock = threading.Lock()
+
+
+def _to_day(value):
+    return np.datetime64(pd.Timestamp(value).date(), 'D')
+
+
+class TradingCalendar:
+    """Sorted array of trading sessions with O(log n) lookups."""
+
+    def __init__(self, sessions, approximate=False):
+        self.sessions = np.unique(np.asarray(sessions, dtype='datetime64[D]'))
+        # True when built from weekdays only (holidays unknown)
+        self.approximate = approximate
+
+    def covers(self, day):
+        return len(self.sessions) > 0 and self.sessions[0] <= _to_day(day) <= self.sessions[-1]
+
+    def is_session(self, day):
+        day = _to_day(day)
+        i = np.searchsorted(self.sessions, day)
+        return i < len(self.sessions) and self.sessions[i] == day
+
+    def previous_session(self, day):
+        """Last session strictly before `day`."""
+        i = np.searchsorted(self.sessions, _to_day(day), side='left')
+        return pd.Timestamp(self.sessions[i - 1]) if i > 0 else None
+
+    def next_session(self, day):
+        """First session strictly after `day`."""
+        i = np.searchsorted(self.sessions, _to_day(day), side='right')
+        return pd.Timestamp(self.sessions[i]) if i < len(self.sessions) else None
+
+    def session_on_or_before(self, day):
+        i = np.searchsorted(self.sessions, _to_day(day), side='right')
+        return pd.Timestamp(self.sessions[i - 1]) if i > 0 else None
+
+    def last_completed_session(self, now=None):
+        """The latest session whose daily bar is final at `now` (defaults to the current time)."""
+        now = now or datetime.datetime.now()
+        today = now.date()
+        if self.is_session(today) and now.hour >= SESSION_CLOSE_HOUR:
+            return pd.Timestamp(today)
+        return self.previous_session(today)
+
+    def sessions_between(self, start, end):
+        """Sessions in the closed interval [start, end] as a DatetimeIndex."""
+        lo = np.searchsorted(self.sessions, _to_day(start), side='left')
+        hi = np.searchsorted(self.sessions, _to_day(end), side='right')
+        return pd.DatetimeIndex(self.sessions[lo:hi])
+
+
+def _weekday_calendar(start="2000-01-01", end=None):
+    end = end or datetime.date(datetime.date.today().year, 12, 31)
+    return TradingCalendar(pd.bdate_range(start, end).values, approximate=True)
+
+
+def _download_sessions():
+    df = rate_limiter.call('calendar', ak.tool_trade_date_hist_sina)
+    return pd.to_datetime(df['trade_date']).values
+
+
+def get_calendar(cache_dir=None):
+    """Returns the process-wide calendar, loading it from disk or AKShare only when needed."""
+    cache_dir = cache_dir or settings.get_config().get('data_dir', 'stock_data_cache')
+    today = datetime.date.today()
+
+    with _lock:
+        calendar = _calendars.get(cache_dir)
+        if calendar is not None and calendar.covers(today):
+            return calendar
+
+        file_path = os.path.join(cache_dir, CALENDAR_FILE)
+        if os.path.exists(file_path):
+            try:
+                calendar = TradingCalendar(pd.read_parquet(file_path)['trade_date'].values)
+            except Exception as e:
+                logger.warning(f"读取交易日历缓存 {file_path} 失败: {e}", extra={'stock': 'NONE', 'strategy': '交易日历'})
+                calendar = None
+
+        if calendar is None or not calendar.covers(today):
+            try:
+                sessions = _download_sessions()
+                os.makedirs(cache_dir, exist_ok=True)
+                pd.DataFrame({'trade_date': sessions}).to_parquet(file_path, index=False)
+                calendar = TradingCalendar(sessions)
+                logger.info(f"已更新交易日历，共 {len(calendar.sessions)} 个交易日，截至 {calendar.sessions[-1]}。", extra={'stock': 'NONE', 'strategy': '交易日历'})
+            except Exception as e:
+                if calendar is None or not calendar.covers(today):
+                    logger.warning(f"获取交易日历失败: {e}，将按工作日近似（无法识别节假日）。", extra={'stock': 'NONE', 'strategy': '交易日历'})
+                    calendar = _weekday_calendar()
+
+        _calendars[cache_dir] = calendar
+        return calendar
+
+
+def session_close(day):
+    """The time from which the daily bar of session `day` is final."""
+    return datetime.datetime.combine(pd.Timestamp(day).date(), datetime.time(SESSION_CLOSE_HOUR))
+
+
+def last_completed_session(now=None, cache_dir=None):
+    return get_calendar(cache_dir).last_completed_session(now)
+
+
+def is_trading_day(day=None, cache_dir=None):
+    return get_calendar(cache_dir).is_session(day or datetime.date.today())
@@ -0,0 +1,65 @@
+# universe.py
+# -*- encoding: UTF-8 -*-
+"""
+Cross-sectional (whole-market) strategy interface.
+
+Besides its per-stock check `check(code_name, data, end_date)`, a strategy module
+may provide a vectorized form working on a MarketPanel:
+
+    def check_universe(panel, as_of=None, threshold=60):
+        return bool ndarray aligned with panel.codes
+
+`check_universe` stands for the module's `check` / `check_enter`; another check
+`foo` is vectorized as `foo_universe`. Runners call vectorized_form() and, when one
+exists, evaluate the whole market in a few array operations instead of one
+DataFrame per stock. Results must match the per-stock check on the same bars.
+"""
+import sys
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+PRIMARY_CHECKS = ('check', 'check_enter')
+
+
+def vectorized_form(strategy_func):
+    """The check_universe counterpart of a per-stock strategy function, or None."""
+    module = sys.modules.get(getattr(strategy_func, '__module__', None) or '')
+    name = getattr(strategy_func, '__name__', '')
+    universe_func = getattr(module, f"{name}_universe", None)
+    if universe_func is None and name in PRIMARY_CHECKS:
+        universe_func = getattr(module, 'check_universe', None)
+    return universe_func if callable(universe_func) else None
+
+
+def split_strategies(strategies):
+    """{name: func} -> ({name: per-stock func}, {name: check_universe func})."""
+    per_stock, vectorized = {}, {}
+    for strategy_name, strategy_func in strategies.items():
+        universe_func = vectorized_form(strategy_func)
+        if universe_func is not None:
+            vectorized[strategy_name] = universe_func
+        else:
+            per_stock[strategy_name] = strategy_func
+    return per_stock, vectorized
+
+
+def evaluate(vectorized, panel, as_of=None):
+    """Runs every check_universe on `panel`; returns {strategy_name: {code: bool}}."""
+    results = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for strategy_name, universe_func in vectorized.items():
+            mask = np.asarray(universe_func(panel, as_of), dtype=bool)
+            results[strategy_name] = dict(zip(panel.codes, mask.tolist()))
+    return results
+
+
+def pct_change(bars):
+    """Per-bar % change of (stocks × n) bars, as `tl.ROC(close, 1)`; (stocks × n-1), always float64."""
+    bars = np.asarray(bars, dtype=np.float64)
+    return (bars[:, 1:] / bars[:, :-1] - 1.0) * 100.0
+
+
+def rolling_mean(bars, window):
+    """`tl.MA(values, window)` of (stocks × n) bars for the n-window+1 complete windows, in float64."""
+    return sliding_window_view(np.asarray(bars, dtype=np.float64), window, axis=1).mean(axis=-1)
@@ -1,7 +1,14 @@
 # -*- coding: UTF-8 -*-
 import datetime
 
+import trading_calendar
+
 
 # 是否是工作日
 def is_weekday():
-    return datetime.datetime.today().weekday() < 5
\ No newline at end of file
+    return datetime.datetime.today().weekday() < 5
+
+
+# 是否是交易日（按沪深交易日历，节假日休市）
+def is_trading_day():
+    return trading_calendar.is_trading_day()
@@ -101,7 +101,14 @@
 # -*- encoding: UTF-8 -*-
 
 import data_fetcher
+import feature_store
+import funnel
+import indicator_state
+import rule_engine
 import settings
+import snapshot_cache
+import universe
+from market_panel import MarketPanel
 import strategy.enter as enter
 from strategy import turtle_trade, climax_limitdown
 from strategy import backtrace_ma250
@@ -121,7 +128,7 @@ titleMsg = "************************ 旧策略 ************************"
 def prepare():
     global titleMsg  # 声明 titleMsg 为全局变量以便修改
     logging.info("************************ process start ***************************************")
-    all_data = ak.stock_zh_a_spot_em()
+    all_data = snapshot_cache.spot_snapshot()
     # 选择需要的列
     filtered_subset = all_data[['代码', '名称', '总市值']]
 
@@ -163,31 +170,41 @@ def prepare():
     else:
         push.strategy("无符合条件的策略结果")
 
+    feature_store.log_stats()
+    feature_store.save()
+    indicator_state.log_stats()
+    indicator_state.save()
+    rule_engine.log_stats()
+    rule_engine.save()
+    funnel.log_stats()
+    funnel.reset()
     logging.info("************************ process   end ***************************************")
 
 def process(stocks, strategies):
+    global titleMsg
     stocks_data = data_fetcher.run(stocks)
-    for strategy, strategy_func in strategies.items():
-        check(stocks_data, strategy, strategy_func)
-        time.sleep(2)
-
-def check(stocks_data, strategy, strategy_func):
-    global titleMsg  # 声明 titleMsg 为全局变量以便追加
-    end = settings.config['end_date']
-    m_filter = check_enter(end_date=end, strategy_fun=strategy_func)
-    results = dict(filter(m_filter, stocks_data.items()))
-    if len(results) > 0:
-        # 将策略结果追加到 titleMsg，而不是直接推送
-        titleMsg += '\n**************"{0}"**************\n{1}\n'.format(strategy, list(results.keys()))
-
-def check_enter(end_date=None, strategy_fun=enter.check_volume):
-    def end_date_filter(stock_data):
-        if end_date is not None:
-            if end_date < stock_data[1].iloc[0].日期:  # 该股票在end_date时还未上市
-                logging.debug("{}在{}时还未上市".format(stock_data[0], end_date))
-                return False
-        return strategy_fun(stock_data[0], stock_data[1], end_date=end_date)
-    return end_date_filter
+    end = settings.get_config()['end_date']
+    # 提供 check_universe 的策略对全市场一次性计算 (见 universe.py)，其余逐只运行
+    per_stock, vectorized = universe.split_strategies(strategies)
+    universe_results = {}
+    if vectorized:
+        panel = MarketPanel.from_frames(stocks_data)
+        universe_results = universe.evaluate(vectorized, panel, as_of=end)
+    # 每只股票只遍历一次：上市日期只判断一次，然后在同一份数据上运行全部策略
+    matrix = {}
+    for code_name, data in stocks_data.items():
+        row = {strategy: results.get(code_name[0], False) for strategy, results in universe_results.items()}
+        if end is not None and end < data.iloc[0].日期:
+            logging.debug("{}在{}时还未上市".format(code_name, end))
+            matrix[code_name] = {**dict.fromkeys(strategies, False), **row}
+            continue
+        row.update({strategy: bool(strategy_func(code_name, data, end_date=end))
+                    for strategy, strategy_func in per_stock.items()})
+        matrix[code_name] = row
+    for strategy in strategies:
+        results = [code_name for code_name, row in matrix.items() if row[strategy]]
+        if len(results) > 0:
+            titleMsg += '\n**************"{0}"**************\n{1}\n'.format(strategy, results)
 
 # 统计数据
 def statistics(all_data, stocks):
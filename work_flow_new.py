@@ -1,16 +1,26 @@
 # work_flow_new.py
 # -*- encoding: UTF-8 -*-
 import data_fetcher_new
+import feature_store
+import funnel
+import indicator_state
+import profiler
+import rule_engine
+import rate_limiter
+import replay
 import settings
+import snapshot_cache
+import strategy_scheduler
+import trading_calendar
+import universe
 import akshare as ak # Keep this import, as akshare is used here now
 import push
+from market_panel import MarketPanel
 import logging
-import datetime
 import pandas as pd
 import time
 import random
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from ratelimit import limits, sleep_and_retry
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
 import sys
 from tqdm import tqdm
 import importlib
@@ -109,7 +119,7 @@ def fetch_top_list_stocks():
     Returns a set of stock codes (strings) or an empty set on failure.
     """
     try:
-        df = ak.stock_lhb_stock_statistic_em(symbol="近三月")
+        df = replay.lhb_statistic("近三月")
         if not df.empty and '买方机构次数' in df.columns and '代码' in df.columns:
             df['买方机构次数'] = pd.to_numeric(df['买方机构次数'], errors='coerce').fillna(0)
             mask = (df['买方机构次数'] > 1)  # 机构买入次数大于1
@@ -128,8 +138,13 @@ def prepare():
     titleMsg = ""
     selected_limit_up_stocks = []
     logger.info("Process start", extra={'stock': 'NONE', 'strategy': 'NONE'})
+    profiler.start('work_flow_new')
     try:
-        all_data = ak.stock_zh_a_spot_em()
+        spot_bars = settings.get_config().get('daily_bar_source', 'spot') == 'spot'
+        with profiler.stage('spot'):
+            # A snapshot that becomes daily bars must have been taken after the close of the last completed session
+            fetched_after = trading_calendar.session_close(trading_calendar.last_completed_session(replay.now())) if spot_bars else None
+            fetched_at, all_data = replay.spot_entry(fetched_after)
         logger.info(f"股票总的数量是： {len(all_data)} 只股票。", extra={'stock': 'NONE', 'strategy': '所有数据'})
 
         required_cols = {'代码', '名称', '总市值', '涨跌幅', '成交额', '换手率', '最新价'}
@@ -138,6 +153,15 @@ def prepare():
             logger.error(f"ak.stock_zh_a_spot_em() 返回的数据缺少必要列: {missing_cols}。请检查AKShare数据源。", extra={'stock': 'NONE', 'strategy': '数据获取'})
             return "", []
 
+        # Today's bar for every cached stock comes from the snapshot; per-stock history calls are left for backfills
+        if spot_bars:
+            data_cache_dir = settings.get_config().get('data_dir', 'stock_data_cache')
+            try:
+                with profiler.stage('ingest'):
+                    data_fetcher_new.ingest_spot_snapshot(all_data, cache_dir=data_cache_dir, fetched_at=fetched_at)
+            except Exception as e:
+                logger.error(f"实时行情快照入库失败: {e}\n{traceback.format_exc()}，将回退到逐只下载。", extra={'stock': 'NONE', 'strategy': '快照入库'})
+
         logger.info("正在应用初步筛选条件...")
         for col in ['总市值', '涨跌幅', '成交额', '换手率', '最新价']:
             if col in all_data.columns:
@@ -164,7 +188,8 @@ def prepare():
 
         final_stocks_df_for_processing = pd.DataFrame()
 
-        top_list_codes = fetch_top_list_stocks()
+        with profiler.stage('lhb'):
+            top_list_codes = fetch_top_list_stocks()
 
         if top_list_codes:
             logger.info(f"已获取 {len(top_list_codes)} 个龙虎榜股票代码用于进一步筛选。", extra={'stock': 'NONE', 'strategy': '龙虎榜'})
@@ -217,127 +242,191 @@ def prepare():
                 push.strategy("Warning: No strategies were discovered. Check logs.")
             return "", []
 
-        if datetime.datetime.now().weekday() == 0:
-            pass
-
         titleMsg, selected_limit_up_stocks = process(stocks, strategies, titleMsg, selected_limit_up_stocks)
 
         logger.info(f"符合涨停板次日溢价策略的股票：{len(selected_limit_up_stocks)} 只", extra={'stock': 'NONE', 'strategy': '涨停板次日溢价'})
 
-        if selected_limit_up_stocks and datetime.datetime.now().weekday() == 0 and settings.get_config().get('run_limit_up_backtest', True):
+        if selected_limit_up_stocks and replay.now().weekday() == 0 and settings.get_config().get('run_limit_up_backtest', True):
             logger.info("开始回测涨停板次日溢价策略", extra={'stock': 'NONE', 'strategy': '限价板回测'})
             try:
                 import strategy.new_limit_up as new_limit_up
-                backtest_results = backtest_selected_stocks(selected_limit_up_stocks, new_limit_up)
+                with profiler.stage('backtest'):
+                    backtest_results = backtest_selected_stocks(selected_limit_up_stocks, new_limit_up)
                 titleMsg += format_backtest_results(backtest_results)
             except ImportError:
                 logger.error("Could not import 'newStrategy.limit_up'. Backtest skipped.", extra={'stock': 'NONE', 'strategy': '限价板回测'})
             except Exception as e:
                 logger.error(f"涨停板次日溢价回测失败: {e}\n{traceback.format_exc()}", extra={'stock': 'NONE', 'strategy': '限价板回测'})
 
-        if titleMsg:
-            max_length = 4000
-            print(titleMsg)
-            if settings.get_config().get('push', {}).get('enable', False):
-                if len(titleMsg) > max_length:
-                    chunks = [titleMsg[i:i+max_length] for i in range(0, len(titleMsg), max_length)]
-                    for chunk in chunks:
-                        push.strategy(chunk)
-                else:
-                    push.strategy(titleMsg)
-        else:
-            if settings.get_config().get('push', {}).get('enable', False):
-                push.strategy("无符合条件的策略结果")
+        with profiler.stage('push'):
+            if titleMsg:
+                max_length = 4000
+                print(titleMsg)
+                if settings.get_config().get('push', {}).get('enable', False):
+                    if len(titleMsg) > max_length:
+                        chunks = [titleMsg[i:i+max_length] for i in range(0, len(titleMsg), max_length)]
+                        for chunk in chunks:
+                            push.strategy(chunk)
+                    else:
+                        push.strategy(titleMsg)
+            else:
+                if settings.get_config().get('push', {}).get('enable', False):
+                    push.strategy("无符合条件的策略结果")
 
     except Exception as e:
         logger.exception(f"程序执行失败: {e}\n{traceback.format_exc()}", extra={'stock': 'NONE', 'strategy': 'NONE'})
         if settings.get_config().get('push', {}).get('enable', False):
             push.strategy(f"程序执行失败: {e}")
 
+    rate_limiter.log_stats()
+    snapshot_cache.log_stats()
+    feature_store.log_stats()
+    feature_store.save()
+    indicator_state.log_stats()
+    indicator_state.save()
+    rule_engine.log_stats()
+    rule_engine.save()
+    funnel.log_stats()
+    profiler.attach('rate_limits', rate_limiter.stats())
+    profiler.attach('funnel', funnel.get_funnel().table())
+    profiler.attach('rules', {name: engine.funnel() for name, engine in rule_engine.engines().items()})
+    funnel.reset()
+    profiler.finish()
     logger.info("Process end", extra={'stock': 'NONE', 'strategy': 'NONE'})
     return titleMsg, selected_limit_up_stocks
 
-@sleep_and_retry
-@limits(calls=10, period=60) # Limit to 10 calls per 60 seconds
+REQUIRED_COLUMNS = {'日期', '收盘', '开盘', '最高', '最低', '成交量', '成交额', '换手率'}
+
+
+def validate_stock_data(code, name, data):
+    """
+    Checks a stock's frame once before any strategy sees it. Returns False if it cannot
+    be evaluated (empty or missing columns); NaNs in key columns are only reported.
+    """
+    if data is None or data.empty or not REQUIRED_COLUMNS.issubset(data.columns):
+        logger.warning(f"[{name}({code})]: 传入策略的数据不完整或为空，跳过。", extra={'stock': code, 'strategy': '数据校验'})
+        return False
+    for col in ['收盘', '成交量', '成交额', '换手率']:
+        if data[col].isnull().any():
+            logger.warning(f"[{name}({code})]: 传入策略的数据在列 '{col}' 包含NaN值。可能影响策略判断。", extra={'stock': code, 'strategy': '数据校验'})
+    return True
+
+
 def call_strategy_check(stock_info, strategy_func, end_date):
-    """Calls a single strategy's check_enter function for a given stock."""
+    """Calls a single strategy's check_enter function for a stock already passed through validate_stock_data."""
     stock_code, stock_name, stock_data_df = stock_info
-
     try:
-        # Phase 3, Item 7: Basic data validation before passing to strategy
-        # This is an additional check, as data_fetcher_new also performs validation
-        if stock_data_df.empty or not {'日期', '收盘', '开盘', '最高', '最低', '成交量', '成交额', '换手率'}.issubset(stock_data_df.columns):
-            logger.warning(f"[{stock_name}({stock_code})]: 传入策略的数据不完整或为空，跳过。", extra={'stock': stock_code, 'strategy': strategy_func.__module__})
-            return (stock_code, stock_name), False
-
-        # Check for NaN in critical columns (e.g., '收盘', '成交量')
-        for col in ['收盘', '成交量', '成交额', '换手率']:
-            if col in stock_data_df.columns and stock_data_df[col].isnull().any():
-                logger.warning(f"[{stock_name}({stock_code})]: 传入策略的数据在列 '{col}' 包含NaN值。可能影响策略判断。", extra={'stock': stock_code, 'strategy': strategy_func.__module__})
-                # Option: You might choose to drop NaNs or fill them here, depending on strategy's tolerance
-                # stock_data_df.dropna(subset=[col], inplace=True)
-                # stock_data_df[col].fillna(method='ffill', inplace=True) # or .fillna(0, inplace=True)
-
         result = strategy_func((stock_code, stock_name), stock_data_df, end_date=end_date)
         return (stock_code, stock_name), result
     except Exception as e:
         logger.error(f"策略函数 {strategy_func.__name__} 执行失败 for {stock_name}({stock_code}): {e}\n{traceback.format_exc()}", extra={'stock': stock_code, 'strategy': strategy_func.__module__})
         return (stock_code, stock_name), False
 
-def process(stocks, strategies, titleMsg, selected_limit_up_stocks):
-    """Processes stocks through the discovered strategies."""
-    try:
-        logger.info(f"开始获取 {len(stocks)} 支股票的历史数据...", extra={'stock': 'NONE', 'strategy': '数据获取'})
-
-        # Access data_dir from settings for caching
-        data_cache_dir = settings.get_config().get('data_dir', 'stock_data_cache')
-        stocks_data_dict = data_fetcher_new.run(stocks, cache_dir=data_cache_dir)
-
-        logger.info(f"历史数据获取完成，成功获取 {len(stocks_data_dict)} 支股票数据。", extra={'stock': 'NONE', 'strategy': '数据获取'})
 
-        # Always use current date as the analysis end date
-        end_date_str = datetime.datetime.now().strftime('%Y-%m-%d')
-        end_date_ts = pd.Timestamp(end_date_str)
-        logger.info(f"当前分析日期为: {end_date_ts.strftime('%Y-%m-%d')} (基于实时时间)", extra={'stock': 'NONE', 'strategy': '日期'})
+def result_matrix(results, strategy_names):
+    """
+    {(code, name): {strategy_name: result}} -> bool DataFrame, one row per evaluated
+    stock (index 'code name'), one column per strategy.
+    """
+    index = [f"{code} {name}" for code, name in results]
+    rows = [[bool(stock_results.get(strategy_name, False)) for strategy_name in strategy_names]
+            for stock_results in results.values()]
+    return pd.DataFrame(rows, index=pd.Index(index, name='股票'), columns=list(strategy_names), dtype=bool)
 
-        # Access max_workers from settings if you add it to config.yaml
-        max_workers = settings.get_config().get('max_workers', 5) # Default to 5 if not in config
 
-        for strategy_name, strategy_func in strategies.items():
-            # You might want to filter strategies based on settings here too
-            # E.g., if strategy_name not in settings.get_config().get('enabled_strategies', strategies.keys()): continue
+def evaluate(stocks, strategies, end_date):
+    """
+    Streams the stocks' history and visits each stock once: its frame is validated,
+    then every strategy runs against it (see strategy_scheduler.py for how checks are
+    routed). Strategies with a check_universe form (universe.py) run once over a
+    MarketPanel of all valid stocks after the stream ends. Returns the stock × strategy
+    result matrix (see result_matrix()) and {'code name': frame} of the stocks matched
+    by at least one strategy.
+    """
+    config = settings.get_config()
+    per_stock, vectorized = universe.split_strategies(strategies)
+    results = {}
+    valid_frames = {}
+    matched_frames = {}
+    fetched_count = 0
+
+    def collect(futures):
+        for future in futures:
+            code, name, data = pending.pop(future)
+            try:
+                for strategy_name, result in future.result():
+                    results[(code, name)][strategy_name] = result
+                    if result:
+                        matched_frames[f"{code} {name}"] = data
+                        logger.info(f"股票 {name} ({code}) 符合策略 [{strategy_name}]", extra={'stock': code, 'strategy': strategy_name})
+            except Exception as exc:
+                logger.error(f"处理股票 {name}({code}) 时发生异常: {exc}\n{traceback.format_exc()}", extra={'stock': code, 'strategy': 'NONE'})
+            progress.update(1)
+
+    pending = {}
+    stream = replay.stream(stocks, cache_dir=config.get('data_dir', 'stock_data_cache'),
+                           max_workers=config.get('fetch_concurrency', 5),
+                           timeout=config.get('fetch_timeout'),
+                           maxsize=config.get('stream_queue_size', 64))
+    scheduler = strategy_scheduler.StrategyScheduler.from_config(per_stock, call_strategy_check)
+    with scheduler, tqdm(total=len(stocks) * len(scheduler.groups), desc="Fetching & evaluating",
+                         unit="check", file=sys.stdout) as progress:
+        for (code, name), data in stream:
+            fetched_count += 1
+            results[(code, name)] = {}
+            if not validate_stock_data(code, name, data):
+                progress.update(len(scheduler.groups))
+                continue
+            if vectorized:
+                valid_frames[(code, name)] = data
+            for future in scheduler.submit(code, name, data, end_date):
+                pending[future] = (code, name, data)
+            # Results and progress come in as checks finish; full pools hold the fetch back
+            if pending and len(pending) >= scheduler.capacity * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            else:
+                collect([f for f in list(pending) if f.done()])
+        scheduler.flush()
+        collect(list(as_completed(list(pending))))
+
+    logger.info(f"历史数据获取完成，成功获取 {fetched_count} 支股票数据。", extra={'stock': 'NONE', 'strategy': '数据获取'})
+    scheduler.log_stats()
+    profiler.attach('scheduler', scheduler.stats())
+
+    if valid_frames:
+        with profiler.stage('universe'):
+            panel = MarketPanel.from_frames(valid_frames)
+            universe_results_by_strategy = universe.evaluate(vectorized, panel, as_of=end_date)
+        for strategy_name, universe_results in universe_results_by_strategy.items():
+            for (code, name), data in valid_frames.items():
+                if universe_results.get(code, False):
+                    results[(code, name)][strategy_name] = True
+                    matched_frames[f"{code} {name}"] = data
+                    logger.info(f"股票 {name} ({code}) 符合策略 [{strategy_name}]", extra={'stock': code, 'strategy': strategy_name})
+    return result_matrix(results, list(strategies)), matched_frames
 
-            logger.info(f"开始运行策略: {strategy_name}", extra={'stock': 'NONE', 'strategy': strategy_name})
 
-            current_strategy_results = {}
+def process(stocks, strategies, titleMsg, selected_limit_up_stocks):
+    """
+    Processes stocks through the discovered strategies as a stream: each stock is
+    evaluated as soon as its data is loaded from the cache or downloaded, while the
+    remaining downloads continue, so a run takes about max(fetch, evaluate).
+    Per-strategy reports are read off the stock × strategy matrix from evaluate().
+    """
+    try:
+        logger.info(f"开始获取 {len(stocks)} 支股票的历史数据，获取与策略计算同时进行...", extra={'stock': 'NONE', 'strategy': '数据获取'})
 
-            # Filter stocks_data_dict for those with actual data before processing
-            processable_stocks_data = {cn: df for cn, df in stocks_data_dict.items() if not df.empty}
-            if not processable_stocks_data:
-                logger.warning(f"No processable stock data for strategy '{strategy_name}'. Skipping.", extra={'stock': 'NONE', 'strategy': strategy_name})
-                continue
+        # Always use current date as the analysis end date (the recorded one when replaying)
+        end_date_str = replay.now().strftime('%Y-%m-%d')
+        end_date_ts = pd.Timestamp(end_date_str)
+        logger.info(f"当前分析日期为: {end_date_ts.strftime('%Y-%m-%d')} (基于实时时间)", extra={'stock': 'NONE', 'strategy': '日期'})
 
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                future_to_stock_info = {
-                    executor.submit(call_strategy_check, (code_name[0], code_name[1], data), strategy_func, end_date_ts): code_name
-                    for code_name, data in processable_stocks_data.items()
-                }
-
-                for future in tqdm(as_completed(future_to_stock_info),
-                                   total=len(future_to_stock_info),
-                                   desc=f"Running {strategy_name.ljust(20)}", # Pad for better tqdm display
-                                   unit="stock",
-                                   file=sys.stdout # Ensure tqdm prints to stdout without interfering with logs
-                                   ):
-                    original_code_name_tuple = future_to_stock_info[future]
-                    try:
-                        (code, name), result = future.result()
-                        if result:
-                            current_strategy_results[f"{code} {name}"] = stocks_data_dict[(code, name)]
-                            logger.info(f"股票 {name} ({code}) 符合策略 [{strategy_name}]", extra={'stock': code, 'strategy': strategy_name})
-                    except Exception as exc:
-                        logger.error(f"处理股票 {original_code_name_tuple[1]}({original_code_name_tuple[0]}) 时发生异常: {exc}\n{traceback.format_exc()}", extra={'stock': original_code_name_tuple[0], 'strategy': strategy_name})
+        with profiler.stage('evaluate'):
+            matrix, matched_frames = evaluate(stocks, strategies, end_date_ts)
 
+        for strategy_name in matrix.columns:
+            current_strategy_results = {key: matched_frames[key] for key in matrix.index[matrix[strategy_name]]}
             logger.info(f"策略 [{strategy_name}] 运行完成，找到 {len(current_strategy_results)} 支符合条件的股票。", extra={'stock': 'NONE', 'strategy': strategy_name})
 
             if len(current_strategy_results) > 0:
@@ -472,8 +561,10 @@ def format_backtest_results(backtest_results):
 def backtest_selected_stocks(selected_stocks, limit_up_module):
     """Runs backtests for the selected limit up stocks."""
     backtest_results = {}
-    start_date = '20240101'
-    end_date = datetime.datetime.now().strftime('%Y%m%d')
+    calendar = trading_calendar.get_calendar(settings.get_config().get('data_dir', 'stock_data_cache'))
+    # Backtest over whole sessions only: from the first session of 2024 to the last completed one
+    start_date = calendar.next_session('2023-12-31').strftime('%Y%m%d')
+    end_date = calendar.last_completed_session(replay.now()).strftime('%Y%m%d')
 
     logger.info(f"进行涨停板次日溢价回测，日期范围: {start_date} 至 {end_date}", extra={'stock': 'NONE', 'strategy': '限价板回测'})
 
@@ -483,7 +574,8 @@ def backtest_selected_stocks(selected_stocks, limit_up_module):
             stats = limit_up_module.backtest(code_name_str, data, start_date, end_date)
             backtest_results[code_name_str] = stats
             logger.info(f"回测 {code_name_str} 完成: 胜率={stats.get('胜率', 0):.2%}, 平均收益率={stats.get('平均收益率', 0):.2%}", extra={'stock': symbol, 'strategy': '限价板回测'})
-            time.sleep(random.uniform(0.1, 0.5))
+            if not replay.is_playback():
+                time.sleep(random.uniform(0.1, 0.5))
         except Exception as e:
             logger.error(f"回测 {code_name_str} 失败: {e}\n{traceback.format_exc()}", extra={'stock': symbol, 'strategy': '限价板回测'})
     return backtest_results